@@ -7,7 +7,8 @@ from app.models import Base
 
 config = context.config
 config.set_main_option("sqlalchemy.url", settings.database_url)
-if config.config_file_name is not None:
+# Not when run from the application (app.database.upgrade_db), which has its own logging setup
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 target_metadata = Base.metadata
 
@@ -0,0 +1,32 @@
+"""Per-host rate limiter / circuit breaker state.
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "002"
+down_revision: Union[str, None] = "001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "host_limits",
+        sa.Column("host", sa.String(255), nullable=False),
+        sa.Column("rate", sa.Float(), nullable=False),
+        sa.Column("failures", sa.Integer(), nullable=False),
+        sa.Column("error_rate", sa.Float(), nullable=False),
+        sa.Column("open_until", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("host"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("host_limits")
@@ -0,0 +1,25 @@
+"""Per-search check interval and index for the "next due" query.
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "003"
+down_revision: Union[str, None] = "002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("searches", sa.Column("check_interval", sa.Integer(), nullable=True))
+    op.create_index("ix_searches_due", "searches", ["is_active", "blocked_until", "last_check_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_searches_due", "searches")
+    op.drop_column("searches", "check_interval")
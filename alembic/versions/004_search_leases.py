@@ -0,0 +1,29 @@
+"""Leases for distributing searches between check workers.
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "004"
+down_revision: Union[str, None] = "003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("searches", sa.Column("next_check_at", sa.DateTime(), nullable=True))
+    op.add_column("searches", sa.Column("lease_owner", sa.String(64), nullable=True))
+    op.add_column("searches", sa.Column("lease_until", sa.DateTime(), nullable=True))
+    op.create_index("ix_searches_next_check", "searches", ["is_active", "next_check_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_searches_next_check", "searches")
+    op.drop_column("searches", "lease_until")
+    op.drop_column("searches", "lease_owner")
+    op.drop_column("searches", "next_check_at")
@@ -0,0 +1,69 @@
+"""seen_ads retention: last_seen_at, index for per-search compaction, optional hash partitioning.
+
+The global ix_seen_ads_avito_ad_id is dropped: every lookup is per search and is served by
+uq_search_avito_ad. Set SEEN_ADS_PARTITIONS=N (PostgreSQL only) to rebuild the table as N hash
+partitions by search_id; the default 0 leaves it a plain table.
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-18
+
+"""
+import os
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "005"
+down_revision: Union[str, None] = "004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _partition() -> None:
+    partitions = int(os.environ.get("SEEN_ADS_PARTITIONS", "0"))
+    if partitions <= 0 or op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE seen_ads RENAME TO seen_ads_old")
+    op.execute("ALTER TABLE seen_ads_old RENAME CONSTRAINT uq_search_avito_ad TO uq_search_avito_ad_old")
+    op.execute("ALTER INDEX ix_seen_ads_search_last_seen RENAME TO ix_seen_ads_search_last_seen_old")
+    # The partition key must be part of every unique constraint, hence the (search_id, id) primary key
+    op.execute(
+        """
+        CREATE TABLE seen_ads (
+            id SERIAL,
+            search_id INTEGER NOT NULL REFERENCES searches (id) ON DELETE CASCADE,
+            avito_ad_id VARCHAR(64) NOT NULL,
+            first_seen_at TIMESTAMP WITHOUT TIME ZONE,
+            last_seen_at TIMESTAMP WITHOUT TIME ZONE,
+            PRIMARY KEY (search_id, id),
+            CONSTRAINT uq_search_avito_ad UNIQUE (search_id, avito_ad_id)
+        ) PARTITION BY HASH (search_id)
+        """
+    )
+    for i in range(partitions):
+        op.execute(
+            f"CREATE TABLE seen_ads_p{i} PARTITION OF seen_ads FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+        )
+    op.execute(
+        "INSERT INTO seen_ads (id, search_id, avito_ad_id, first_seen_at, last_seen_at) "
+        "SELECT id, search_id, avito_ad_id, first_seen_at, last_seen_at FROM seen_ads_old"
+    )
+    op.execute("SELECT setval(pg_get_serial_sequence('seen_ads', 'id'), COALESCE(MAX(id), 1)) FROM seen_ads")
+    op.execute("DROP TABLE seen_ads_old")
+    op.create_index("ix_seen_ads_search_last_seen", "seen_ads", ["search_id", "last_seen_at"], unique=False)
+
+
+def upgrade() -> None:
+    op.add_column("seen_ads", sa.Column("last_seen_at", sa.DateTime(), nullable=True))
+    op.execute("UPDATE seen_ads SET last_seen_at = first_seen_at")
+    op.drop_index("ix_seen_ads_avito_ad_id", "seen_ads")
+    op.create_index("ix_seen_ads_search_last_seen", "seen_ads", ["search_id", "last_seen_at"], unique=False)
+    _partition()
+
+
+def downgrade() -> None:
+    # A partitioned table keeps its partitions; only the columns and indexes are reverted
+    op.drop_index("ix_seen_ads_search_last_seen", "seen_ads")
+    op.create_index("ix_seen_ads_avito_ad_id", "seen_ads", ["avito_ad_id"], unique=False)
+    op.drop_column("seen_ads", "last_seen_at")
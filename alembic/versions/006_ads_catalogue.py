@@ -0,0 +1,50 @@
+"""Ad catalogue (latest fields per Avito id) and append-only price history.
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "006"
+down_revision: Union[str, None] = "005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ads",
+        sa.Column("avito_id", sa.String(64), nullable=False),
+        sa.Column("title", sa.Text(), nullable=False),
+        sa.Column("price", sa.Integer(), nullable=True),
+        sa.Column("url", sa.Text(), nullable=False),
+        sa.Column("location", sa.String(255), nullable=True),
+        sa.Column("published_at", sa.DateTime(), nullable=True),
+        sa.Column("image_url", sa.Text(), nullable=True),
+        sa.Column("first_seen_at", sa.DateTime(), nullable=True),
+        sa.Column("last_seen_at", sa.DateTime(), nullable=True),
+        sa.Column("price_changed_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("avito_id"),
+    )
+    op.create_index("ix_ads_last_seen_at", "ads", ["last_seen_at"], unique=False)
+    op.create_table(
+        "ad_prices",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("avito_id", sa.String(64), nullable=False),
+        sa.Column("price", sa.Integer(), nullable=True),
+        sa.Column("seen_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["avito_id"], ["ads.avito_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_ad_prices_ad_seen", "ad_prices", ["avito_id", "seen_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ad_prices_ad_seen", "ad_prices")
+    op.drop_table("ad_prices")
+    op.drop_index("ix_ads_last_seen_at", "ads")
+    op.drop_table("ads")
@@ -0,0 +1,34 @@
+"""Search quotas: per-user search_count and a global counters table, backfilled from searches.
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "008"
+down_revision: Union[str, None] = "007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("search_count", sa.Integer(), server_default="0", nullable=False))
+    op.execute(
+        "UPDATE users SET search_count = (SELECT count(*) FROM searches WHERE searches.user_id = users.id)"
+    )
+    op.create_table(
+        "counters",
+        sa.Column("name", sa.String(64), nullable=False),
+        sa.Column("value", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.execute("INSERT INTO counters (name, value) SELECT 'searches', count(*) FROM searches")
+
+
+def downgrade() -> None:
+    op.drop_table("counters")
+    op.drop_column("users", "search_count")
@@ -0,0 +1,125 @@
+"""Parsed search links: canonical URL, min price, decoded filters, region and category on searches.
+
+The backfill parses the links with a frozen copy of app.search_url as it was at this revision, so
+later changes to the application's parsing do not change what this migration writes.
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-18
+
+"""
+import base64
+import binascii
+import json
+import re
+from typing import Sequence, Union
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlunparse
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "009"
+down_revision: Union[str, None] = "008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ("canonical_url", "min_price", "filters", "region", "category")
+
+AVITO_DOMAINS = ("avito.ru", "www.avito.ru", "m.avito.ru")
+_F_BLOB_RE = re.compile(r"eyJ[A-Za-z0-9+/=_-]+")
+
+
+def _is_avito_host(host: str) -> bool:
+    return any(host == d or host.endswith("." + d) for d in AVITO_DOMAINS)
+
+
+def _decode_f(f_value: str) -> dict:
+    match = _F_BLOB_RE.search(f_value.replace("~", ""))
+    if not match:
+        return {}
+    b64 = match.group(0)
+    b64 += "=" * (-len(b64) % 4)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(b64.replace("+", "-").replace("/", "_")).decode("utf-8"))
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _price(values: list[str] | None) -> float | None:
+    if not values:
+        return None
+    try:
+        return float(values[0].replace(" ", "").replace(",", "."))
+    except (ValueError, TypeError):
+        return None
+
+
+def _filter_price(filters: dict, key: str) -> float | None:
+    try:
+        return float(filters[key]) if key in filters else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _canonical(parsed) -> str:
+    scheme, netloc = parsed.scheme.lower(), parsed.netloc.lower()
+    if (parsed.hostname or "").lower() in AVITO_DOMAINS[:2]:
+        scheme, netloc = "https", "www.avito.ru"
+    path = parsed.path.rstrip("/") or "/"
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if not k.startswith("utm_"))
+    return urlunparse((scheme, netloc, path, "", urlencode(query), ""))
+
+
+def _parse(url: str) -> dict:
+    """The stored fields of a search link; raises ValueError if it is not a URL at all."""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    qs = parse_qs(parsed.query)
+    filters = _decode_f(qs["f"][0]) if qs.get("f") else {}
+    min_price = _price(qs.get("minPrice") or qs.get("min_price"))
+    if min_price is None:
+        min_price = _filter_price(filters, "from")
+    segments = [s for s in parsed.path.split("/") if s]
+    region = category = None
+    if segments and _is_avito_host(host):
+        region = segments[0]
+        category = "/".join(segments[1:]) or None
+    return {
+        "canonical_url": _canonical(parsed),
+        "min_price": min_price,
+        "filters": filters or None,
+        "region": region,
+        "category": category,
+    }
+
+
+def upgrade() -> None:
+    op.add_column("searches", sa.Column("canonical_url", sa.Text(), nullable=True))
+    op.add_column("searches", sa.Column("min_price", sa.Numeric(12, 2), nullable=True))
+    op.add_column("searches", sa.Column("filters", sa.JSON(), nullable=True))
+    op.add_column("searches", sa.Column("region", sa.String(64), nullable=True))
+    op.add_column("searches", sa.Column("category", sa.String(255), nullable=True))
+
+    searches = sa.table(
+        "searches",
+        sa.column("id", sa.Integer()),
+        sa.column("search_url", sa.Text()),
+        sa.column("canonical_url", sa.Text()),
+        sa.column("min_price", sa.Numeric(12, 2)),
+        sa.column("filters", sa.JSON()),
+        sa.column("region", sa.String(64)),
+        sa.column("category", sa.String(255)),
+    )
+    conn = op.get_bind()
+    for search_id, url in conn.execute(sa.select(searches.c.id, searches.c.search_url)).all():
+        try:
+            fields = _parse(url)
+        except ValueError:
+            continue
+        conn.execute(searches.update().where(searches.c.id == search_id).values(**fields))
+
+
+def downgrade() -> None:
+    for column in reversed(COLUMNS):
+        op.drop_column("searches", column)
@@ -0,0 +1,22 @@
+"""seen_ads: index on avito_ad_id again, for fanning out price drops to every search that saw the ad.
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = "010"
+down_revision: Union[str, None] = "009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_seen_ads_avito_ad_id", "seen_ads", ["avito_ad_id"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_seen_ads_avito_ad_id", "seen_ads")
@@ -0,0 +1,32 @@
+"""searches: AUTOINCREMENT on SQLite, so the id of a deleted search is never given to a new one.
+
+Workers key their seen-ad cache, and the outbox its idempotency keys, by search id. PostgreSQL
+sequences never hand out an id twice; SQLite reuses the highest rowid after it is deleted.
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+revision: str = "011"
+down_revision: Union[str, None] = "010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _recreate(autoincrement: bool) -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    with op.batch_alter_table("searches", recreate="always", table_kwargs={"sqlite_autoincrement": autoincrement}):
+        pass
+
+
+def upgrade() -> None:
+    _recreate(True)
+
+
+def downgrade() -> None:
+    _recreate(False)
@@ -1,9 +1,77 @@
-"""Minimal FastAPI app for health check."""
-from fastapi import FastAPI
+"""
+FastAPI app: health check, Prometheus metrics and, with BOT_MODE=webhook, the Telegram webhook
+(the bot's handlers then run in this process and share its DB pool).
+"""
+import hmac
+import logging
+from contextlib import asynccontextmanager
 
-app = FastAPI(title="Avito Monitor", version="0.1.0")
+from fastapi import FastAPI, Request, Response
+
+from config import settings
+from app.metrics import mark_process_dead, render
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        if settings.bot_mode == "webhook":
+            async with _webhook(app):
+                yield
+        else:
+            yield
+    finally:
+        mark_process_dead()
+
+
+@asynccontextmanager
+async def _webhook(app: FastAPI):
+    """BOT_MODE=webhook: the bot's handlers run in this process."""
+    from app.bot.setup import make_bot, make_update_dispatcher
+    from app.bot.webhook import make_update_queue, set_webhook
+    from app.database import async_engine
+
+    bot = make_bot()
+    dp = make_update_dispatcher()
+    app.state.updates = make_update_queue(bot, dp)
+    app.state.updates.start()
+    try:
+        await set_webhook(bot, dp)
+        yield
+    finally:
+        await app.state.updates.stop()
+        await bot.session.close()
+        await async_engine.dispose()
+
+
+app = FastAPI(title="Avito Monitor", version="0.1.0", lifespan=lifespan)
 
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition; includes the bot/monitor process when PROMETHEUS_MULTIPROC_DIR is shared."""
+    body, content_type = render()
+    return Response(content=body, media_type=content_type)
+
+
+if settings.bot_mode == "webhook":
+    from app.bot.webhook import SECRET_HEADER, check_webhook_settings
+
+    check_webhook_settings()
+
+    @app.post(settings.webhook_path, include_in_schema=False)
+    async def telegram_webhook(request: Request):
+        """Queue the update and answer at once; 503 makes Telegram resend it while the queue is full."""
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret, settings.webhook_secret):
+            return Response(status_code=403)
+        if not request.app.state.updates.submit(await request.json()):
+            return Response(status_code=503)
+        return Response(status_code=200)
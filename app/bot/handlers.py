@@ -5,7 +5,12 @@ from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import CommandStart, Command
 
-from app.services import ensure_user, add_search, list_user_searches, delete_search
+from app.services import (
+    ensure_user_id_async,
+    add_search_async,
+    list_user_searches_async,
+    delete_search_by_number_async,
+)
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -15,7 +20,7 @@ router = Router()
 async def cmd_start(message: Message) -> None:
     if not message.from_user:
         return
-    ensure_user(message.from_user.id)
+    await ensure_user_id_async(message.from_user.id)
     await message.answer(
         "Привет! Я бот мониторинга объявлений Avito.\n\n"
         "Добавить поиск: /add_search\n"
@@ -39,7 +44,7 @@ async def cmd_add_search(message: Message) -> None:
     if len(parts) >= 2 and parts[1].startswith("http"):
         url = parts[1].strip()
         name = (parts[2].strip()[:200]) if len(parts) > 2 else "Поиск"
-        success, msg, _ = add_search(message.from_user.id, url, name)
+        success, msg, _ = await add_search_async(message.from_user.id, url, name)
         await message.answer(msg)
         return
     await message.answer(
@@ -56,7 +61,7 @@ async def cmd_add_search(message: Message) -> None:
 async def cmd_my_searches(message: Message) -> None:
     if not message.from_user:
         return
-    searches = list_user_searches(message.from_user.id)
+    searches = await list_user_searches_async(message.from_user.id)
     if not searches:
         await message.answer("У вас пока нет сохранённых поисков. Добавьте: /add_search")
         return
@@ -86,12 +91,7 @@ async def cmd_delete_search(message: Message) -> None:
     except ValueError:
         await message.answer("Укажите номер цифрой, например: /delete_search 1")
         return
-    searches = list_user_searches(message.from_user.id)
-    if num < 1 or num > len(searches):
-        await message.answer(f"Нет поиска с номером {num}. Ваши номера: 1–{len(searches)}. Список: /my_searches")
-        return
-    search_id = searches[num - 1]["id"]
-    ok, msg = delete_search(message.from_user.id, search_id)
+    ok, msg = await delete_search_by_number_async(message.from_user.id, num)
     await message.answer(msg)
 
 
@@ -108,5 +108,5 @@ async def handle_search_link(message: Message) -> None:
         url = parts[0].strip()
         if parts[1].strip():
             name = parts[1].strip()[:200]
-    success, msg, _ = add_search(message.from_user.id, url, name)
+    success, msg, _ = await add_search_async(message.from_user.id, url, name)
     await message.answer(msg)
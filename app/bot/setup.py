@@ -0,0 +1,21 @@
+"""Bot and update dispatcher, shared by polling (app.main) and webhook mode (app.api)."""
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+
+from config import settings
+from app.bot.handlers import router
+
+
+def make_bot() -> Bot:
+    return Bot(
+        token=settings.bot_token,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+
+def make_update_dispatcher() -> Dispatcher:
+    """Dispatcher with the command handlers; the router can be attached to one dispatcher per process."""
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
@@ -0,0 +1,100 @@
+"""Webhook mode: updates posted by Telegram to the API are handled by a bounded pool of tasks."""
+import asyncio
+import logging
+import re
+import time
+from urllib.parse import urlsplit
+
+from aiogram import Bot, Dispatcher
+
+from config import settings
+from app.metrics import BOT_UPDATE_QUEUE_DEPTH, BOT_UPDATE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# What Telegram accepts as secret_token
+_SECRET_RE = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+def check_webhook_settings() -> None:
+    """Exit with the reason unless WEBHOOK_URL, WEBHOOK_PATH and WEBHOOK_SECRET are usable for webhook mode."""
+    url = urlsplit(settings.webhook_url)
+    if url.scheme != "https" or not url.hostname:
+        raise SystemExit(
+            f"BOT_MODE=webhook needs WEBHOOK_URL, the public https:// address of the API, got {settings.webhook_url!r}"
+        )
+    if not settings.webhook_path.startswith("/"):
+        raise SystemExit(f"WEBHOOK_PATH must start with /, got {settings.webhook_path!r}")
+    if not _SECRET_RE.fullmatch(settings.webhook_secret):
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_SECRET: 1-256 characters from A-Z, a-z, 0-9, _ and -")
+
+
+class UpdateQueue:
+    """
+    submit() only queues the raw update, so the webhook request returns at once; `workers` tasks feed
+    the updates to the dispatcher concurrently. When `queue_size` updates are waiting submit() refuses
+    (the endpoint answers 503 and Telegram delivers the update again later).
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, workers: int = 16, queue_size: int = 1000) -> None:
+        self.bot = bot
+        self.dp = dp
+        self.workers = workers
+        self._queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, update: dict) -> bool:
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Update queue full (%s), asking Telegram to resend", self._queue.qsize())
+            return False
+        BOT_UPDATE_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Give queued updates `drain_timeout` seconds to be handled, then cancel the workers."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Update queue not drained, %s left", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self._queue.get()
+            BOT_UPDATE_QUEUE_DEPTH.set(self._queue.qsize())
+            start = time.perf_counter()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Update %s failed: %s", update.get("update_id"), e)
+            finally:
+                BOT_UPDATE_SECONDS.observe(time.perf_counter() - start)
+                self._queue.task_done()
+
+
+async def set_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Point Telegram at WEBHOOK_URL + WEBHOOK_PATH (pending updates are kept)."""
+    url = settings.webhook_url.rstrip("/") + settings.webhook_path
+    await bot.set_webhook(
+        url,
+        secret_token=settings.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=min(100, max(1, settings.webhook_workers)),
+    )
+    logger.info("Webhook set to %s", url)
+
+
+def make_update_queue(bot: Bot, dp: Dispatcher) -> UpdateQueue:
+    return UpdateQueue(bot, dp, workers=settings.webhook_workers, queue_size=settings.webhook_queue_size)
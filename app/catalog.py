@@ -0,0 +1,103 @@
+"""
+Per-cycle upkeep of the ad catalogue (ads / ad_prices) and price-drop detection. A bounded in-memory
+map of the last written price per ad keeps the steady state (same ads, same prices) off the DB.
+"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from config import settings
+from app.metrics import PRICE_DROPS
+from app.parser.avito import ParsedAd
+from app.services import load_ad_prices_async, upsert_ads_async
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class CatalogChanges:
+    """What compare() found: the ads to write (new ads and changed prices in `changed`) and the drops."""
+    write: list[ParsedAd]
+    changed: set[str]
+    # avito_id -> previous price, for ads that got cheaper
+    drops: dict[str, int]
+
+
+class AdCatalog:
+    """
+    compare() takes every ad parsed in a cycle (all pages, before any per-search filtering) and
+    returns the ads to write — new ads, changed prices and, at most every `refresh_seconds` per ad,
+    last_seen_at — with the ads whose price went down; save() writes them. The caller saves only
+    after the price drops are in the outbox, so a drop is never recorded without its notification
+    (one found again by the next cycle or another worker maps to the same outbox key). For ads
+    whose price differs from memory the DB price is re-read first.
+    """
+
+    def __init__(self, max_entries: int, refresh_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        # avito_id -> (price, monotonic time last written)
+        self._known: OrderedDict[str, tuple[int | None, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def _remember(self, avito_id: str, price: int | None, written_at: float) -> None:
+        self._known[avito_id] = (price, written_at)
+        self._known.move_to_end(avito_id)
+        while len(self._known) > self.max_entries:
+            self._known.popitem(last=False)
+
+    async def compare(self, ads: list[ParsedAd]) -> CatalogChanges:
+        """Changes of the cycle's ads against the catalogue; nothing is written."""
+        now = time.monotonic()
+        by_id = {ad.id: ad for ad in ads}
+        suspect: list[str] = []
+        write: list[ParsedAd] = []
+        for avito_id, ad in by_id.items():
+            known = self._known.get(avito_id)
+            if known is None or known[0] != ad.price:
+                suspect.append(avito_id)
+            elif now - known[1] >= self.refresh_seconds:
+                write.append(ad)
+            else:
+                self._known.move_to_end(avito_id)
+
+        changed: set[str] = set()
+        drops: dict[str, int] = {}
+        stored = await load_ad_prices_async(suspect) if suspect else {}
+        utc_now = datetime.utcnow()
+        for avito_id in suspect:
+            ad = by_id[avito_id]
+            if avito_id not in stored:
+                changed.add(avito_id)
+                write.append(ad)
+                continue
+            old_price, last_seen_at = stored[avito_id]
+            if old_price != ad.price:
+                changed.add(avito_id)
+                write.append(ad)
+                if old_price is not None and ad.price is not None and ad.price < old_price:
+                    drops[avito_id] = old_price
+            elif (utc_now - last_seen_at).total_seconds() >= self.refresh_seconds:
+                write.append(ad)
+            else:
+                # Up to date in the DB (written by another worker or before a restart)
+                self._remember(avito_id, ad.price, now)
+        return CatalogChanges(write, changed, drops)
+
+    async def save(self, changes: CatalogChanges) -> None:
+        """Upsert the ads found by compare()."""
+        now = time.monotonic()
+        await upsert_ads_async(changes.write, changes.changed)
+        for ad in changes.write:
+            self._remember(ad.id, ad.price, now)
+        if changes.drops:
+            PRICE_DROPS.inc(len(changes.drops))
+            logger.info("Price dropped for %s ads", len(changes.drops))
+
+
+def make_ad_catalog() -> AdCatalog:
+    return AdCatalog(max_entries=settings.catalog_cache_size, refresh_seconds=settings.catalog_refresh_seconds)
@@ -1,7 +1,11 @@
 """Database session and setup."""
 import logging
-from contextlib import contextmanager
-from sqlalchemy import create_engine
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import AsyncIterator
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 
 from config import settings
@@ -9,20 +13,75 @@ from app.models import Base
 
 logger = logging.getLogger(__name__)
 
+ROOT = Path(__file__).resolve().parent.parent
+# Schema init_db() created before migrations ran at startup
+BASELINE_REVISION = "001"
+
+# Async drivers for the sync URLs used in DATABASE_URL
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def _async_url(url: str) -> str:
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    return parsed.set(drivername=ASYNC_DRIVERS.get(backend, parsed.drivername)).render_as_string(hide_password=False)
+
+
+def _pool_options(url: str) -> dict:
+    """Pool sizing for server databases; SQLite keeps SQLAlchemy's defaults."""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+
+
 engine = create_engine(
     settings.database_url,
     pool_pre_ping=True,
     echo=False,
+    **_pool_options(settings.database_url),
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    _async_url(settings.database_url),
+    pool_pre_ping=True,
+    echo=False,
+    **_pool_options(settings.database_url),
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def init_db() -> None:
-    """Create all tables."""
+    """Create all tables from the models (tests and benchmarks; deployments use upgrade_db)."""
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created")
 
 
+def upgrade_db() -> None:
+    """
+    Migrate the schema to the latest alembic revision (an empty database is created by the
+    migrations). A database made by init_db() in earlier versions has tables but no alembic_version:
+    its schema is BASELINE_REVISION, so it is stamped with it and only the later migrations run.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    cfg = Config(str(ROOT / "alembic.ini"))
+    cfg.set_main_option("script_location", str(ROOT / "alembic"))
+    # Keep the application's logging setup
+    cfg.attributes["configure_logger"] = False
+    tables = set(inspect(engine).get_table_names())
+    if "users" in tables and "alembic_version" not in tables:
+        logger.info("Database has no migration history: stamping revision %s", BASELINE_REVISION)
+        command.stamp(cfg, BASELINE_REVISION)
+    command.upgrade(cfg, "head")
+
+
 @contextmanager
 def get_db() -> Session:
     session = SessionLocal()
@@ -34,3 +93,17 @@ def get_db() -> Session:
         raise
     finally:
         session.close()
+
+
+@asynccontextmanager
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Async counterpart of get_db for the bot handlers and the monitor (never blocks the event loop)."""
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
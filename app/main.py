@@ -1,17 +1,27 @@
-"""Run Telegram bot and APScheduler (async job in same event loop)."""
+"""
+Run Telegram bot and the monitoring pipeline (tasks in the same event loop).
+APP_ROLE=bot / worker runs only one of them, so monitoring can be scaled out to several workers.
+With BOT_MODE=webhook updates go to the API process (app.api) instead of being long-polled here.
+"""
 import asyncio
 import logging
 import sys
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
 
 from config import settings
-from app.bot.handlers import router
-from app.database import init_db
-from app.monitor import _run_check_async
+from app.bot.setup import make_bot, make_update_dispatcher
+from app.bot.webhook import check_webhook_settings
+from app.catalog import make_ad_catalog
+from app.matching import make_ad_matcher
+from app.database import async_engine, upgrade_db
+from app.metrics import CHECK_INTERVAL, mark_process_dead
+from app.monitor import PageChecker, make_fetcher, make_parse_executor
+from app.notifier import make_dispatcher
+from app.pipeline import make_pipeline
+from app.scheduling import make_due_queue, make_lease_queue
+from app.seen_cache import make_seen_cache
+from app.services import compact_ads_async, compact_outbox_async, compact_seen_ads_async, get_active_searches_async
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,32 +30,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ROLES = ("all", "bot", "worker")
+BOT_MODES = ("polling", "webhook")
+
+
+async def _compact_seen_ads() -> None:
+    try:
+        deleted = await compact_seen_ads_async()
+        ads = await compact_ads_async()
+        sent = await compact_outbox_async()
+        if deleted or ads or sent:
+            logger.info(
+                "Compaction: %s seen_ads rows, %s catalogue ads, %s sent notifications deleted", deleted, ads, sent
+            )
+    except Exception as e:
+        logger.exception("Compaction failed: %s", e)
+
 
 async def main() -> None:
-    init_db()
-    bot = Bot(
-        token=settings.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-    dp = Dispatcher()
-    dp.include_router(router)
+    role = settings.app_role
+    if role not in ROLES:
+        raise SystemExit(f"APP_ROLE must be one of {', '.join(ROLES)}, got {role!r}")
+    if settings.bot_mode not in BOT_MODES:
+        raise SystemExit(f"BOT_MODE must be one of {', '.join(BOT_MODES)}, got {settings.bot_mode!r}")
+    if settings.bot_mode == "webhook" and role != "worker":
+        # The API serves the webhook, but a misconfigured one should not leave the bot silently deaf
+        check_webhook_settings()
+    if role != "worker":
+        # Usually already done by app.prestart; a no-op then
+        upgrade_db()
+    CHECK_INTERVAL.set(settings.check_interval)
+    bot = make_bot()
 
+    fetcher = queue = notifier = parser = pipeline = None
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        _run_check_async,
-        "interval",
-        seconds=settings.check_interval,
-        args=[bot],
-        id="avito_check",
-    )
+    if role != "worker":
+        # One instance only, so scaled-out workers do not compact concurrently
+        scheduler.add_job(
+            _compact_seen_ads,
+            "interval",
+            seconds=settings.seen_compact_interval_seconds,
+            id="seen_ads_compaction",
+            max_instances=1,
+            coalesce=True,
+        )
+    if role != "bot":
+        fetcher = await make_fetcher()
+        parser = make_parse_executor()
+        # A single process keeps its schedule in memory; workers lease searches from the DB
+        queue = make_due_queue() if role == "all" else make_lease_queue()
+        notifier = make_dispatcher(bot)
+        notifier.start()
+        seen = make_seen_cache()
+        await seen.warm_up([s["search_id"] for s in await get_active_searches_async()])
+        checker = PageChecker(fetcher, parser, notifier, seen, make_ad_catalog(), make_ad_matcher())
+        pipeline = make_pipeline(queue, checker)
+        pipeline.start()
+        logger.info(
+            "Check pipeline (%s): each search every %s s (default), %s fetch workers",
+            role, settings.check_interval, pipeline.fetch_workers,
+        )
+
     scheduler.start()
-    logger.info("Scheduler: check every %s s", settings.check_interval)
 
     try:
-        await dp.start_polling(bot)
+        if role == "worker" or settings.bot_mode == "webhook":
+            if role != "worker":
+                logger.info("BOT_MODE=webhook: updates are handled by the API process")
+            await asyncio.Event().wait()
+        else:
+            # A webhook left over from webhook mode would make getUpdates fail
+            await bot.delete_webhook()
+            await make_update_dispatcher().start_polling(bot)
     finally:
         scheduler.shutdown(wait=False)
+        if pipeline is not None:
+            await pipeline.stop(drain_timeout=settings.check_interval)
+            await queue.close()
+            await notifier.stop()
+            await fetcher.close()
+            parser.shutdown()
         await bot.session.close()
+        await async_engine.dispose()
+        mark_process_dead()
 
 
 if __name__ == "__main__":
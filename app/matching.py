@@ -0,0 +1,189 @@
+"""
+Cross-search matching: an ad found on any fetched page is matched against every active search of
+the same family (same region, category and filters apart from price bounds and text query), and
+searches whose page another fetch already covered are not fetched themselves.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from config import settings
+from app.metrics import CROSS_SEARCH_MATCHES
+from app.parser.avito import ParsedAd
+from app.search_url import SearchUrl, parse_search_url
+from app.services import get_active_searches_async
+
+logger = logging.getLogger(__name__)
+
+# Ads on a full Avito search page: a page with fewer lists everything within its filters
+PAGE_SIZE = 50
+
+
+@dataclass(slots=True)
+class _Member:
+    search: dict
+    link: SearchUrl
+    min_price: float | None
+    max_price: float | None
+
+    def matches(self, ad: ParsedAd) -> bool:
+        """
+        For an ad from a page with another text query: price within the search's bounds and every
+        query word in the title (ads without a price never match).
+        """
+        if ad.price is None:
+            return False
+        if (self.max_price is not None and ad.price > self.max_price) or (
+            self.min_price is not None and ad.price < self.min_price
+        ):
+            return False
+        title = ad.title.lower()
+        return all(word in title for word in self.link.words)
+
+
+@dataclass(slots=True)
+class _Cover:
+    """
+    What one recorded page proves: every ad in its price range published since `since` was on it,
+    and was filtered by price for `members` (the searches of its family with the same text query).
+    """
+    query: str | None
+    min_price: float | None
+    max_price: float | None
+    fetched_at: datetime
+    since: datetime
+    members: frozenset[int]
+
+
+def _search_link(search: dict) -> SearchUrl:
+    return parse_search_url(search.get("canonical_url") or search["search_url"])
+
+
+class AdMatcher:
+    """
+    Active searches indexed by family, reloaded every `refresh_seconds`. match() builds the inverted
+    index ad id -> searches for the pages of a cycle; covered() tells whether a search can skip its
+    fetch: a page of its family with the same query and a price range containing the search's was
+    fetched after the search last got ads, was filtered by price for it, and reaches back to then (newest
+    first and its oldest ad older, or not a full page).
+    """
+
+    def __init__(self, refresh_seconds: float) -> None:
+        self.refresh_seconds = refresh_seconds
+        self._families: dict[str, dict[int, _Member]] = {}
+        self._covers: dict[str, dict[str, _Cover]] = {}
+        # search id -> when the ads it was last matched against were fetched
+        self._through: dict[int, datetime] = {}
+        self._loaded_at: float | None = None
+
+    def load(self, searches: list[dict]) -> None:
+        families: dict[str, dict[int, _Member]] = {}
+        for search in searches:
+            link = _search_link(search)
+            member = _Member(search, link, search.get("min_price", link.min_price), search["max_price"])
+            families.setdefault(link.family, {})[search["search_id"]] = member
+            # The DB time is only a starting point: it is set to "now" for covered searches too
+            if search.get("last_check_at") is not None:
+                self._through.setdefault(search["search_id"], search["last_check_at"])
+        active = {search_id for members in families.values() for search_id in members}
+        self._through = {search_id: t for search_id, t in self._through.items() if search_id in active}
+        self._covers = {family: covers for family, covers in self._covers.items() if family in families}
+        self._families = families
+        self._loaded_at = time.monotonic()
+
+    async def refresh(self) -> None:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            self.load(await get_active_searches_async())
+
+    def covered(self, search: dict) -> bool:
+        """True (and the search counts as up to date with that page) if a recorded page covers it."""
+        search_id = search["search_id"]
+        through = self._through.get(search_id)
+        if through is None:
+            return False
+        link = _search_link(search)
+        member = self._families.get(link.family, {}).get(search_id)
+        if member is None:
+            return False
+        for cover in self._covers.get(link.family, {}).values():
+            if (
+                search_id in cover.members
+                and cover.fetched_at > through
+                and cover.since <= through
+                and cover.query == link.query
+                and (cover.min_price is None or (member.min_price is not None and cover.min_price <= member.min_price))
+                and (cover.max_price is None or (member.max_price is not None and cover.max_price >= member.max_price))
+            ):
+                self._through[search_id] = cover.fetched_at
+                return True
+        return False
+
+    def match(
+        self, pages: list[tuple[str, list[dict], list[ParsedAd], datetime]], within
+    ) -> tuple[list[tuple[dict, list[ParsedAd]]], dict[str, set[int]]]:
+        """
+        For the pages (url, subscribers, ads, fetched at): the ads of each search, those of its own
+        page (filtered by `within(ad, search)`) plus matching ads from the other pages of its family,
+        and the inverted index ad id -> search ids. A page with the same text query as the search is
+        filtered by `within` too: Avito already applied the query (also to descriptions, so a title
+        need not contain its words), which keeps a covered search's ads exactly those of its own
+        page. Ads from pages with another query go through _Member.matches().
+        """
+        by_search: dict[int, tuple[dict, dict[str, ParsedAd]]] = {}
+        index: dict[str, set[int]] = {}
+        cross = 0
+
+        def add(search: dict, ad: ParsedAd) -> None:
+            entry = by_search.setdefault(search["search_id"], (search, {}))
+            entry[1].setdefault(ad.id, ad)
+            index.setdefault(ad.id, set()).add(search["search_id"])
+
+        for url, subscribers, ads, _ in pages:
+            own = {s["search_id"] for s in subscribers}
+            for search in subscribers:
+                by_search.setdefault(search["search_id"], (search, {}))
+                for ad in ads:
+                    if within(ad, search):
+                        add(search, ad)
+            if not subscribers:
+                continue
+            link = _search_link(subscribers[0])
+            for search_id, member in self._families.get(link.family, {}).items():
+                if search_id in own:
+                    continue
+                same_query = member.link.query == link.query
+                for ad in ads:
+                    if within(ad, member.search) if same_query else member.matches(ad):
+                        cross += search_id not in index.get(ad.id, ())
+                        add(member.search, ad)
+        if cross:
+            CROSS_SEARCH_MATCHES.inc(cross)
+        return [(search, list(ads.values())) for search, ads in by_search.values()], index
+
+    def recorded(self, pages: list[tuple[str, list[dict], list[ParsedAd], datetime]]) -> None:
+        """After the dedup of these pages (url, subscribers, ads, fetched at) succeeded."""
+        for url, subscribers, ads, fetched_at in pages:
+            if not subscribers:
+                continue
+            link = _search_link(subscribers[0])
+            for search in subscribers:
+                self._through[search["search_id"]] = fetched_at
+            dates = [ad.published_at for ad in ads]
+            # An empty page proves nothing (it may be a captcha or a layout the parser missed)
+            if 0 < len(ads) < PAGE_SIZE:
+                since = datetime.min
+            elif ads and link.sorted_by_date and all(dates):
+                since = min(dates)
+            else:
+                continue
+            family = self._families.get(link.family, {})
+            members = frozenset(i for i, m in family.items() if m.link.query == link.query)
+            members |= {s["search_id"] for s in subscribers}
+            self._covers.setdefault(link.family, {})[url] = _Cover(
+                link.query, link.min_price, link.max_price, fetched_at, since, members
+            )
+
+
+def make_ad_matcher() -> AdMatcher | None:
+    return AdMatcher(refresh_seconds=settings.check_interval) if settings.cross_search_matching else None
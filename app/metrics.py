@@ -0,0 +1,140 @@
+"""
+Prometheus metrics for the hot paths. With PROMETHEUS_MULTIPROC_DIR set (a directory shared by the
+bot and API processes), values from every process are aggregated by the API's /metrics endpoint.
+The directory is cleared once before any process starts (app.prestart), not by the processes
+themselves, and each process removes its live gauges on shutdown (mark_process_dead).
+"""
+import functools
+import inspect
+import os
+import re
+import shutil
+import socket
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    values,
+)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# Every container runs its process as PID 1, so the pid alone would make them share metric files;
+# "_" separates the parts of the file names
+_HOST = re.sub(r"[^A-Za-z0-9.-]", "-", socket.gethostname())
+
+
+def _process_id() -> str:
+    return f"{_HOST}-{os.getpid()}"
+
+
+if MULTIPROC_DIR:
+    # Before any metric is created
+    values.ValueClass = values.MultiProcessValue(_process_id)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+FETCH_SECONDS = Histogram(
+    "avito_fetch_seconds", "Search page fetch latency", ["host", "status"], buckets=LATENCY_BUCKETS
+)
+PROXY_REQUESTS = Counter("avito_proxy_requests_total", "Search page requests per egress", ["egress", "outcome"])
+BLOCKED_RESPONSES = Counter("avito_blocked_responses_total", "403/429 responses", ["status"])
+PAGES_SKIPPED = Counter("avito_pages_skipped_total", "Pages not fetched or not parsed", ["reason"])
+PARSE_SECONDS = Histogram("avito_parse_seconds", "parse_search_page duration", buckets=FAST_BUCKETS)
+ADS_PER_PAGE = Histogram("avito_ads_per_page", "Ads parsed from one page", buckets=(0, 1, 5, 10, 20, 30, 40, 50, 75, 100))
+NEW_ADS = Counter("avito_new_ads_total", "Ads not seen before by their search")
+CROSS_SEARCH_MATCHES = Counter(
+    "avito_cross_search_matches_total", "Ads matched to a search from another page of its family"
+)
+PRICE_DROPS = Counter("avito_price_drops_total", "Catalogue ads whose price went down")
+SEEN_CACHE_LOOKUPS = Counter("avito_seen_cache_lookups_total", "Seen-ad cache answers per ad", ["result"])
+SEEN_CACHE_BYTES = Gauge("avito_seen_cache_bytes", "Approximate size of the seen-ad cache", multiprocess_mode="livesum")
+USER_CACHE_LOOKUPS = Counter("avito_user_cache_lookups_total", "Bot user/search-list cache answers", ["cache", "result"])
+DB_SECONDS = Histogram("avito_db_query_seconds", "Service function duration", ["function"], buckets=FAST_BUCKETS)
+NOTIFY_SECONDS = Histogram(
+    "avito_notification_send_seconds", "Telegram sendMessage latency", ["result"], buckets=LATENCY_BUCKETS
+)
+NOTIFY_QUEUE_DEPTH = Gauge(
+    "avito_notification_queue_depth", "Notifications waiting to be sent", multiprocess_mode="mostrecent"
+)
+BOT_UPDATE_SECONDS = Histogram("avito_bot_update_seconds", "Handling of one Telegram update (webhook mode)", buckets=LATENCY_BUCKETS)
+BOT_UPDATE_QUEUE_DEPTH = Gauge(
+    "avito_bot_update_queue_depth", "Webhook updates waiting for a handler", multiprocess_mode="livesum"
+)
+CYCLE_SECONDS = Histogram("avito_check_cycle_seconds", "Duration of one check cycle", buckets=LATENCY_BUCKETS + (60, 120, 300))
+CHECK_INTERVAL = Gauge("avito_check_interval_seconds", "Configured check interval", multiprocess_mode="mostrecent")
+SCHEDULER_LAG = Gauge("avito_scheduler_lag_seconds", "How long the most overdue search has waited", multiprocess_mode="mostrecent")
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "avito_pipeline_queue_depth", "Pages waiting for a check pipeline stage", ["stage"], multiprocess_mode="livesum"
+)
+PIPELINE_PAGE_SECONDS = Histogram(
+    "avito_pipeline_page_seconds", "From a page being queued to its ads being recorded", buckets=LATENCY_BUCKETS + (60, 120, 300)
+)
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator: observe the duration of a sync or async function into `histogram`."""
+    metric = histogram.labels(**labels) if labels else histogram
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    metric.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+
+    return decorator
+
+
+def db_timed(fn):
+    """timed() on DB_SECONDS, labelled with the function name."""
+    return timed(DB_SECONDS, function=fn.__name__)(fn)
+
+
+def reset_multiprocess_dir() -> None:
+    """Clear values left by previous runs; called once before the processes sharing the directory start."""
+    if MULTIPROC_DIR and os.path.isdir(MULTIPROC_DIR):
+        for name in os.listdir(MULTIPROC_DIR):
+            path = os.path.join(MULTIPROC_DIR, name)
+            if os.path.isfile(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def mark_process_dead() -> None:
+    """Drop this process's live gauges from the shared directory; call on shutdown."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(_process_id())
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition body and content type; aggregates all processes in multiprocess mode."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
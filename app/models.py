@@ -1,6 +1,11 @@
-"""SQLAlchemy models."""
+"""
+SQLAlchemy models.
+
+SQLite does not enforce ON DELETE CASCADE by default, and bulk DELETE statements bypass the ORM
+cascades, so the services delete child rows (seen_ads, ad_prices) explicitly before their parents.
+"""
 from datetime import datetime
-from sqlalchemy import DateTime, ForeignKey, Integer, String, Numeric, Boolean, Text, UniqueConstraint
+from sqlalchemy import JSON, DateTime, Float, ForeignKey, Index, Integer, String, Numeric, Boolean, Text, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -14,6 +19,8 @@ class User(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     telegram_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False, index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Maintained by add/delete search in the same transaction (per-user quota without count(*))
+    search_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0", nullable=False)
 
     searches: Mapped[list["Search"]] = relationship("Search", back_populates="user")
 
@@ -25,23 +32,132 @@ class Search(Base):
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     search_url: Mapped[str] = mapped_column(Text, nullable=False)
     max_price: Mapped[float] = mapped_column(Numeric(12, 2), nullable=False)
+    # Parsed from search_url once, when the search is added (app.search_url)
+    canonical_url: Mapped[str | None] = mapped_column(Text, nullable=True)
+    min_price: Mapped[float | None] = mapped_column(Numeric(12, 2), nullable=True)
+    filters: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    region: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    category: Mapped[str | None] = mapped_column(String(255), nullable=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     last_check_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     blocked_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Seconds between checks; None means settings.check_interval
+    check_interval: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # Work distribution between check workers (APP_ROLE=worker)
+    next_check_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    lease_owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     user: Mapped["User"] = relationship("User", back_populates="searches")
     seen_ads: Mapped[list["SeenAd"]] = relationship("SeenAd", back_populates="search", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_searches_due", "is_active", "blocked_until", "last_check_at"),
+        Index("ix_searches_next_check", "is_active", "next_check_at"),
+        # Ids are never reused (SQLite would give a deleted search's id to the next one): caches
+        # and outbox keys of a deleted search must not apply to a new one
+        {"sqlite_autoincrement": True},
+    )
+
 
 class SeenAd(Base):
     __tablename__ = "seen_ads"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     search_id: Mapped[int] = mapped_column(Integer, ForeignKey("searches.id", ondelete="CASCADE"), nullable=False)
-    avito_ad_id: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    avito_ad_id: Mapped[str] = mapped_column(String(64), nullable=False)
     first_seen_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Refreshed (coarsely) while the ad is still on the page; retention is based on it
+    last_seen_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, default=datetime.utcnow)
 
     search: Mapped["Search"] = relationship("Search", back_populates="seen_ads")
 
-    __table_args__ = (UniqueConstraint("search_id", "avito_ad_id", name="uq_search_avito_ad"),)
+    __table_args__ = (
+        UniqueConstraint("search_id", "avito_ad_id", name="uq_search_avito_ad"),
+        Index("ix_seen_ads_search_last_seen", "search_id", "last_seen_at"),
+        # Price drops are fanned out to every search that has seen the ad
+        Index("ix_seen_ads_avito_ad_id", "avito_ad_id"),
+    )
+
+
+class Ad(Base):
+    """Latest known state of an ad seen on any search page."""
+    __tablename__ = "ads"
+
+    avito_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    title: Mapped[str] = mapped_column(Text, nullable=False)
+    price: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    location: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    published_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    image_url: Mapped[str | None] = mapped_column(Text, nullable=True)
+    first_seen_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_seen_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    price_changed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    prices: Mapped[list["AdPrice"]] = relationship("AdPrice", back_populates="ad", cascade="all, delete-orphan")
+
+
+class AdPrice(Base):
+    """Append-only price history: one row when an ad is first seen and one per price change."""
+    __tablename__ = "ad_prices"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    avito_id: Mapped[str] = mapped_column(String(64), ForeignKey("ads.avito_id", ondelete="CASCADE"), nullable=False)
+    price: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    seen_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    ad: Mapped["Ad"] = relationship("Ad", back_populates="prices")
+
+    __table_args__ = (Index("ix_ad_prices_ad_seen", "avito_id", "seen_at"),)
+
+
+class HostLimit(Base):
+    """Persisted state of the per-host rate limiter / circuit breaker."""
+    __tablename__ = "host_limits"
+
+    host: Mapped[str] = mapped_column(String(255), primary_key=True)
+    rate: Mapped[float] = mapped_column(Float, nullable=False)
+    failures: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    error_rate: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+    open_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class OutboxMessage(Base):
+    """
+    One ad to notify one chat about, written in the same transaction that marks the ad seen and
+    deleted (once sent) by compaction. `key` makes enqueueing idempotent.
+    """
+    __tablename__ = "notification_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(String(160), nullable=False, unique=True)
+    telegram_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    search_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    search_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    kind: Mapped[str] = mapped_column(String(16), nullable=False)
+    avito_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    title: Mapped[str] = mapped_column(Text, nullable=False)
+    price: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    old_price: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    location: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Delivery: due from next_attempt_at, leased by one dispatcher at a time, sent_at once delivered
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    lease_owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (Index("ix_outbox_due", "sent_at", "next_attempt_at"),)
+
+
+class QuotaCounter(Base):
+    """Named counters updated transactionally, e.g. the number of searches on the server."""
+    __tablename__ = "counters"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
@@ -1,85 +1,318 @@
 """Background job: check Avito searches and send Telegram notifications."""
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import time
+from dataclasses import dataclass
+from datetime import datetime
 
-from aiogram import Bot
 from config import settings
-from app.parser.avito import fetch_search_page, parse_search_page
+from app.metrics import ADS_PER_PAGE, BLOCKED_RESPONSES, CYCLE_SECONDS, NEW_ADS, PAGES_SKIPPED, PARSE_SECONDS
+from app.catalog import AdCatalog
+from app.matching import AdMatcher
+from app.notifier import KIND_NEW, KIND_PRICE_DROP, NotificationDispatcher
+from app.parser.avito import ParsedAd
+from app.parser.executor import ParseExecutor
+from app.parser.fetcher import CIRCUIT_OPEN, AsyncFetcher
+from app.parser.proxies import ProxyPool
+from app.parser.ratelimit import HostLimiter
+from app.scheduling import DueQueue, LeaseQueue
+from app.seen_cache import SeenCache
 from app.services import (
-    get_active_searches,
-    get_seen_ad_ids,
-    mark_ad_seen,
-    update_last_check,
-    set_search_blocked,
+    canonical_search_url,
+    get_active_searches_async,
+    get_searches_by_seen_ads_async,
+    filter_unseen_ads_async,
+    outbox_row,
+    update_last_check_many_async,
+    load_host_limits_async,
+    save_host_limits_async,
 )
 
 logger = logging.getLogger(__name__)
 
-BLOCK_DURATION = timedelta(seconds=settings.block_duration_seconds)
 block_count_403 = 0
 block_count_429 = 0
 
 
-async def _run_check_async(bot: Bot) -> None:
-    """Async implementation of check loop."""
-    global block_count_403, block_count_429
-    for search in get_active_searches(limit=settings.max_searches):
-        search_id = search["search_id"]
-        telegram_id = search["telegram_id"]
-        url = search["search_url"]
-        name = search["search_name"]
-        status, html, err = fetch_search_page(url)
-        if err:
-            logger.warning("Search %s fetch error: %s", search_id, err)
-            continue
-        if status == 403:
-            block_count_403 += 1
-            logger.warning(
-                "HTTP 403 for search %s; blocking for %s s (total 403: %s)",
-                search_id, settings.block_duration_seconds, block_count_403,
-            )
-            set_search_blocked(search_id, datetime.utcnow() + BLOCK_DURATION)
-            continue
-        if status == 429:
-            block_count_429 += 1
-            logger.warning(
-                "HTTP 429 for search %s; blocking for %s s (total 429: %s)",
-                search_id, settings.block_duration_seconds, block_count_429,
-            )
-            set_search_blocked(search_id, datetime.utcnow() + BLOCK_DURATION)
-            continue
-        logger.info("Search %s HTTP %s", search_id, status)
+async def make_limiter() -> HostLimiter:
+    """Host limiter configured from settings, with state restored from the DB."""
+    limiter = HostLimiter(
+        initial_rate=settings.host_rate_initial,
+        min_rate=settings.host_rate_min,
+        max_rate=settings.host_rate_max,
+        backoff_base=settings.host_backoff_base_seconds,
+        backoff_max=settings.block_duration_seconds,
+    )
+    try:
+        limiter.restore(await load_host_limits_async())
+    except Exception as e:
+        logger.exception("Could not restore host limiter state: %s", e)
+    return limiter
+
+
+def make_proxy_pool() -> ProxyPool | None:
+    """Pool from PROXIES (comma-separated URLs); None keeps the single direct session."""
+    proxies = [p for p in settings.proxies.split(",") if p.strip()]
+    if not proxies:
+        return None
+    return ProxyPool(proxies, include_direct=settings.proxy_include_direct, per_egress=settings.fetch_per_host_concurrency)
+
+
+def make_parse_executor() -> ParseExecutor:
+    return ParseExecutor(workers=settings.parse_workers)
+
+
+async def make_fetcher(limiter: HostLimiter | None = None) -> AsyncFetcher:
+    proxies = make_proxy_pool()
+    return AsyncFetcher(
+        # Every egress brings its own per-host budget; the overall cap must not undo that
+        concurrency=max(settings.fetch_concurrency, settings.fetch_per_host_concurrency * len(proxies or ())),
+        per_host=settings.fetch_per_host_concurrency,
+        limiter=limiter if limiter is not None else await make_limiter(),
+        proxies=proxies,
+    )
+
+
+def group_by_url(searches: list[dict]) -> dict[str, list[dict]]:
+    """Searches keyed by canonical URL: each distinct page is fetched and parsed once per cycle."""
+    groups: dict[str, list[dict]] = {}
+    for search in searches:
+        url = search.get("canonical_url") or canonical_search_url(search["search_url"])
+        groups.setdefault(url, []).append(search)
+    return groups
+
+
+@dataclass(slots=True)
+class Page:
+    """Outcome of fetching (and parsing) one distinct page."""
+    status: int
+    error: str | None
+    fingerprint: str | None = None
+    # None: not parsed (not a 200, same fingerprint as last time, or parse error)
+    ads: list[ParsedAd] | None = None
+    # Conditional request headers for the next fetch; trusted only once the ads are recorded
+    validators: dict[str, str] | None = None
+    parse_failed: bool = False
+    fetched_at: datetime | None = None
+    # Not fetched: another page of the same family covered all its searches (app.matching)
+    covered: bool = False
+
+
+def _within_price(ad: ParsedAd, search: dict) -> bool:
+    """Within the search's stored price bounds; ads without a price are kept: the search may still be interested."""
+    if ad.price is None:
+        return True
+    max_price, min_price = search["max_price"], search.get("min_price")
+    return (max_price is None or ad.price <= max_price) and (min_price is None or ad.price >= min_price)
+
+
+class PageChecker:
+    """
+    Checks pages for their subscribed searches: fetch() downloads and parses one page, record()
+    dedups a set of fetched pages in bulk and writes the notifications to the outbox in the same
+    transaction. With a seen-ad cache, ads already known are not looked up in the DB; with a
+    catalogue, every parsed ad is recorded and price drops are notified; with a matcher, ads are
+    also matched against the other searches of their family and covered pages are not fetched.
+    """
+
+    def __init__(
+        self,
+        fetcher: AsyncFetcher,
+        parser: ParseExecutor,
+        notifier: NotificationDispatcher,
+        seen: SeenCache | None = None,
+        catalog: AdCatalog | None = None,
+        matcher: AdMatcher | None = None,
+    ) -> None:
+        self.fetcher = fetcher
+        self.parser = parser
+        self.notifier = notifier
+        self.seen = seen
+        self.catalog = catalog
+        self.matcher = matcher
+        # canonical URL -> (fingerprint of the page's ads, search ids that page was processed for,
+        # validators of the response it came from)
+        self._page_state: dict[str, tuple[str, frozenset[int], dict[str, str]]] = {}
+
+    async def check(self, searches: list[dict]) -> None:
+        """One cycle over the given searches."""
+        cycle_start = time.perf_counter()
+        groups = group_by_url(searches)
+        urls = list(groups)
+        if self.matcher is not None:
+            await self.matcher.refresh()
+        pages = await asyncio.gather(*(self.fetch(u, groups[u]) for u in urls))
+        await self.save_host_limits()
+        await self.record([(u, groups[u], page) for u, page in zip(urls, pages)])
+        CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
+
+    async def save_host_limits(self) -> None:
+        if self.fetcher.limiter is not None:
+            await save_host_limits_async(self.fetcher.limiter.snapshot())
+
+    def _known_page(self, url: str, search_ids: list[int]) -> tuple[str, dict[str, str]] | None:
+        """
+        Fingerprint and validators of the page as last processed, if every current subscriber already
+        got its ads (a page with a new subscriber must be downloaded and parsed in full even if it has
+        not changed).
+        """
+        state = self._page_state.get(url)
+        if state is None or not state[1].issuperset(search_ids):
+            return None
+        return state[0], state[2]
+
+    def _is_covered(self, subscribers: list[dict]) -> bool:
+        """Every subscriber of the page already got its ads from another page of its family."""
+        # A list, not a generator: covered() marks each covered search up to date
+        return self.matcher is not None and all([self.matcher.covered(s) for s in subscribers])
+
+    async def fetch(self, url: str, subscribers: list[dict]) -> Page:
+        """Fetch one page and parse it."""
+        if self._is_covered(subscribers):
+            return Page(0, None, covered=True)
+        known_fingerprint, validators = self._known_page(url, [s["search_id"] for s in subscribers]) or (None, None)
+        fetched_at = datetime.utcnow()
+        status, html, err, received = await self.fetcher.fetch_conditional(url, validators)
         if status != 200 or not html:
-            continue
+            return Page(status, err, fetched_at=fetched_at)
         try:
-            ads = parse_search_page(html)
+            fingerprint, ads, seconds = await self.parser.parse(html, known_fingerprint)
         except Exception as e:
-            logger.exception("Parse error for search %s: %s", search_id, e)
-            update_last_check(search_id)
-            continue
-        seen = get_seen_ad_ids(search_id)
-        for ad in ads:
-            if ad.id in seen:
+            logger.exception("Parse error for %s: %s", url, e)
+            return Page(status, None, parse_failed=True, fetched_at=fetched_at)
+        if ads is not None:
+            PARSE_SECONDS.observe(seconds)
+            ADS_PER_PAGE.observe(len(ads))
+        return Page(status, None, fingerprint, ads, received, fetched_at=fetched_at)
+
+    async def record(self, results: list[tuple[str, list[dict], Page]]) -> None:
+        """
+        Dedup the fetched pages (url, subscribers, page) in bulk, write notifications to the outbox
+        and record the checks. With a matcher, each page's ads also go to the other searches of its
+        family that they match.
+        """
+        global block_count_403, block_count_429
+        fetched: list[tuple[str, list[dict], list[ParsedAd], datetime]] = []
+        page_ads: list[ParsedAd] = []
+        checked: list[int] = []
+        fingerprints: dict[str, tuple[str, frozenset[int], dict[str, str]]] = {}
+        skipped = unchanged = 0
+        for url, subscribers, page in results:
+            status, err = page.status, page.error
+            search_ids = [s["search_id"] for s in subscribers]
+            if page.covered:
+                checked.extend(search_ids)
+                PAGES_SKIPPED.labels(reason="covered").inc()
+                continue
+            if err == CIRCUIT_OPEN:
+                skipped += 1
+                PAGES_SKIPPED.labels(reason="circuit_open").inc()
+                continue
+            if err:
+                logger.warning("Searches %s fetch error: %s", search_ids, err)
+                continue
+            if status in (403, 429):
+                # The host limiter has already backed off; the searches are retried once its breaker closes
+                if status == 403:
+                    block_count_403 += 1
+                    total = block_count_403
+                else:
+                    block_count_429 += 1
+                    total = block_count_429
+                BLOCKED_RESPONSES.labels(status=str(status)).inc()
+                logger.warning("HTTP %s for searches %s (total %s: %s)", status, search_ids, status, total)
+                continue
+            logger.info("URL %s HTTP %s (%s searches)", url, status, len(subscribers))
+            if status == 304:
+                checked.extend(search_ids)
+                unchanged += 1
+                PAGES_SKIPPED.labels(reason="not_modified").inc()
+                continue
+            if status != 200 or (page.ads is None and page.fingerprint is None and not page.parse_failed):
+                continue
+            checked.extend(search_ids)
+            if page.parse_failed:
                 continue
-            mark_ad_seen(search_id, ad.id)
-            text = (
-                f"🆕 Новое объявление ({name})\n\n"
-                f"{ad.title}\n"
-                f"Цена: {ad.price}\n"
-                f"{ad.url}\n\n"
-                f"Обнаружено: {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC"
-            )
-            try:
-                await bot.send_message(telegram_id, text, disable_web_page_preview=True)
-            except Exception as e:
-                logger.exception("Send notification failed: %s", e)
-        update_last_check(search_id)
-
-
-def run_check(bot: Bot) -> None:
-    """Fetch active searches, parse pages, notify. Called every CHECK_INTERVAL (sync for APScheduler)."""
+            if page.ads is None:
+                unchanged += 1
+                PAGES_SKIPPED.labels(reason="same_fingerprint").inc()
+                # Same ads as already recorded: the new validators can be trusted
+                if url in self._page_state:
+                    fingerprints[url] = (page.fingerprint, self._page_state[url][1], page.validators or {})
+                continue
+            ads = page.ads
+            if page.fingerprint is not None:
+                fingerprints[url] = (page.fingerprint, frozenset(search_ids), page.validators or {})
+            page_ads.extend(ads)
+            fetched.append((url, subscribers, ads, page.fetched_at or datetime.utcnow()))
+
+        if self.matcher is not None:
+            await self.matcher.refresh()
+            parsed, _ = self.matcher.match(fetched, _within_price)
+        else:
+            parsed = [
+                (search, [ad for ad in ads if _within_price(ad, search)])
+                for _, subscribers, ads, _ in fetched
+                for search in subscribers
+            ]
+
+        if skipped:
+            logger.info("Skipped %s pages: host circuit open", skipped)
+        if unchanged:
+            logger.info("%s pages unchanged since last check", unchanged)
+
+        # All ads of the pages, not only those within max_price: an ad dropping below it then shows its old price
+        changes = await self.catalog.compare(page_ads) if self.catalog is not None else None
+        drops = changes.drops if changes is not None else {}
+        # Every search that was notified of a dropped ad hears of the drop, wherever the ad was found
+        watchers = await get_searches_by_seen_ads_async(list(drops)) if drops and settings.price_drop_alerts else {}
+        dropped = {ad.id: ad for ad in page_ads if ad.id in watchers}
+        now = datetime.utcnow()
+
+        def outbox(new_pairs: set[tuple[int, str]]) -> list[dict]:
+            """Notifications for the new pairs (and price drops of the others), written with the dedup."""
+            rows = [
+                outbox_row(KIND_NEW, search, ad, drops.get(ad.id), now)
+                for search, ads in parsed
+                for ad in ads
+                if (search["search_id"], ad.id) in new_pairs
+            ]
+            for avito_id, searches in watchers.items():
+                ad = dropped[avito_id]
+                rows.extend(
+                    outbox_row(KIND_PRICE_DROP, search, ad, drops[avito_id], now)
+                    for search in searches
+                    if (search["search_id"], avito_id) not in new_pairs and _within_price(ad, search)
+                )
+            return rows
+
+        pairs = ((s["search_id"], ad.id) for s, ads in parsed for ad in ads)
+        new_pairs = await (
+            self.seen.filter_unseen(pairs, outbox) if self.seen is not None else filter_unseen_ads_async(pairs, outbox)
+        )
+        # Only after the dedup succeeded, otherwise a failed cycle would be skipped next time (by the
+        # fingerprint, or by a 304 to the validators of the failed fetch)
+        self._page_state.update(fingerprints)
+        if changes is not None:
+            # Likewise: a price drop not in the outbox must still be a drop next cycle
+            await self.catalog.save(changes)
+        if self.matcher is not None:
+            self.matcher.recorded(fetched)
+        await update_last_check_many_async(checked)
+        NEW_ADS.inc(len(new_pairs))
+        self.notifier.wake()
+
+
+async def run_check_async(checker: PageChecker, queue: DueQueue | LeaseQueue | None = None) -> None:
+    """
+    Check the searches `queue` hands out (due now / leased) with `checker`, or all active searches
+    without a queue. The checker's dispatcher delivers the notifications it wrote to the outbox.
+    """
+    searches = await queue.next_batch() if queue is not None else await get_active_searches_async()
+    if not searches:
+        return
     try:
-        asyncio.run(_run_check_async(bot))
-    except Exception as e:
-        logger.exception("Monitor job failed: %s", e)
+        await checker.check(searches)
+    finally:
+        if queue is not None:
+            await queue.complete(searches)
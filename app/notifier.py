@@ -0,0 +1,326 @@
+"""
+Outbound Telegram notifications: drained from the notification outbox table by a worker pool with
+per-chat/global rate limits, digests and retries.
+"""
+import asyncio
+import html
+import logging
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
+
+from config import settings
+from app.metrics import NOTIFY_QUEUE_DEPTH, NOTIFY_SECONDS
+from app.models import OutboxMessage
+from app.parser.avito import ParsedAd
+from app.services import (
+    claim_outbox_async,
+    drop_outbox_async,
+    mark_outbox_sent_async,
+    release_outbox_async,
+    retry_outbox_async,
+)
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer messages
+MESSAGE_LIMIT = 4096
+RETRY_BASE_SECONDS = 2.0
+
+KIND_NEW = "new"
+KIND_PRICE_DROP = "price_drop"
+# Header of a single-ad message and of a digest, per notification kind
+HEADERS = {
+    KIND_NEW: ("🆕 Новое объявление ({name})", "🆕 Новые объявления ({name}): {count}"),
+    KIND_PRICE_DROP: ("📉 Цена снижена ({name})", "📉 Цены снижены ({name}): {count}"),
+}
+
+
+@dataclass
+class Notification:
+    telegram_id: int
+    search_name: str
+    ads: list[ParsedAd]
+    kind: str = KIND_NEW
+    # Previous price per ad id, shown next to the current one
+    old_prices: dict[str, int] = field(default_factory=dict)
+    # Outbox row of each ad, in the order of `ads`
+    row_ids: list[int] = field(default_factory=list)
+    found_at: datetime | None = None
+    attempts: int = 0
+    # Filled in when the notification is split into messages: (text, outbox rows it covers)
+    messages: list[tuple[str, list[int]]] = field(default_factory=list)
+
+    @property
+    def pending_ids(self) -> list[int]:
+        """Outbox rows not delivered yet."""
+        return [i for _, ids in self.messages for i in ids] if self.messages else list(self.row_ids)
+
+
+def _notifications(rows: list[OutboxMessage]) -> list[Notification]:
+    """Outbox rows grouped per chat, search and kind (one digest each), oldest first."""
+    groups: dict[tuple[int, int, str], Notification] = {}
+    for row in rows:
+        n = groups.get((row.telegram_id, row.search_id, row.kind))
+        if n is None:
+            n = groups[(row.telegram_id, row.search_id, row.kind)] = Notification(
+                row.telegram_id, row.search_name, [], row.kind, found_at=row.created_at
+            )
+        n.ads.append(ParsedAd(row.avito_id, row.title, row.price, row.url, row.location))
+        n.row_ids.append(row.id)
+        if row.old_price is not None:
+            n.old_prices[row.avito_id] = row.old_price
+        n.attempts = max(n.attempts, row.attempts or 0)
+    return list(groups.values())
+
+
+def _format_ad(ad: ParsedAd, old_price: int | None = None) -> str:
+    was = f" (было {old_price:,} ₽)".replace(",", " ") if old_price is not None else ""
+    location = f"\n{html.escape(ad.location)}" if ad.location else ""
+    return f"{html.escape(ad.title)}\nЦена: {ad.price_text}{was}{location}\n{html.escape(ad.url)}"
+
+
+def split_messages(
+    search_name: str,
+    ads: list[ParsedAd],
+    per_message: int,
+    kind: str = KIND_NEW,
+    old_prices: dict[str, int] | None = None,
+    found_at: datetime | None = None,
+) -> list[tuple[str, int]]:
+    """
+    (text, number of ads) per message: one message for a single ad, otherwise digests of up to
+    `per_message` consecutive ads within MESSAGE_LIMIT.
+    """
+    name = html.escape(search_name)
+    old_prices = old_prices or {}
+    single, digest = HEADERS[kind]
+    found = f"Обнаружено: {(found_at or datetime.utcnow()).strftime('%Y-%m-%d %H:%M')} UTC"
+    if len(ads) == 1:
+        block = _format_ad(ads[0], old_prices.get(ads[0].id))
+        return [(f"{single.format(name=name)}\n\n{block}\n\n{found}", 1)]
+    messages: list[tuple[str, int]] = []
+    chunk: list[str] = []
+
+    def flush() -> None:
+        if chunk:
+            header = digest.format(name=name, count=len(chunk))
+            messages.append((header + "\n\n" + "\n\n".join(chunk) + f"\n\n{found}", len(chunk)))
+            chunk.clear()
+
+    for ad in ads:
+        block = _format_ad(ad, old_prices.get(ad.id))
+        size = sum(len(c) + 2 for c in chunk) + len(block) + len(name) + len(found) + 64
+        if len(chunk) >= per_message or (chunk and size > MESSAGE_LIMIT):
+            flush()
+        chunk.append(block[:MESSAGE_LIMIT - len(name) - len(found) - 64])
+    flush()
+    return messages
+
+
+class NotificationDispatcher:
+    """
+    Delivers the notification outbox. A drain task leases due rows (`claim_batch` at a time, only
+    while the local queue is short, so leases are not hoarded) and hands them to `workers` sender
+    tasks as per-chat digests. Rows of delivered messages are marked sent in batches by the drain
+    task (a crash right after a send can repeat that message). Each chat gets at most
+    one message per `per_chat_interval` seconds and the bot as a whole at most `global_rate` per
+    second. TelegramRetryAfter pauses all sending and makes the rows due again after the requested
+    time without counting an attempt; other errors are retried with backoff up to `max_attempts`.
+    Rows of a dispatcher that dies are claimed again once its lease runs out (at-least-once).
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 4,
+        global_rate: float = 25.0,
+        per_chat_interval: float = 1.0,
+        max_attempts: int = 5,
+        ads_per_message: int = 10,
+        owner: str = "dispatcher",
+        claim_batch: int = 200,
+        lease_seconds: int = 300,
+        poll_seconds: float = 1.0,
+    ) -> None:
+        self.bot = bot
+        self.workers = workers
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.ads_per_message = ads_per_message
+        self.owner = owner
+        self.claim_batch = claim_batch
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._queue: asyncio.Queue[Notification] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        # Outbox rows delivered but not marked sent yet
+        self._sent: list[int] = []
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_next: dict[int, float] = {}
+        self._global_lock = asyncio.Lock()
+        self._global_next = 0.0
+        self._paused_until = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._drain()))
+
+    def wake(self) -> None:
+        """New rows were written to the outbox: claim them now rather than at the next poll."""
+        self._wake.set()
+
+    async def join(self) -> None:
+        """Wait until nothing in the outbox is due and everything claimed has been handled."""
+        while True:
+            await self._queue.join()
+            await self._flush_sent()
+            if not await self._claim():
+                return
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Give due notifications `drain_timeout` seconds to go out, then cancel the tasks and release leases."""
+        try:
+            await asyncio.wait_for(self.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Notification queue not drained, %s left", self.depth)
+        except Exception as e:
+            logger.warning("Notification queue not drained: %s", e)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._flush_sent()
+        await self._settle(release_outbox_async(self.owner))
+
+    async def _flush_sent(self) -> None:
+        if self._sent:
+            ids, self._sent = self._sent, []
+            await self._settle(mark_outbox_sent_async(ids))
+
+    async def _claim(self) -> int:
+        """Lease due outbox rows and queue them; returns the number of rows claimed."""
+        async with self._claim_lock:
+            rows = await claim_outbox_async(self.owner, self.claim_batch, self.lease_seconds)
+            for n in _notifications(rows):
+                self._queue.put_nowait(n)
+            NOTIFY_QUEUE_DEPTH.set(self.depth)
+            return len(rows)
+
+    async def _drain(self) -> None:
+        while True:
+            self._wake.clear()
+            await self._flush_sent()
+            if self._queue.qsize() < self.workers:
+                try:
+                    if await self._claim():
+                        # Possibly a backlog: keep claiming as fast as the workers send
+                        continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Outbox claim failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _settle(self, update) -> None:
+        """Outbox bookkeeping after a send; on failure the rows are retried once their lease runs out."""
+        try:
+            await update
+        except Exception as e:
+            logger.warning("Outbox update failed (rows will be resent after their lease): %s", e)
+
+    async def _wait_turn(self, chat_id: int) -> None:
+        now = time.monotonic()
+        wait = max(self._chat_next.get(chat_id, 0.0), self._paused_until) - now
+        if wait > 0:
+            await asyncio.sleep(wait)
+        async with self._global_lock:
+            now = time.monotonic()
+            wait = max(self._global_next, self._paused_until) - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+            self._global_next = now + 1.0 / self.global_rate
+        self._chat_next[chat_id] = now + self.per_chat_interval
+
+    async def _send(self, n: Notification) -> None:
+        if not n.messages:
+            start = 0
+            for text, count in split_messages(
+                n.search_name, n.ads, self.ads_per_message, n.kind, n.old_prices, n.found_at
+            ):
+                n.messages.append((text, n.row_ids[start:start + count]))
+                start += count
+        lock = self._chat_locks.setdefault(n.telegram_id, asyncio.Lock())
+        async with lock:
+            while n.messages:
+                await self._wait_turn(n.telegram_id)
+                start = time.perf_counter()
+                try:
+                    await self.bot.send_message(n.telegram_id, n.messages[0][0], disable_web_page_preview=True)
+                except Exception:
+                    NOTIFY_SECONDS.labels(result="error").observe(time.perf_counter() - start)
+                    raise
+                NOTIFY_SECONDS.labels(result="ok").observe(time.perf_counter() - start)
+                _, ids = n.messages.pop(0)
+                self._sent.extend(ids)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            n = await self._queue.get()
+            NOTIFY_QUEUE_DEPTH.set(self.depth)
+            if self._queue.qsize() < self.workers:
+                self._wake.set()
+            try:
+                await self._send(n)
+            except TelegramRetryAfter as e:
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning("Telegram flood control: pausing sends for %s s", e.retry_after)
+                await self._settle(retry_outbox_async(n.pending_ids, e.retry_after, count_attempt=False))
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                logger.warning("Notification to %s dropped: %s", n.telegram_id, e)
+                await self._settle(drop_outbox_async(n.pending_ids))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                n.attempts += 1
+                if n.attempts >= self.max_attempts:
+                    logger.error("Notification to %s dropped after %s attempts: %s", n.telegram_id, n.attempts, e)
+                    await self._settle(drop_outbox_async(n.pending_ids))
+                else:
+                    delay = RETRY_BASE_SECONDS * 2 ** (n.attempts - 1) * random.uniform(0.5, 1.5)
+                    logger.warning("Notification to %s failed (%s), retry in %.1f s", n.telegram_id, e, delay)
+                    await self._settle(retry_outbox_async(n.pending_ids, delay))
+            finally:
+                self._queue.task_done()
+
+
+def make_dispatcher(bot: Bot) -> NotificationDispatcher:
+    return NotificationDispatcher(
+        bot,
+        workers=settings.notify_workers,
+        global_rate=settings.notify_global_rate,
+        per_chat_interval=settings.notify_per_chat_interval,
+        ads_per_message=settings.notify_ads_per_message,
+        owner=f"{socket.gethostname()}-{os.getpid()}"[:64],
+        claim_batch=settings.notify_claim_batch,
+        lease_seconds=settings.notify_lease_seconds,
+        poll_seconds=settings.notify_poll_seconds,
+    )
@@ -1,13 +1,21 @@
-"""Fetch and parse Avito search page; extract ad list from embedded JSON."""
+"""Parse Avito search pages: extract the ad list from embedded JSON. HEADERS / TIMEOUT are the fetcher's defaults."""
+import hashlib
 import json
 import logging
 import re
 from dataclasses import dataclass
-from typing import Any
+from datetime import datetime
+from typing import Any, Iterator
+from urllib.parse import unquote
 
-import requests
 from bs4 import BeautifulSoup
 
+try:
+    import brotli  # noqa: F401  (lets aiohttp decode "br" responses)
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
 logger = logging.getLogger(__name__)
 
 USER_AGENT = (
@@ -18,30 +26,42 @@ HEADERS = {
     "User-Agent": USER_AGENT,
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Accept-Encoding": ACCEPT_ENCODING,
 }
 TIMEOUT = 10
 
+_JSON_DECODER = json.JSONDecoder()
+_SCRIPT_JSON_TYPE = re.compile(r"""type\s*=\s*["']?application/json""", re.IGNORECASE)
+_INITIAL_DATA_RE = re.compile(r"__initialData__\s*=\s*")
+# Last path (dict keys / list indexes) at which items were found, per payload source.
+# Avito keeps the same layout between pages, so this is tried before the recursive search.
+_known_items_path: dict[str, tuple] = {}
+
 
-@dataclass
+@dataclass(slots=True)
 class ParsedAd:
     id: str
     title: str
-    price: str
+    # Rubles; None when the ad has no price ("Цена не указана", fallback parser)
+    price: int | None
     url: str
+    location: str | None = None
+    published_at: datetime | None = None
+    image_url: str | None = None
 
+    @property
+    def price_text(self) -> str:
+        return f"{self.price:,} ₽".replace(",", " ") if self.price is not None else "—"
 
-def fetch_search_page(url: str) -> tuple[int, str | None, str | None]:
-    """
-    GET search URL. Returns (status_code, html_or_none, error_message).
-    """
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-        return r.status_code, r.text, None
-    except requests.Timeout:
-        return 0, None, "timeout"
-    except requests.RequestException as e:
-        logger.exception("Request failed: %s", e)
-        return 0, None, str(e)
+
+def parse_price(value: str | int | float | None) -> float | None:
+    """Numeric price from "12 500 ₽" / "12500" / 12500; None if there are no digits."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    digits = re.sub(r"[^\d]", "", str(value))
+    return float(digits) if digits else None
 
 
 def _extract_json_from_script(html: str) -> list[dict[str, Any]]:
@@ -119,33 +139,201 @@ def _looks_like_ad(obj: dict) -> bool:
     )
 
 
+def _iter_json_scripts(html: str) -> Iterator[str]:
+    """Bodies of <script type="application/json"> tags, located by offsets (no DOM)."""
+    lower = html.lower()
+    pos = 0
+    while True:
+        start = lower.find("<script", pos)
+        if start == -1:
+            return
+        tag_end = lower.find(">", start)
+        if tag_end == -1:
+            return
+        body_end = lower.find("</script", tag_end)
+        if body_end == -1:
+            return
+        pos = body_end + 8
+        if _SCRIPT_JSON_TYPE.search(html, start, tag_end):
+            body = html[tag_end + 1:body_end]
+            if body.strip():
+                yield body
+
+
+def _decode_initial_data(html: str) -> Any | None:
+    """Decode `__initialData__ = {...}` (or its URI-encoded string form) starting at its offset."""
+    m = _INITIAL_DATA_RE.search(html)
+    if not m:
+        return None
+    try:
+        data, _ = _JSON_DECODER.raw_decode(html, m.end())
+        if isinstance(data, str):
+            data = json.loads(unquote(data))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return None
+    return data
+
+
+def _find_items_with_path(node: Any, path: tuple = ()) -> tuple[list[dict[str, Any]], tuple]:
+    """Same search as _find_items_in_json, also returning the path to the matched node."""
+    items = _items_at_node(node)
+    if items:
+        return items, path
+    if isinstance(node, list):
+        for i, item in enumerate(node):
+            found, found_path = _find_items_with_path(item, path + (i,))
+            if found:
+                return found, found_path
+    elif isinstance(node, dict):
+        for k, v in node.items():
+            found, found_path = _find_items_with_path(v, path + (k,))
+            if found:
+                return found, found_path
+    return [], ()
+
+
+def _items_at_node(node: Any) -> list[dict[str, Any]]:
+    """Non-recursive part of _find_items_in_json: ad list (or single ad) at this exact node."""
+    if isinstance(node, list):
+        for item in node:
+            if isinstance(item, dict) and _looks_like_ad(item):
+                return node if all(_looks_like_ad(x) for x in node if isinstance(x, dict)) else [item]
+        return []
+    if isinstance(node, dict) and _looks_like_ad(node):
+        return [node]
+    return []
+
+
+def _items_at_path(data: Any, path: tuple) -> list[dict[str, Any]]:
+    node = data
+    for key in path:
+        try:
+            node = node[key]
+        except (KeyError, IndexError, TypeError):
+            return []
+    return _items_at_node(node)
+
+
+def _items_from_payload(data: Any, source: str) -> list[dict[str, Any]]:
+    """Try the cached path for this source first, then the generic recursive search."""
+    path = _known_items_path.get(source)
+    if path is not None:
+        items = _items_at_path(data, path)
+        if items:
+            return items
+    items, path = _find_items_with_path(data)
+    if items:
+        _known_items_path[source] = path
+    return items
+
+
+def _extract_items_fast(html: str) -> list[dict[str, Any]]:
+    """
+    Streaming extractor: JSON scripts and __initialData__ are found by offsets and decoded
+    in place, without building a BeautifulSoup tree. Returns [] when nothing is found.
+    """
+    for body in _iter_json_scripts(html):
+        try:
+            data = json.loads(body)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        items = _items_from_payload(data, "script")
+        if items:
+            return items
+    data = _decode_initial_data(html)
+    if data is not None:
+        return _items_from_payload(data if isinstance(data, dict) else {"items": data}, "initial")
+    return []
+
+
+def _items_fingerprint(items: list[dict[str, Any]]) -> str:
+    """Digest of the raw ad nodes: equal fingerprints mean the same ads with the same fields and prices."""
+    raw = json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+
+def _ad_price(raw: dict) -> int | None:
+    node = raw.get("price") or raw.get("priceDetailed") or raw.get("priceStr")
+    if isinstance(node, dict):
+        node = node.get("value") or node.get("price") or node.get("string")
+    price = parse_price(node)
+    return int(price) if price is not None else None
+
+
+def _ad_location(raw: dict) -> str | None:
+    for key, field in (("location", "name"), ("geo", "formattedAddress"), ("addressDetailed", "locationName")):
+        node = raw.get(key)
+        if isinstance(node, dict) and isinstance(node.get(field), str) and node[field].strip():
+            return node[field].strip()
+    return None
+
+
+def _ad_published_at(raw: dict) -> datetime | None:
+    """sortTimeStamp is in milliseconds (UTC)."""
+    ts = raw.get("sortTimeStamp") or raw.get("time")
+    if not isinstance(ts, (int, float)) or ts <= 0:
+        return None
+    return datetime.utcfromtimestamp(ts / 1000 if ts > 1e11 else ts)
+
+
+def _ad_image_url(raw: dict) -> str | None:
+    """Largest size of the first photo ({"208x156": url, "236x177": url, ...})."""
+    images = raw.get("images")
+    if not isinstance(images, list) or not images or not isinstance(images[0], dict):
+        return None
+    sizes = []
+    for size, url in images[0].items():
+        w, _, h = size.partition("x")
+        if isinstance(url, str) and w.isdigit() and h.isdigit():
+            sizes.append((int(w) * int(h), url))
+    return max(sizes)[1] if sizes else None
+
+
 def _normalize_ad(raw: dict) -> ParsedAd | None:
     """Build ParsedAd from raw JSON node."""
     ad_id = str(raw.get("itemId") or raw.get("id") or raw.get("value") or "")
     if not ad_id or not ad_id.isdigit():
         return None
     title = (raw.get("title") or raw.get("name") or raw.get("titlePrefix") or "").strip() or "Без названия"
-    price_node = raw.get("price") or raw.get("priceStr")
-    if isinstance(price_node, dict):
-        price = str(price_node.get("value") or price_node.get("price") or "")
-    else:
-        price = str(price_node or "")
-    if not price:
-        price = "—"
     url = raw.get("url") or raw.get("link") or ""
     if url and not url.startswith("http"):
         url = "https://www.avito.ru" + (url if url.startswith("/") else "/" + url)
     if not url:
         url = f"https://www.avito.ru/item/{ad_id}"
-    return ParsedAd(id=ad_id, title=title, price=price, url=url)
+    return ParsedAd(
+        id=ad_id,
+        title=title,
+        price=_ad_price(raw),
+        url=url,
+        location=_ad_location(raw),
+        published_at=_ad_published_at(raw),
+        image_url=_ad_image_url(raw),
+    )
 
 
-def parse_search_page(html: str) -> list[ParsedAd]:
-    """Parse HTML and return list of ParsedAd."""
-    raw_list = _extract_json_from_script(html)
+def _normalize_items(raw_list: list[dict[str, Any]]) -> list[ParsedAd]:
     result = []
     for raw in raw_list:
         ad = _normalize_ad(raw)
         if ad:
             result.append(ad)
     return result
+
+
+def parse_search_page(html: str) -> list[ParsedAd]:
+    """Parse HTML and return list of ParsedAd. Fast extractor first, full BeautifulSoup parse as fallback."""
+    return _normalize_items(_extract_items_fast(html) or _extract_json_from_script(html))
+
+
+def fingerprint_and_parse(html: str, known_fingerprint: str | None = None) -> tuple[str | None, list[ParsedAd] | None]:
+    """
+    Like parse_search_page, also returning the fingerprint of the ad nodes the fast extractor
+    found in the decoded payload (at the cached items path while it still matches). The ads are
+    None when that fingerprint is `known_fingerprint`, i.e. nothing changed since the last parse.
+    Pages only the BeautifulSoup fallback understands have no fingerprint.
+    """
+    items = _extract_items_fast(html)
+    fingerprint = _items_fingerprint(items) if items else None
+    if fingerprint is not None and fingerprint == known_fingerprint:
+        return fingerprint, None
+    return fingerprint, _normalize_items(items or _extract_json_from_script(html))
@@ -0,0 +1,62 @@
+"""
+Parse stage of the check cycle: fingerprint_and_parse in worker processes, so CPU-bound
+parsing neither blocks the event loop nor is limited to one core. Workers return plain tuples of ad
+fields; no soup or intermediate JSON comes back across the process boundary.
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.parser.avito import ParsedAd, fingerprint_and_parse
+
+logger = logging.getLogger(__name__)
+
+AdFields = tuple  # ParsedAd fields in declaration order
+
+
+def parse_page(html: str, known_fingerprint: str | None) -> tuple[str | None, list[AdFields] | None, float]:
+    """
+    Runs in a worker: (fingerprint, ads, seconds spent). ads is None when the page has the
+    `known_fingerprint`, i.e. nothing changed since it was last parsed.
+    """
+    start = time.perf_counter()
+    fingerprint, ads = fingerprint_and_parse(html, known_fingerprint)
+    if ads is None:
+        return fingerprint, None, time.perf_counter() - start
+    fields = [
+        (ad.id, ad.title, ad.price, ad.url, ad.location, ad.published_at, ad.image_url) for ad in ads
+    ]
+    return fingerprint, fields, time.perf_counter() - start
+
+
+class ParseExecutor:
+    """
+    `workers` processes (0: parse inline on the event loop, as before). Pages waiting for a worker
+    are bounded by the caller: each fetch worker of the check pipeline fetches and parses one page at
+    a time, so when parsing falls behind, the workers stop fetching and the pipeline's job queue fills.
+    """
+
+    def __init__(self, workers: int = 0) -> None:
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that runs an event loop, DB pools and sessions is unsafe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def parse(self, html: str, known_fingerprint: str | None = None) -> tuple[str | None, list[ParsedAd] | None, float]:
+        if self.workers > 0:
+            loop = asyncio.get_running_loop()
+            fingerprint, fields, seconds = await loop.run_in_executor(self._get_pool(), parse_page, html, known_fingerprint)
+        else:
+            fingerprint, fields, seconds = parse_page(html, known_fingerprint)
+        return fingerprint, [ParsedAd(*f) for f in fields] if fields is not None else None, seconds
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,199 @@
+"""Async HTTP engine for search pages: shared connection pool, global and per-host limits, optional proxy pool."""
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from app.parser.avito import HEADERS, TIMEOUT
+from app.metrics import FETCH_SECONDS, PROXY_REQUESTS
+from app.parser.proxies import Egress, ProxyPool
+from app.parser.ratelimit import OUTCOME_BLOCKED, OUTCOME_ERROR, OUTCOME_OK, OUTCOME_TIMEOUT, HostLimiter
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_OPEN = "circuit open"
+# Egresses whose next token is at most this much later than the soonest one are chosen by score
+EGRESS_WAIT_SLACK = 0.05
+
+
+def _outcome(status: int, html: str | None, err: str | None) -> str:
+    if status in (403, 429):
+        return OUTCOME_BLOCKED
+    if err == "timeout":
+        return OUTCOME_TIMEOUT
+    if err or status >= 500:
+        return OUTCOME_ERROR
+    return OUTCOME_OK
+
+
+def _validators(headers) -> dict[str, str]:
+    """Conditional request headers answering a response's ETag / Last-Modified."""
+    validators = {}
+    if headers.get("ETag"):
+        validators["If-None-Match"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        validators["If-Modified-Since"] = headers["Last-Modified"]
+    return validators
+
+
+def _status_label(status: int, err: str | None) -> str:
+    if err:
+        return "timeout" if err == "timeout" else "error"
+    return str(status)
+
+
+class AsyncFetcher:
+    """
+    One aiohttp session for all fetches. `concurrency` caps requests in flight overall,
+    `per_host` caps them per host. An optional HostLimiter paces requests per host and
+    short-circuits them while the host's breaker is open.
+
+    With a ProxyPool each request goes out through an egress picked by the pool, and limits,
+    pacing and breakers apply per (host, egress) instead: a blocked proxy is quarantined while
+    the others carry on, and each added proxy brings its own request budget.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        per_host: int = 4,
+        timeout: float = TIMEOUT,
+        limiter: HostLimiter | None = None,
+        proxies: ProxyPool | None = None,
+    ) -> None:
+        self._concurrency = concurrency
+        self._per_host = per_host
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: aiohttp.ClientSession | None = None
+        self._global = asyncio.Semaphore(concurrency)
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+        self.limiter = limiter
+        self.proxies = proxies
+        # limiter key -> acquire() calls waiting for a token
+        self._queued: dict[str, int] = {}
+        if proxies is not None and proxies.timeout is None:
+            proxies.timeout = self._timeout
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._concurrency, limit_per_host=self._per_host, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=self._timeout)
+        return self._session
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        sem = self._hosts.get(host)
+        if sem is None:
+            sem = self._hosts[host] = asyncio.Semaphore(self._per_host)
+        return sem
+
+    async def fetch(self, url: str) -> tuple[int, str | None, str | None]:
+        """(status_code, html_or_none, error_message); status 0 when the request failed or was not sent."""
+        status, html, err, _ = await self.fetch_conditional(url)
+        return status, html, err
+
+    async def fetch_conditional(
+        self, url: str, validators: dict[str, str] | None = None
+    ) -> tuple[int, str | None, str | None, dict[str, str]]:
+        """
+        fetch() sending `validators` (as returned here for an earlier 200) back: an unchanged page
+        comes back as (304, None, None, {}). The last item holds the ETag / Last-Modified of a 200
+        response; the caller keeps them for as long as it trusts what it made of that page.
+        """
+        host = (urlparse(url).hostname or "").lower()
+        egress, key = await self._acquire(host)
+        if key is None:
+            return 0, None, CIRCUIT_OPEN, {}
+        start = time.perf_counter()
+        try:
+            result = await self._get(url, key, validators, egress)
+        except BaseException:
+            # Cancelled mid-request: no outcome to record, but a half-open probe must not stay taken
+            if self.limiter is not None:
+                self.limiter.abandon(key)
+            raise
+        elapsed = time.perf_counter() - start
+        FETCH_SECONDS.labels(host=host, status=_status_label(result[0], result[2])).observe(elapsed)
+        outcome = _outcome(*result[:3])
+        if self.limiter is not None:
+            self.limiter.record(key, outcome)
+        if egress is not None:
+            self.proxies.record(egress, outcome, elapsed)
+            PROXY_REQUESTS.labels(egress=egress.name, outcome=outcome).inc()
+        return result
+
+    @staticmethod
+    def _key(host: str, egress: Egress | None) -> str:
+        """Limiter / semaphore key; the direct connection keeps the plain host (and its saved state)."""
+        return host if egress is None or egress.proxy is None else f"{host}@{egress.name}"
+
+    async def _acquire(self, host: str) -> tuple[Egress | None, str | None]:
+        """
+        Pick an egress whose breaker for `host` is closed and take a token; key None if there is none.
+        Among egresses the one a token comes soonest for (counting requests already queued) wins;
+        the pool's score decides between those about equally soon.
+        """
+        if self.proxies is None:
+            if self.limiter is not None and not await self.limiter.acquire(host):
+                return None, None
+            return None, host
+        tried: set[str] = set()
+        while True:
+            if self.limiter is None:
+                egress = self.proxies.choose(exclude=tried)
+            else:
+                waits = {
+                    e.name: self.limiter.wait_time(self._key(host, e), self._queued.get(self._key(host, e), 0))
+                    for e in self.proxies.egresses
+                    if e.name not in tried
+                }
+                soonest = min(waits.values(), default=float("inf"))
+                if soonest == float("inf"):
+                    return None, None
+                egress = self.proxies.choose(lambda e: waits.get(e.name, soonest + 1) <= soonest + EGRESS_WAIT_SLACK)
+            if egress is None:
+                return None, None
+            key = self._key(host, egress)
+            if self.limiter is None:
+                return egress, key
+            self._queued[key] = self._queued.get(key, 0) + 1
+            try:
+                if await self.limiter.acquire(key):
+                    return egress, key
+            finally:
+                self._queued[key] -= 1
+            tried.add(egress.name)
+
+    async def _get(
+        self, url: str, key: str, validators: dict[str, str] | None, egress: Egress | None = None
+    ) -> tuple[int, str | None, str | None, dict[str, str]]:
+        session = self.proxies.session(egress) if egress is not None else self._get_session()
+        proxy = egress.proxy if egress is not None else None
+        async with self._global, self._host_semaphore(key):
+            try:
+                async with session.get(url, headers=validators or None, proxy=proxy) as r:
+                    if r.status == 304:
+                        return 304, None, None, {}
+                    received = _validators(r.headers) if r.status == 200 else {}
+                    return r.status, await r.text(errors="replace"), None, received
+            except asyncio.TimeoutError:
+                return 0, None, "timeout", {}
+            except aiohttp.ClientError as e:
+                logger.warning("Request failed for %s: %s", url, e)
+                return 0, None, str(e) or e.__class__.__name__, {}
+
+    async def fetch_many(self, urls: list[str]) -> list[tuple[int, str | None, str | None]]:
+        """Fetch all URLs concurrently; results are in the order of `urls`."""
+        return await asyncio.gather(*(self.fetch(u) for u in urls))
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self.proxies is not None:
+            await self.proxies.close()
@@ -0,0 +1,130 @@
+"""
+Egress pool for search-page fetches: direct connection and/or HTTP proxies, each with its own
+aiohttp session (kept-alive connections) and browser header profile, scored on success rate and
+latency and picked by weighted choice. Blocked egresses are quarantined by the fetcher's
+HostLimiter, which keeps a separate breaker and rate per (host, egress).
+"""
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+from urllib.parse import urlparse
+
+import aiohttp
+
+from app.parser.avito import HEADERS
+from app.parser.ratelimit import OUTCOME_OK
+
+logger = logging.getLogger(__name__)
+
+DIRECT = "direct"
+# Weight of the latest request in the smoothed success rate / latency
+SCORE_ALPHA = 0.2
+# Latency floor for scoring, so a few very fast responses do not take all the traffic
+MIN_LATENCY = 0.05
+# A proxy that failed everything still gets an occasional request to notice it recovered
+MIN_SCORE = 0.01
+
+PROFILES = (
+    {
+        "User-Agent": HEADERS["User-Agent"],
+        "Accept-Language": HEADERS["Accept-Language"],
+    },
+    {
+        "User-Agent": (
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 "
+            "(KHTML, like Gecko) Version/17.2 Safari/605.1.15"
+        ),
+        "Accept-Language": "ru-RU,ru;q=0.9",
+    },
+    {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0",
+        "Accept-Language": "ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3",
+    },
+    {
+        "User-Agent": (
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
+        ),
+        "Accept-Language": "ru,en;q=0.9",
+    },
+)
+
+
+def proxy_name(url: str) -> str:
+    """host:port of a proxy URL; credentials never end up in logs, metrics or limiter keys."""
+    parsed = urlparse(url)
+    return f"{parsed.hostname}:{parsed.port}" if parsed.port else str(parsed.hostname)
+
+
+@dataclass
+class Egress:
+    name: str
+    proxy: str | None  # proxy URL, None for the direct connection
+    headers: dict[str, str]
+    success: float = 1.0
+    latency: float = 1.0
+    requests: int = 0
+    session: aiohttp.ClientSession | None = field(default=None, repr=False)
+
+    @property
+    def score(self) -> float:
+        return max(MIN_SCORE, self.success / max(self.latency, MIN_LATENCY))
+
+
+class ProxyPool:
+    """
+    choose() picks an egress with probability proportional to its score among those `usable`
+    (the fetcher passes "limiter breaker closed for this egress"); record() updates the score.
+    Each egress holds a connector of `per_egress` connections, so capacity grows with the pool.
+    """
+
+    def __init__(
+        self,
+        proxies: Iterable[str] = (),
+        include_direct: bool = True,
+        per_egress: int = 4,
+        timeout: aiohttp.ClientTimeout | None = None,
+    ) -> None:
+        urls = [p.strip() for p in proxies if p.strip()]
+        self.egresses: list[Egress] = []
+        if include_direct or not urls:
+            self.egresses.append(Egress(DIRECT, None, {**HEADERS, **PROFILES[0]}))
+        for i, url in enumerate(urls, start=len(self.egresses)):
+            self.egresses.append(Egress(proxy_name(url), url, {**HEADERS, **PROFILES[i % len(PROFILES)]}))
+        self.per_egress = per_egress
+        self.timeout = timeout
+
+    def __len__(self) -> int:
+        return len(self.egresses)
+
+    def choose(self, usable: Callable[[Egress], bool] = lambda e: True, exclude: Iterable[str] = ()) -> Egress | None:
+        excluded = set(exclude)
+        candidates = [e for e in self.egresses if e.name not in excluded and usable(e)]
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[e.score for e in candidates])[0]
+
+    def record(self, egress: Egress, outcome: str, latency: float) -> None:
+        egress.requests += 1
+        egress.success += SCORE_ALPHA * ((1.0 if outcome == OUTCOME_OK else 0.0) - egress.success)
+        egress.latency += SCORE_ALPHA * (latency - egress.latency)
+
+    def session(self, egress: Egress) -> aiohttp.ClientSession:
+        if egress.session is None or egress.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.per_egress, ttl_dns_cache=300)
+            egress.session = aiohttp.ClientSession(connector=connector, headers=egress.headers, timeout=self.timeout)
+        return egress.session
+
+    def stats(self) -> list[dict]:
+        return [
+            {"name": e.name, "score": round(e.score, 3), "success": round(e.success, 3),
+             "latency": round(e.latency, 3), "requests": e.requests}
+            for e in self.egresses
+        ]
+
+    async def close(self) -> None:
+        for egress in self.egresses:
+            if egress.session is not None and not egress.session.closed:
+                await egress.session.close()
+            egress.session = None
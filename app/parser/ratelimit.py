@@ -0,0 +1,178 @@
+"""Per-host token bucket with AIMD rate adaptation and a circuit breaker (exponential backoff + jitter)."""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_OK = "ok"
+OUTCOME_BLOCKED = "blocked"  # 403 / 429
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_ERROR = "error"
+
+# Consecutive timeouts that open the breaker (a single 403/429 opens it immediately)
+TIMEOUTS_TO_OPEN = 3
+# Weight of the latest outcome in the smoothed error rate
+ERROR_RATE_ALPHA = 0.1
+
+
+@dataclass
+class HostState:
+    host: str
+    rate: float
+    tokens: float = 1.0
+    refilled_at: float = field(default_factory=time.monotonic)
+    failures: int = 0
+    timeouts: int = 0
+    open_until: float = 0.0  # wall clock (time.time()), so it can be persisted
+    probing: bool = False
+    error_rate: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+class HostLimiter:
+    """
+    acquire(host) waits for a token (rate = requests/s for the host) or returns False while the
+    breaker is open. record(host, outcome) adapts the rate: +increase per success,
+    ×decrease per block/timeout. A block opens the breaker for base·2^(n-1) seconds (capped,
+    with jitter); after it expires a single probe request decides whether to close it. Outcomes of
+    requests that were already in flight when the breaker opened are only counted in the error rate,
+    so one incident escalates the backoff once.
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 1.0,
+        min_rate: float = 0.05,
+        max_rate: float = 5.0,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        backoff_base: float = 30.0,
+        backoff_max: float = 600.0,
+    ) -> None:
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._hosts: dict[str, HostState] = {}
+
+    def _state(self, host: str) -> HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(host=host, rate=self.initial_rate)
+        return state
+
+    def wait_time(self, host: str, queued: int = 0) -> float:
+        """
+        Seconds until a token would be free for one more acquire(host) behind `queued` waiting ones
+        (inf while the breaker is open).
+        """
+        state = self._hosts.get(host)
+        if state is None:
+            return max(0.0, queued / self.initial_rate)
+        if state.open_until > time.time() or state.probing:
+            return float("inf")
+        tokens = min(1.0, state.tokens + (time.monotonic() - state.refilled_at) * state.rate)
+        return max(0.0, (queued + 1.0 - tokens) / state.rate)
+
+    async def acquire(self, host: str) -> bool:
+        """
+        True when the request may go out; every True must be followed by record() or, if the
+        request is not made or its outcome is lost (cancelled), by abandon().
+        """
+        state = self._state(host)
+        async with state.lock:
+            probe = False
+            if state.open_until:
+                if state.open_until > time.time() or state.probing:
+                    return False
+                # Half-open: let exactly one request through to test the host
+                state.probing = probe = True
+            try:
+                while True:
+                    now = time.monotonic()
+                    state.tokens = min(1.0, state.tokens + (now - state.refilled_at) * state.rate)
+                    state.refilled_at = now
+                    if state.tokens >= 1.0:
+                        state.tokens -= 1.0
+                        return True
+                    await asyncio.sleep((1.0 - state.tokens) / state.rate)
+            except BaseException:
+                if probe:
+                    state.probing = False
+                raise
+
+    def abandon(self, host: str) -> None:
+        """A request let through by acquire() ended without an outcome: a half-open host may be probed again."""
+        state = self._hosts.get(host)
+        if state is not None:
+            state.probing = False
+
+    def record(self, host: str, outcome: str) -> None:
+        state = self._state(host)
+        failed = outcome != OUTCOME_OK
+        state.error_rate += ERROR_RATE_ALPHA * ((1.0 if failed else 0.0) - state.error_rate)
+        if state.open_until and not state.probing:
+            # Sent before the breaker opened: it neither escalates the backoff nor closes the breaker
+            return
+        if outcome == OUTCOME_OK:
+            state.rate = min(self.max_rate, state.rate + self.increase)
+            if state.open_until:
+                logger.info("Host %s recovered; circuit closed at %.2f req/s", host, state.rate)
+            state.failures = state.timeouts = 0
+            state.open_until = 0.0
+            state.probing = False
+        elif outcome == OUTCOME_BLOCKED:
+            state.rate = max(self.min_rate, state.rate * self.decrease)
+            state.failures += 1
+            self._open(state)
+        elif outcome == OUTCOME_TIMEOUT:
+            state.rate = max(self.min_rate, state.rate * self.decrease)
+            state.timeouts += 1
+            if state.probing or state.timeouts >= TIMEOUTS_TO_OPEN:
+                state.failures += 1
+                state.timeouts = 0
+                self._open(state)
+        elif state.probing:
+            # Connection error on the probe: stay open for another round
+            self._open(state)
+
+    def _open(self, state: HostState) -> None:
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (state.failures - 1))
+        backoff = random.uniform(backoff / 2, backoff)
+        state.open_until = time.time() + backoff
+        state.probing = False
+        state.tokens = 0.0
+        logger.warning(
+            "Host %s circuit open for %.0f s (failures in a row: %s, rate now %.2f req/s, error rate %.2f)",
+            state.host, backoff, state.failures, state.rate, state.error_rate,
+        )
+
+    def snapshot(self) -> list[dict]:
+        """State to persist: one dict per host (see services.save_host_limits_async)."""
+        return [
+            {
+                "host": s.host,
+                "rate": s.rate,
+                "failures": s.failures,
+                "error_rate": s.error_rate,
+                "open_until": datetime.utcfromtimestamp(s.open_until) if s.open_until else None,
+            }
+            for s in self._hosts.values()
+        ]
+
+    def restore(self, rows: list[dict]) -> None:
+        """Load state saved by snapshot(), e.g. at startup."""
+        for row in rows:
+            state = self._state(row["host"])
+            state.rate = min(self.max_rate, max(self.min_rate, row["rate"]))
+            state.failures = row["failures"]
+            state.error_rate = row["error_rate"]
+            open_until = row["open_until"]
+            state.open_until = (open_until - datetime(1970, 1, 1)).total_seconds() if open_until else 0.0
@@ -0,0 +1,185 @@
+"""
+Continuous check pipeline of the monitoring process: due searches -> fetch/parse workers -> dedup
+and outbox, connected by bounded queues. A slow stage stalls the ones before it instead of cycles
+overlapping or being skipped, so throughput is set by fetch, parse and DB capacity, not by a timer.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from config import settings
+from app.metrics import PIPELINE_PAGE_SECONDS, PIPELINE_QUEUE_DEPTH
+from app.monitor import Page, PageChecker, group_by_url
+from app.scheduling import DueQueue, LeaseQueue
+
+logger = logging.getLogger(__name__)
+
+# Host limiter state is written to the DB at most this often
+HOST_LIMITS_SAVE_SECONDS = 30.0
+
+
+@dataclass(slots=True)
+class _Job:
+    """One distinct page and the searches subscribed to it."""
+    url: str
+    searches: list[dict]
+    queued_at: float
+    page: Page | None = None
+
+
+class CheckPipeline:
+    """
+    The producer takes due searches from `queue` once every `tick_seconds` (the queues hand out a
+    tick's share, so checks are spread instead of bursting), groups them by page and puts one job
+    per page on a queue of `queue_size`. `fetch_workers` tasks fetch
+    and parse the pages onto a second queue of the same size; one recorder task takes whatever has
+    accumulated there (up to `record_batch` pages), has the `checker` dedup it in one transaction
+    with the outbox rows and completes the searches. Full queues hold back the producer, so searches are taken only as
+    fast as they are processed; how far that falls behind shows up as scheduler lag.
+    """
+
+    def __init__(
+        self,
+        queue: DueQueue | LeaseQueue,
+        checker: PageChecker,
+        fetch_workers: int = 20,
+        queue_size: int = 100,
+        record_batch: int = 200,
+        tick_seconds: float = 5.0,
+    ) -> None:
+        self.queue = queue
+        self.checker = checker
+        self.fetch_workers = fetch_workers
+        self.record_batch = record_batch
+        self.tick_seconds = tick_seconds
+        self._jobs: asyncio.Queue[_Job] = asyncio.Queue(maxsize=queue_size)
+        self._pages: asyncio.Queue[_Job] = asyncio.Queue(maxsize=queue_size)
+        self._stopping = asyncio.Event()
+        self._producer: asyncio.Task | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._limits_saved_at = 0.0
+
+    def start(self) -> None:
+        if self._producer is None:
+            self._stopping.clear()
+            self._producer = asyncio.create_task(self._produce())
+            self._tasks = [asyncio.create_task(self._fetch_worker()) for _ in range(self.fetch_workers)]
+            self._tasks.append(asyncio.create_task(self._record()))
+
+    async def stop(self, drain_timeout: float = 30.0) -> None:
+        """
+        Take no more searches and give the pages in flight `drain_timeout` seconds to be recorded,
+        then cancel the tasks. Searches leased but not recorded are released by the queue's close().
+        """
+        if self._producer is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._drain(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Check pipeline not drained: %s pages to fetch, %s to record", self._jobs.qsize(), self._pages.qsize()
+            )
+        for task in [self._producer, *self._tasks]:
+            task.cancel()
+        await asyncio.gather(self._producer, *self._tasks, return_exceptions=True)
+        self._producer = None
+        self._tasks = []
+
+    async def _drain(self) -> None:
+        await self._producer
+        await self._jobs.join()
+        await self._pages.join()
+
+    def _report_depth(self) -> None:
+        PIPELINE_QUEUE_DEPTH.labels(stage="fetch").set(self._jobs.qsize())
+        PIPELINE_QUEUE_DEPTH.labels(stage="record").set(self._pages.qsize())
+
+    async def _produce(self) -> None:
+        while not self._stopping.is_set():
+            tick_start = time.monotonic()
+            try:
+                searches = await self.queue.next_batch()
+            except Exception as e:
+                logger.exception("Could not get due searches: %s", e)
+                searches = []
+            for url, subscribers in group_by_url(searches).items():
+                # Blocks while the fetch workers are behind: backpressure up to the scheduler
+                await self._jobs.put(_Job(url, subscribers, time.monotonic()))
+                self._report_depth()
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=max(0.0, self.tick_seconds - (time.monotonic() - tick_start))
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fetch_worker(self) -> None:
+        while True:
+            job = await self._jobs.get()
+            try:
+                job.page = await self.checker.fetch(job.url, job.searches)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Fetch failed for %s: %s", job.url, e)
+                job.page = Page(0, str(e))
+            try:
+                await self._pages.put(job)
+            finally:
+                self._jobs.task_done()
+                self._report_depth()
+
+    async def _record(self) -> None:
+        while True:
+            jobs = [await self._pages.get()]
+            while len(jobs) < self.record_batch:
+                try:
+                    jobs.append(self._pages.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            self._report_depth()
+            try:
+                await self._record_jobs(jobs)
+            finally:
+                for _ in jobs:
+                    self._pages.task_done()
+
+    async def _record_jobs(self, jobs: list[_Job]) -> None:
+        try:
+            await self._save_host_limits()
+            await self.checker.record([(j.url, j.searches, j.page) for j in jobs])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Recording %s pages failed: %s", len(jobs), e)
+        finally:
+            # As in the interval job: a failed check is retried at the search's next due time
+            try:
+                await self.queue.complete([s for j in jobs for s in j.searches])
+            except Exception as e:
+                logger.warning("Could not complete searches: %s", e)
+        now = time.monotonic()
+        for job in jobs:
+            PIPELINE_PAGE_SECONDS.observe(now - job.queued_at)
+
+    async def _save_host_limits(self) -> None:
+        now = time.monotonic()
+        if now - self._limits_saved_at >= HOST_LIMITS_SAVE_SECONDS:
+            self._limits_saved_at = now
+            await self.checker.save_host_limits()
+
+
+def make_pipeline(
+    queue: DueQueue | LeaseQueue,
+    checker: PageChecker,
+) -> CheckPipeline:
+    return CheckPipeline(
+        queue,
+        checker,
+        fetch_workers=checker.fetcher.concurrency,
+        queue_size=settings.pipeline_queue_size,
+        record_batch=settings.pipeline_record_batch,
+        tick_seconds=settings.schedule_tick_seconds,
+    )
@@ -0,0 +1,28 @@
+"""
+One-shot preparation that runs before the bot, the workers and the API start (the `init` service
+in docker-compose, ExecStartPre under systemd): migrates the database to the latest schema and
+clears the metrics left by previous runs from the shared PROMETHEUS_MULTIPROC_DIR.
+"""
+import logging
+import sys
+
+from app.database import upgrade_db
+from app.metrics import MULTIPROC_DIR, reset_multiprocess_dir
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    stream=sys.stdout,
+)
+logger = logging.getLogger(__name__)
+
+
+def main() -> None:
+    upgrade_db()
+    if MULTIPROC_DIR:
+        reset_multiprocess_dir()
+        logger.info("Cleared metrics directory %s", MULTIPROC_DIR)
+
+
+if __name__ == "__main__":
+    main()
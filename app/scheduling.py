@@ -0,0 +1,225 @@
+"""
+Where the check pipeline (and the one-off check loop) gets its searches from:
+DueQueue (single process, in-memory heap) or LeaseQueue (any number of workers, leases in the DB).
+"""
+import asyncio
+import heapq
+import logging
+import math
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from config import settings
+from app.metrics import SCHEDULER_LAG
+from app.services import (
+    claim_due_searches_async,
+    extend_leases_async,
+    get_active_searches_async,
+    release_searches_async,
+)
+
+logger = logging.getLogger(__name__)
+
+# When more than one interval behind, a tick may take this many times its fair share
+CATCH_UP_FACTOR = 2.0
+# The check pipeline asks for searches continuously; "behind" is logged at most this often
+LAG_WARN_SECONDS = 60.0
+
+_lag_warned_at = 0.0
+
+
+def _report_lag(lag: float, default_interval: int, searches: int) -> None:
+    global _lag_warned_at
+    SCHEDULER_LAG.set(lag)
+    now = time.monotonic()
+    if lag > default_interval and now - _lag_warned_at >= LAG_WARN_SECONDS:
+        _lag_warned_at = now
+        logger.warning("Scheduler is %.0f s behind (%s searches)", lag, searches)
+
+
+class DueQueue:
+    """
+    Min-heap of (due_at, page) over the distinct search pages (canonical URLs). A page is due at
+    the earliest last_check_at + interval of its subscribers (a never-checked one makes it due
+    immediately) and is handed out with all of them, so each page is fetched once per interval
+    however the subscribers' own check times drift apart. The active set is reloaded from the DB
+    every `refresh_seconds`; between reloads popped pages are rescheduled in memory.
+
+    Each tick returns the subscribers of at most `budget` pages: the sum of 1/interval over all
+    pages times the tick length (×CATCH_UP_FACTOR while lagging). Checks are therefore spread over
+    the interval instead of bursting, and every active page gets its turn however many there are.
+    """
+
+    def __init__(self, tick_seconds: float, default_interval: int, refresh_seconds: float | None = None) -> None:
+        self.tick_seconds = tick_seconds
+        self.default_interval = default_interval
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else default_interval
+        self._heap: list[tuple[datetime, str]] = []
+        self._pages: dict[str, list[dict]] = {}
+        self._due: dict[str, datetime] = {}
+        self._size = 0
+        self._refreshed_at: datetime | None = None
+
+    def interval(self, search: dict) -> int:
+        return search.get("check_interval") or self.default_interval
+
+    def page_interval(self, subscribers: list[dict]) -> int:
+        """A page is checked as often as its most frequently checked subscriber wants."""
+        return min(self.interval(s) for s in subscribers)
+
+    def load(self, searches: list[dict], now: datetime) -> None:
+        """Replace the active set, keeping in-memory due times for pages already queued."""
+        pages: dict[str, list[dict]] = {}
+        for search in searches:
+            pages.setdefault(search["canonical_url"], []).append(search)
+        due: dict[str, datetime] = {}
+        for url, subscribers in pages.items():
+            from_db = min(
+                s["last_check_at"] + timedelta(seconds=self.interval(s)) if s.get("last_check_at") else now
+                for s in subscribers
+            )
+            # The DB may lag behind in-memory reschedules (or be ahead, after another process checked
+            # the page); a new subscriber gets the page at its own due time
+            known = self._due.get(url)
+            added = {s["search_id"] for s in subscribers} - {s["search_id"] for s in self._pages.get(url, ())}
+            due[url] = max(from_db, known) if known and not added else from_db
+        self._pages = pages
+        self._due = due
+        self._size = len(searches)
+        self._heap = [(d, url) for url, d in due.items()]
+        heapq.heapify(self._heap)
+        self._refreshed_at = now
+
+    def budget(self, now: datetime) -> int:
+        rate = sum(1.0 / self.page_interval(subscribers) for subscribers in self._pages.values())
+        share = rate * self.tick_seconds
+        if self.lag(now) > self.default_interval:
+            share *= CATCH_UP_FACTOR
+        return max(1, math.ceil(share))
+
+    def pop_due(self, now: datetime) -> list[dict]:
+        """
+        Subscribers of the pages due at `now`, most overdue page first, at most budget() pages;
+        the pages are rescheduled.
+        """
+        batch: list[dict] = []
+        limit, pages = self.budget(now), 0
+        while self._heap and pages < limit:
+            due_at, url = self._heap[0]
+            if self._due.get(url) != due_at:
+                heapq.heappop(self._heap)  # stale entry
+                continue
+            if due_at > now:
+                break
+            heapq.heappop(self._heap)
+            subscribers = self._pages[url]
+            batch.extend(subscribers)
+            pages += 1
+            self._reschedule(url, now + timedelta(seconds=self.page_interval(subscribers)))
+        return batch
+
+    def _reschedule(self, url: str, due_at: datetime) -> None:
+        self._due[url] = due_at
+        heapq.heappush(self._heap, (due_at, url))
+
+    def lag(self, now: datetime) -> float:
+        """Seconds the most overdue page has been waiting (0 when on schedule)."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return 0.0
+        return max(0.0, (now - self._heap[0][0]).total_seconds())
+
+    async def next_batch(self, now: datetime | None = None) -> list[dict]:
+        """Reload from the DB when stale, then pop the due searches."""
+        now = now or datetime.utcnow()
+        if self._refreshed_at is None or (now - self._refreshed_at).total_seconds() >= self.refresh_seconds:
+            self.load(await get_active_searches_async(), now)
+        batch = self.pop_due(now)
+        _report_lag(self.lag(now), self.default_interval, self._size)
+        return batch
+
+    async def complete(self, searches: list[dict]) -> None:
+        """Searches are rescheduled when popped; nothing to release."""
+
+    async def close(self) -> None:
+        pass
+
+
+class LeaseQueue:
+    """
+    Searches are leased from the DB in batches, so several worker processes/nodes can share them
+    without checking the same search twice; a page's subscribers are leased together (see
+    claim_due_searches_async). A worker holds at most about `batch_size` leases: it claims only
+    room freed by completed searches, so due searches it could not process yet stay with the other
+    workers. While searches are being checked a heartbeat extends their leases; complete() releases
+    them and sets next_check_at. A crashed worker's leases simply expire.
+    """
+
+    def __init__(self, worker_id: str, batch_size: int, lease_seconds: int, default_interval: int) -> None:
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.default_interval = default_interval
+        self._held: set[int] = set()
+        self._heartbeat: asyncio.Task | None = None
+
+    async def next_batch(self) -> list[dict]:
+        room = self.batch_size - len(self._held)
+        if room <= 0:
+            return []
+        batch = await claim_due_searches_async(self.worker_id, room, self.lease_seconds)
+        self._held.update(s["search_id"] for s in batch)
+        now = datetime.utcnow()
+        _report_lag(max((self.lag(s, now) for s in batch), default=0.0), self.default_interval, len(batch))
+        if self._held and (self._heartbeat is None or self._heartbeat.done()):
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        return batch
+
+    def lag(self, search: dict, now: datetime) -> float:
+        """Seconds `search` has waited past its due time (never-checked searches count as on time)."""
+        last = search.get("last_check_at")
+        if last is None:
+            return 0.0
+        due = last + timedelta(seconds=search.get("check_interval") or self.default_interval)
+        return max(0.0, (now - due).total_seconds())
+
+    async def _heartbeat_loop(self) -> None:
+        while self._held:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await extend_leases_async(self.worker_id, list(self._held), self.lease_seconds)
+            except Exception as e:
+                logger.warning("Lease heartbeat failed: %s", e)
+
+    async def complete(self, searches: list[dict]) -> None:
+        now = datetime.utcnow()
+        await release_searches_async(
+            self.worker_id,
+            {s["search_id"]: now + timedelta(seconds=s.get("check_interval") or self.default_interval) for s in searches},
+        )
+        self._held.difference_update(s["search_id"] for s in searches)
+
+    async def close(self) -> None:
+        """Hand held searches back immediately (due now) so other workers pick them up."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._held:
+            now = datetime.utcnow()
+            await release_searches_async(self.worker_id, {search_id: now for search_id in self._held})
+            self._held.clear()
+
+
+def make_due_queue() -> DueQueue:
+    return DueQueue(tick_seconds=settings.schedule_tick_seconds, default_interval=settings.check_interval)
+
+
+def make_lease_queue() -> LeaseQueue:
+    return LeaseQueue(
+        worker_id=f"{socket.gethostname()}-{os.getpid()}"[:64],
+        batch_size=settings.worker_batch_size,
+        lease_seconds=settings.worker_lease_seconds,
+        default_interval=settings.check_interval,
+    )
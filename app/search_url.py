@@ -0,0 +1,152 @@
+"""
+Search links parsed once: canonical URL, decoded `f` filter blob, price bounds, region and category.
+Parsed when a search is added and stored with it; repeated links are answered from an LRU cache.
+"""
+import base64
+import binascii
+import json
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from urllib.parse import parse_qs, parse_qsl, urlencode, urlparse, urlunparse
+
+AVITO_DOMAINS = ("avito.ru", "www.avito.ru", "m.avito.ru")
+# Distinct links kept parsed per process
+URL_CACHE_SIZE = 4096
+
+# Avito encodes filters in `f` as "<opaque>~<base64 JSON>"; the JSON part starts with eyJ ("{")
+_F_BLOB_RE = re.compile(r"eyJ[A-Za-z0-9+/=_-]+")
+# Query parameters that only narrow a listing by price, by text, or order / paginate it: searches differing
+# only in these belong to the same family (same region, category and other filters)
+_FAMILY_IGNORED = {"maxPrice", "minPrice", "max_price", "min_price", "pmax", "pmin", "q", "s", "p"}
+# Avito's "newest first" sort order
+SORT_BY_DATE = "104"
+
+
+@dataclass(frozen=True, slots=True)
+class SearchUrl:
+    """A parsed search link. Instances are shared through the cache: treat `filters` as read-only."""
+    url: str
+    canonical: str
+    scheme: str
+    host: str
+    # First path segment on Avito (rossiya, moskva, ...) and the rest of the path (transport/avtomobili)
+    region: str | None
+    category: str | None
+    filters: dict = field(default_factory=dict)
+    min_price: float | None = None
+    max_price: float | None = None
+    # Text query (q), the link without price/text/sort parameters, and whether newest ads come first
+    query: str | None = None
+    family: str = ""
+    sorted_by_date: bool = False
+
+    @property
+    def words(self) -> tuple[str, ...]:
+        return tuple(self.query.lower().split()) if self.query else ()
+
+    @property
+    def is_avito(self) -> bool:
+        return _is_avito_host(self.host)
+
+
+def _is_avito_host(host: str) -> bool:
+    return any(host == d or host.endswith("." + d) for d in AVITO_DOMAINS)
+
+
+def decode_f_param(f_value: str) -> dict:
+    """Decoded JSON part of Avito's `f` filter parameter ({} when there is none)."""
+    if not f_value:
+        return {}
+    match = _F_BLOB_RE.search(f_value.replace("~", ""))
+    if not match:
+        return {}
+    b64 = match.group(0)
+    # base64 without padding; '-' and '_' are the URL-safe alphabet
+    b64 += "=" * (-len(b64) % 4)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(b64.replace("+", "-").replace("/", "_")).decode("utf-8"))
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _price(values: list[str] | None) -> float | None:
+    if not values:
+        return None
+    try:
+        return float(values[0].replace(" ", "").replace(",", "."))
+    except (ValueError, TypeError):
+        return None
+
+
+def _filter_price(filters: dict, key: str) -> float | None:
+    try:
+        return float(filters[key]) if key in filters else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _family(canonical: str) -> str:
+    """Canonical link without the _FAMILY_IGNORED parameters and the price JSON of `f`."""
+    parsed = urlparse(canonical)
+    query = [
+        (k, v.split("~", 1)[0] if k == "f" else v)
+        for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if k not in _FAMILY_IGNORED
+    ]
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", urlencode(query), ""))
+
+
+def _canonical(parsed, query: list[tuple[str, str]]) -> str:
+    scheme, netloc = parsed.scheme.lower(), parsed.netloc.lower()
+    if (parsed.hostname or "").lower() in AVITO_DOMAINS[:2]:
+        scheme, netloc = "https", "www.avito.ru"
+    path = parsed.path.rstrip("/") or "/"
+    query = sorted((k, v) for k, v in query if not k.startswith("utm_"))
+    return urlunparse((scheme, netloc, path, "", urlencode(query), ""))
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def parse_search_url(url: str) -> SearchUrl:
+    """Parse a search link; raises ValueError if it is not a URL at all."""
+    url = url.strip()
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    qs = parse_qs(parsed.query)
+    filters = decode_f_param(qs["f"][0]) if qs.get("f") else {}
+    max_price = _price(qs.get("maxPrice") or qs.get("max_price"))
+    min_price = _price(qs.get("minPrice") or qs.get("min_price"))
+    if max_price is None:
+        max_price = _filter_price(filters, "to")
+    if min_price is None:
+        min_price = _filter_price(filters, "from")
+    segments = [s for s in parsed.path.split("/") if s]
+    region = category = None
+    if segments and _is_avito_host(host):
+        region = segments[0]
+        category = "/".join(segments[1:]) or None
+    canonical = _canonical(parsed, parse_qsl(parsed.query, keep_blank_values=True))
+    return SearchUrl(
+        url=url,
+        canonical=canonical,
+        scheme=parsed.scheme.lower(),
+        host=host,
+        region=region,
+        category=category,
+        filters=filters,
+        min_price=min_price,
+        max_price=max_price,
+        query=(qs.get("q") or [""])[0].strip() or None,
+        family=_family(canonical),
+        sorted_by_date=(qs.get("s") or [""])[0] == SORT_BY_DATE,
+    )
+
+
+def canonical_search_url(url: str) -> str:
+    """
+    Normalize a search link so identical searches compare equal: https://www.avito.ru for Avito
+    (other hosts, e.g. a local stub, keep scheme and port), no trailing slash, no fragment or
+    utm_* params, query parameters sorted.
+    """
+    return parse_search_url(url).canonical
@@ -0,0 +1,223 @@
+"""
+Process-level cache of seen ads in front of the seen_ads table: a bloom filter answers "definitely
+new", per-search sorted arrays of numeric ad ids answer "already seen", least recently used searches
+are evicted under a memory cap. New ads are written through with filter_unseen_ads_async, which
+stays the authority (other workers may have seen an ad first).
+
+Entries of deleted searches are not dropped: search ids are never reused (see app.models.Search),
+so nothing asks for them again and they age out under the memory cap.
+"""
+import bisect
+import hashlib
+import logging
+import math
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Iterable
+
+from config import settings
+from app.metrics import SEEN_CACHE_BYTES, SEEN_CACHE_LOOKUPS
+from app.services import add_outbox_async, filter_unseen_ads_async, load_seen_ads_async
+from app.services.search import SEEN_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Rough per-search overhead (entry object, array header, OrderedDict slot)
+ENTRY_OVERHEAD = 200
+WARM_UP_CHUNK = 100
+
+
+def _numeric(ad_id: str) -> int | None:
+    """Avito ad ids are decimal; anything else is not cached and always goes to the DB."""
+    if ad_id.isdigit() and len(ad_id) < 19:
+        return int(ad_id)
+    return None
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over (search_id, ad_id) pairs; never yields false negatives."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, search_id: int, ad_id: int):
+        digest = hashlib.blake2b(
+            search_id.to_bytes(8, "little") + ad_id.to_bytes(8, "little"), digest_size=16
+        ).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, search_id: int, ad_id: int) -> None:
+        for pos in self._positions(search_id, ad_id):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(*key))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+
+class _SearchIds:
+    """Sorted ad ids of one search; `complete` when loaded from the DB rather than built from inserts."""
+
+    __slots__ = ("ids", "complete", "touched_at", "accounted")
+
+    def __init__(self, ids: Iterable[int] = (), complete: bool = False) -> None:
+        self.ids = array("q", sorted(set(ids)))
+        self.complete = complete
+        self.touched_at = time.monotonic()
+        self.accounted = 0
+
+    def __contains__(self, ad_id: int) -> bool:
+        i = bisect.bisect_left(self.ids, ad_id)
+        return i < len(self.ids) and self.ids[i] == ad_id
+
+    def add(self, ad_id: int) -> None:
+        i = bisect.bisect_left(self.ids, ad_id)
+        if i == len(self.ids) or self.ids[i] != ad_id:
+            self.ids.insert(i, ad_id)
+
+    @property
+    def nbytes(self) -> int:
+        return ENTRY_OVERHEAD + self.ids.itemsize * len(self.ids)
+
+
+class SeenCache:
+    """
+    filter_unseen() has the contract of filter_unseen_ads_async but only goes to the DB for ads that
+    may be new, for searches not in memory yet, and once per SEEN_REFRESH_SECONDS per search to keep
+    last_seen_at (retention) current. A cycle without new ads is answered from memory.
+    """
+
+    def __init__(self, max_bytes: int, bloom_capacity: int, refresh_seconds: float = SEEN_REFRESH_SECONDS) -> None:
+        self.max_bytes = max_bytes
+        self.refresh_seconds = refresh_seconds
+        self.bloom = BloomFilter(bloom_capacity)
+        self._searches: OrderedDict[int, _SearchIds] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes + self.bloom.nbytes
+
+    def __len__(self) -> int:
+        return len(self._searches)
+
+    def _store(self, search_id: int, entry: _SearchIds) -> None:
+        """(Re)account an entry as most recently used, then evict down to the memory cap."""
+        old = self._searches.pop(search_id, None)
+        if old is not None:
+            self._bytes -= old.accounted
+        entry.accounted = entry.nbytes
+        self._searches[search_id] = entry
+        self._bytes += entry.accounted
+        while self._bytes > self.max_bytes and len(self._searches) > 1:
+            _, evicted = self._searches.popitem(last=False)
+            self._bytes -= evicted.accounted
+        SEEN_CACHE_BYTES.set(self.nbytes)
+
+    def _load(self, rows: dict[int, list[str]], search_ids: Iterable[int]) -> None:
+        """Install DB rows as complete entries, merged with whatever is already cached."""
+        for search_id in search_ids:
+            ids = [n for n in map(_numeric, rows.get(search_id, ())) if n is not None]
+            for ad_id in ids:
+                self.bloom.add(search_id, ad_id)
+            entry = self._searches.get(search_id)
+            if entry is not None:
+                ids.extend(entry.ids)
+            self._store(search_id, _SearchIds(ids, complete=True))
+
+    async def warm_up(self, search_ids: list[int]) -> None:
+        """Load the seen ids of these searches (e.g. all active ones) until the memory cap is reached."""
+        start = time.perf_counter()
+        for i in range(0, len(search_ids), WARM_UP_CHUNK):
+            if self._bytes >= self.max_bytes:
+                break
+            chunk = search_ids[i:i + WARM_UP_CHUNK]
+            self._load(await load_seen_ads_async(chunk), chunk)
+        logger.info(
+            "Seen-ad cache warmed up: %s searches, %.1f MiB in %.1f s",
+            len(self._searches), self.nbytes / 2**20, time.perf_counter() - start,
+        )
+
+    async def filter_unseen(
+        self,
+        pairs: Iterable[tuple[int, str]],
+        outbox: Callable[[set[tuple[int, str]]], list[dict]] | None = None,
+    ) -> set[tuple[int, str]]:
+        """
+        Pairs not seen before; all pairs are seen afterwards (written through to seen_ads, together
+        with the `outbox` rows for the new pairs, as in filter_unseen_ads_async).
+        """
+        now = time.monotonic()
+        candidates: list[tuple[int, str]] = []
+        refresh: list[tuple[int, str]] = []
+        cold: dict[int, list[str]] = {}
+        for search_id, ad_id in dict.fromkeys(pairs):
+            num = _numeric(ad_id)
+            if num is None:
+                candidates.append((search_id, ad_id))
+                continue
+            if (search_id, num) not in self.bloom:
+                SEEN_CACHE_LOOKUPS.labels(result="bloom_new").inc()
+                candidates.append((search_id, ad_id))
+                continue
+            entry = self._searches.get(search_id)
+            if entry is not None and num in entry:
+                SEEN_CACHE_LOOKUPS.labels(result="known").inc()
+                self._searches.move_to_end(search_id)
+                if now - entry.touched_at >= self.refresh_seconds:
+                    refresh.append((search_id, ad_id))
+            elif entry is not None and entry.complete:
+                SEEN_CACHE_LOOKUPS.labels(result="new").inc()
+                candidates.append((search_id, ad_id))
+            else:
+                # Maybe seen, but this search is not (fully) in memory: read its history once
+                SEEN_CACHE_LOOKUPS.labels(result="loaded").inc()
+                cold.setdefault(search_id, []).append(ad_id)
+
+        if cold:
+            rows = await load_seen_ads_async(list(cold))
+            for search_id, ad_ids in cold.items():
+                seen = set(rows.get(search_id, ()))
+                candidates.extend((search_id, ad_id) for ad_id in ad_ids if ad_id not in seen)
+            self._load(rows, cold)
+
+        if not candidates and not refresh:
+            if outbox is not None:
+                await add_outbox_async(outbox(set()))
+            return set()
+        # A refreshed pair only comes back as "new" if compaction removed it meanwhile; it was notified already
+        wanted = set(candidates)
+        new = await filter_unseen_ads_async(
+            candidates + refresh, outbox and (lambda new_pairs: outbox(new_pairs & wanted))
+        )
+        new.intersection_update(wanted)
+        for search_id, _ in refresh:
+            entry = self._searches.get(search_id)
+            if entry is not None:
+                entry.touched_at = now
+        added: dict[int, _SearchIds] = {}
+        for search_id, ad_id in candidates:
+            num = _numeric(ad_id)
+            if num is None:
+                continue
+            self.bloom.add(search_id, num)
+            entry = added.get(search_id) or self._searches.get(search_id) or _SearchIds()
+            entry.add(num)
+            added[search_id] = entry
+        for search_id, entry in added.items():
+            self._store(search_id, entry)
+        return new
+
+
+def make_seen_cache() -> SeenCache:
+    return SeenCache(
+        max_bytes=settings.seen_cache_mb * 2**20,
+        bloom_capacity=settings.seen_bloom_capacity,
+    )
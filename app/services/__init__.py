@@ -1,23 +1,72 @@
 from app.services.search import (
-    ensure_user,
-    add_search,
-    list_user_searches,
-    delete_search,
-    get_active_searches,
-    get_seen_ad_ids,
-    mark_ad_seen,
-    set_search_blocked,
-    update_last_check,
+    canonical_search_url,
+)
+
+from app.services.ads import (
+    load_ad_prices_async,
+    upsert_ads_async,
+    compact_ads_async,
+)
+
+from app.services.outbox import (
+    outbox_row,
+    add_outbox_async,
+    claim_outbox_async,
+    mark_outbox_sent_async,
+    retry_outbox_async,
+    drop_outbox_async,
+    release_outbox_async,
+    compact_outbox_async,
+)
+
+from app.services.search_async import (
+    ensure_user_async,
+    ensure_user_id_async,
+    add_search_async,
+    list_user_searches_async,
+    delete_search_async,
+    delete_search_by_number_async,
+    get_active_searches_async,
+    load_seen_ads_async,
+    get_searches_by_seen_ads_async,
+    filter_unseen_ads_async,
+    compact_seen_ads_async,
+    update_last_check_many_async,
+    load_host_limits_async,
+    save_host_limits_async,
+    claim_due_searches_async,
+    extend_leases_async,
+    release_searches_async,
 )
 
 __all__ = [
-    "ensure_user",
-    "add_search",
-    "list_user_searches",
-    "delete_search",
-    "get_active_searches",
-    "get_seen_ad_ids",
-    "mark_ad_seen",
-    "set_search_blocked",
-    "update_last_check",
+    "load_ad_prices_async",
+    "upsert_ads_async",
+    "compact_ads_async",
+    "outbox_row",
+    "add_outbox_async",
+    "claim_outbox_async",
+    "mark_outbox_sent_async",
+    "retry_outbox_async",
+    "drop_outbox_async",
+    "release_outbox_async",
+    "compact_outbox_async",
+    "canonical_search_url",
+    "ensure_user_async",
+    "ensure_user_id_async",
+    "add_search_async",
+    "list_user_searches_async",
+    "delete_search_async",
+    "delete_search_by_number_async",
+    "get_active_searches_async",
+    "load_seen_ads_async",
+    "get_searches_by_seen_ads_async",
+    "filter_unseen_ads_async",
+    "compact_seen_ads_async",
+    "update_last_check_many_async",
+    "load_host_limits_async",
+    "save_host_limits_async",
+    "claim_due_searches_async",
+    "extend_leases_async",
+    "release_searches_async",
 ]
@@ -0,0 +1,100 @@
+"""Ad catalogue and price history (async; used by the monitor once per cycle)."""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from config import settings
+from app.database import get_async_db
+from app.metrics import db_timed
+from app.models import Ad, AdPrice
+from app.parser.avito import ParsedAd
+from app.services.search import _insert_chunk, _insert_for_dialect
+
+logger = logging.getLogger(__name__)
+
+ADS_UPSERT_CHUNK = _insert_chunk(len(Ad.__table__.columns))
+AD_PRICES_INSERT_CHUNK = _insert_chunk(3)
+ADS_SELECT_CHUNK = 500
+
+
+def _ad_row(ad: ParsedAd, now: datetime, price_changed: bool) -> dict:
+    return {
+        "avito_id": ad.id,
+        "title": ad.title,
+        "price": ad.price,
+        "url": ad.url,
+        "location": ad.location,
+        "published_at": ad.published_at,
+        "image_url": ad.image_url,
+        "first_seen_at": now,
+        "last_seen_at": now,
+        "price_changed_at": now if price_changed else None,
+    }
+
+
+def _ads_upsert_stmt(rows: list[dict]):
+    stmt = _insert_for_dialect()(Ad).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["avito_id"],
+        set_={
+            "title": stmt.excluded.title,
+            "price": stmt.excluded.price,
+            "url": stmt.excluded.url,
+            "location": func.coalesce(stmt.excluded.location, Ad.location),
+            "published_at": func.coalesce(stmt.excluded.published_at, Ad.published_at),
+            "image_url": func.coalesce(stmt.excluded.image_url, Ad.image_url),
+            "last_seen_at": stmt.excluded.last_seen_at,
+            "price_changed_at": func.coalesce(stmt.excluded.price_changed_at, Ad.price_changed_at),
+        },
+    )
+
+
+@db_timed
+async def load_ad_prices_async(avito_ids: list[str]) -> dict[str, tuple[int | None, datetime]]:
+    """Stored (price, last_seen_at) of the ads that are in the catalogue."""
+    out: dict[str, tuple[int | None, datetime]] = {}
+    async with get_async_db() as db:
+        for i in range(0, len(avito_ids), ADS_SELECT_CHUNK):
+            rows = await db.execute(
+                select(Ad.avito_id, Ad.price, Ad.last_seen_at).where(Ad.avito_id.in_(avito_ids[i:i + ADS_SELECT_CHUNK]))
+            )
+            out.update((r.avito_id, (r.price, r.last_seen_at)) for r in rows)
+    return out
+
+
+@db_timed
+async def upsert_ads_async(ads: list[ParsedAd], price_changes: set[str]) -> None:
+    """
+    Write the latest fields of `ads` in batched upserts, and append a price history row for each
+    id in `price_changes` (new ads and changed prices), all in one transaction.
+    """
+    if not ads:
+        return
+    now = datetime.utcnow()
+    rows = [_ad_row(ad, now, ad.id in price_changes) for ad in ads]
+    history = [{"avito_id": ad.id, "price": ad.price, "seen_at": now} for ad in ads if ad.id in price_changes]
+    async with get_async_db() as db:
+        for i in range(0, len(rows), ADS_UPSERT_CHUNK):
+            await db.execute(_ads_upsert_stmt(rows[i:i + ADS_UPSERT_CHUNK]))
+        for i in range(0, len(history), AD_PRICES_INSERT_CHUNK):
+            await db.execute(insert(AdPrice).values(history[i:i + AD_PRICES_INSERT_CHUNK]))
+
+
+@db_timed
+async def compact_ads_async() -> int:
+    """Delete ads (and their history) not seen for SEEN_RETENTION_DAYS, SEEN_COMPACT_BATCH per transaction."""
+    cutoff = datetime.utcnow() - timedelta(days=settings.seen_retention_days)
+    deleted = 0
+    while True:
+        async with get_async_db() as db:
+            ids = list(
+                (await db.execute(select(Ad.avito_id).where(Ad.last_seen_at < cutoff).limit(settings.seen_compact_batch)))
+                .scalars()
+            )
+            if ids:
+                await db.execute(delete(AdPrice).where(AdPrice.avito_id.in_(ids)))
+                await db.execute(delete(Ad).where(Ad.avito_id.in_(ids)))
+        deleted += len(ids)
+        if len(ids) < settings.seen_compact_batch:
+            return deleted
@@ -0,0 +1,149 @@
+"""Notification outbox (async): written with the seen_ads dedup, drained by the notification dispatcher."""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+
+from app.database import get_async_db
+from app.metrics import db_timed
+from app.models import OutboxMessage
+from app.parser.avito import ParsedAd
+from app.services.search import _insert_chunk, _insert_for_dialect
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_INSERT_CHUNK = _insert_chunk(len(OutboxMessage.__table__.columns))
+# Sent rows are kept this long so a notification enqueued twice (e.g. the same price drop seen by
+# two workers) is still recognised by its key
+OUTBOX_SENT_RETENTION = timedelta(days=1)
+
+
+def outbox_key(kind: str, search_id: int, ad: ParsedAd) -> str:
+    """Idempotency key: one notification per ad and search, and per price for price drops."""
+    key = f"{kind}:{search_id}:{ad.id}"
+    return key if kind == "new" else f"{key}:{ad.price}"
+
+
+def outbox_row(kind: str, search: dict, ad: ParsedAd, old_price: int | None, now: datetime) -> dict:
+    """`search` is a dict as returned by get_active_searches_async."""
+    return {
+        "key": outbox_key(kind, search["search_id"], ad),
+        "telegram_id": search["telegram_id"],
+        "search_id": search["search_id"],
+        "search_name": search["search_name"],
+        "kind": kind,
+        "avito_id": ad.id,
+        "title": ad.title,
+        "price": ad.price,
+        "old_price": old_price,
+        "url": ad.url,
+        "location": ad.location,
+        "created_at": now,
+        "attempts": 0,
+        "next_attempt_at": now,
+    }
+
+
+async def add_outbox_rows(db, rows: list[dict]) -> None:
+    """Insert within the caller's transaction; rows whose key is already there are ignored."""
+    for i in range(0, len(rows), OUTBOX_INSERT_CHUNK):
+        stmt = _insert_for_dialect()(OutboxMessage).values(rows[i:i + OUTBOX_INSERT_CHUNK])
+        await db.execute(stmt.on_conflict_do_nothing(index_elements=["key"]))
+
+
+@db_timed
+async def add_outbox_async(rows: list[dict]) -> None:
+    if not rows:
+        return
+    async with get_async_db() as db:
+        await add_outbox_rows(db, rows)
+
+
+@db_timed
+async def claim_outbox_async(owner: str, limit: int, lease_seconds: int) -> list[OutboxMessage]:
+    """
+    Lease up to `limit` due, unsent rows to this dispatcher, oldest first. Leases of a dispatcher
+    that died run out and the rows are claimed again: delivery is at least once.
+    """
+    now = datetime.utcnow()
+    due = (
+        select(OutboxMessage.id)
+        .where(OutboxMessage.sent_at == None)
+        .where(OutboxMessage.next_attempt_at <= now)
+        .where((OutboxMessage.lease_until == None) | (OutboxMessage.lease_until < now))
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with get_async_db() as db:
+        result = await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due.scalar_subquery()))
+            .values(lease_owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+            .returning(OutboxMessage.id)
+            .execution_options(synchronize_session=False)
+        )
+        ids = [r[0] for r in result]
+        if not ids:
+            return []
+        rows = await db.execute(select(OutboxMessage).where(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id))
+        return list(rows.scalars())
+
+
+@db_timed
+async def mark_outbox_sent_async(ids: list[int]) -> None:
+    async with get_async_db() as db:
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(ids))
+            .values(sent_at=datetime.utcnow(), lease_owner=None, lease_until=None)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@db_timed
+async def retry_outbox_async(ids: list[int], delay: float, count_attempt: bool = True) -> None:
+    """Release the rows and make them due again in `delay` seconds."""
+    values = {
+        "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+        "lease_owner": None,
+        "lease_until": None,
+    }
+    if count_attempt:
+        values["attempts"] = OutboxMessage.attempts + 1
+    async with get_async_db() as db:
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(ids))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@db_timed
+async def drop_outbox_async(ids: list[int]) -> None:
+    """Give up on rows that cannot be delivered (chat blocked the bot, attempts exhausted)."""
+    async with get_async_db() as db:
+        await db.execute(delete(OutboxMessage).where(OutboxMessage.id.in_(ids)))
+
+
+@db_timed
+async def release_outbox_async(owner: str) -> None:
+    """On shutdown: unsent rows this dispatcher still holds become claimable right away."""
+    async with get_async_db() as db:
+        await db.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.lease_owner == owner, OutboxMessage.sent_at == None)
+            .values(lease_owner=None, lease_until=None)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@db_timed
+async def compact_outbox_async() -> int:
+    """Delete rows sent more than OUTBOX_SENT_RETENTION ago."""
+    async with get_async_db() as db:
+        result = await db.execute(
+            delete(OutboxMessage).where(OutboxMessage.sent_at < datetime.utcnow() - OUTBOX_SENT_RETENTION)
+        )
+        return result.rowcount
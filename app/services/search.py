@@ -1,193 +1,234 @@
-"""Search and user DB operations."""
-import base64
-import json
+"""Statements and helpers of the search and user DB operations (executed by app.services.search_async)."""
 import logging
-import re
-from datetime import datetime
-from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timedelta
 
-from sqlalchemy import func
-from app.database import get_db
-from app.models import User, Search, SeenAd
+from sqlalchemy import delete, func, or_, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.database import engine
+from app.models import HostLimit, QuotaCounter, User, Search, SeenAd
+from app.search_url import SearchUrl, canonical_search_url, parse_search_url
 
 logger = logging.getLogger(__name__)
 
-AVITO_DOMAINS = ("avito.ru", "www.avito.ru", "m.avito.ru")
-
-
-def _extract_max_price_from_f_param(f_value: str) -> float | None:
-    """Извлечь макс. цену из параметра f (Avito кодирует фильтры в base64). Пример: ...XeyJmcm9tIjowLCJ0byI6MTAwMDAwMH0 -> to=1000000."""
-    if not f_value:
-        return None
-    # Ищем base64-подобную подстроку, начинающуюся с eyJ (base64 для "{")
-    match = re.search(r"eyJ[A-Za-z0-9+/=_-]+", f_value.replace("~", ""))
-    if not match:
-        return None
-    b64 = match.group(0)
-    # Добить padding при необходимости
-    pad = 4 - len(b64) % 4
-    if pad != 4:
-        b64 += "=" * pad
-    try:
-        data = json.loads(base64.b64decode(b64).decode("utf-8"))
-        if isinstance(data, dict) and "to" in data:
-            return float(data["to"])
-    except (ValueError, TypeError, UnicodeDecodeError):
-        pass
-    return None
+# Bind variables per statement SQLite accepts by default (SQLITE_MAX_VARIABLE_NUMBER before 3.32)
+SQLITE_MAX_VARIABLES = 999
+# last_seen_at of an ad still on the page is rewritten at most this often (kept below the retention window)
+SEEN_REFRESH_SECONDS = 86400
+# QuotaCounter row holding the number of searches on the server
+SEARCH_COUNTER = "searches"
+
+
+def _insert_chunk(columns: int) -> int:
+    """Rows per multi-row INSERT ... VALUES of `columns` columns, so it stays under SQLITE_MAX_VARIABLES."""
+    return SQLITE_MAX_VARIABLES // columns
+
+
+SEEN_INSERT_CHUNK = _insert_chunk(3)
 
 
-def _validate_avito_search_url(url: str) -> tuple[bool, str | None, float | None]:
-    """Check URL is Avito search and extract maxPrice. Returns (ok, error_message, max_price)."""
+def _validate_search_url(url: str) -> tuple[bool, str | None, SearchUrl | None]:
+    """Check the URL is an Avito search with maxPrice. Returns (ok, error_message, parsed link stored with the search)."""
     try:
-        parsed = urlparse(url)
-    except Exception:
+        parsed = parse_search_url(url)
+    except ValueError:
         return False, "Некорректная ссылка.", None
     if parsed.scheme not in ("http", "https"):
         return False, "Ссылка должна начинаться с http или https.", None
-    netloc = (parsed.netloc or "").lower().replace("www.", "")
-    if not any(netloc == d or netloc.endswith("." + d) for d in AVITO_DOMAINS):
+    if not parsed.is_avito:
         return False, "Поддерживаются только ссылки на поиск Avito.", None
-    qs = parse_qs(parsed.query)
-    price_val = None
-    # 1) Явный параметр maxPrice / max_price
-    max_price = qs.get("maxPrice") or qs.get("max_price")
-    if max_price and len(max_price) >= 1:
-        try:
-            price_val = float(max_price[0].replace(" ", "").replace(",", "."))
-        except (ValueError, TypeError):
-            pass
-    # 2) Фильтр в параметре f (формат Avito с кодированными фильтрами)
-    if price_val is None and "f" in qs and qs["f"]:
-        price_val = _extract_max_price_from_f_param(qs["f"][0])
-    if price_val is None:
+    if parsed.max_price is None:
         return False, "В ссылке нет максимальной цены. На Avito в фильтрах укажите макс. цену (если не важна — например 100000000), обновите страницу и скопируйте ссылку заново. Либо добавьте в конец ссылки: &maxPrice=100000000", None
-    if price_val <= 0:
+    if parsed.max_price <= 0:
         return False, "Максимальная цена должна быть больше 0.", None
-    return True, None, price_val
-
-
-def ensure_user(telegram_id: int) -> User:
-    """Get or create user by telegram_id."""
-    with get_db() as db:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            user = User(telegram_id=telegram_id)
-            db.add(user)
-            db.flush()
-        return user
-
-
-def add_search(telegram_id: int, search_url: str, search_name: str) -> tuple[bool, str, int | None]:
-    """
-    Validate URL, check limits, add search. Returns (success, message, search_id or None).
-    """
-    ok, err, max_price = _validate_avito_search_url(search_url)
-    if not ok:
-        return False, err or "Ошибка валидации.", None
-
-    with get_db() as db:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            user = User(telegram_id=telegram_id)
-            db.add(user)
-            db.flush()
-        from config import settings
-        count = db.query(func.count(Search.id)).scalar()
-        if count >= settings.max_searches:
-            return False, f"Достигнут лимит поисков на сервере ({settings.max_searches}). Попробуйте позже.", None
-        search = Search(
-            user_id=user.id,
-            search_url=search_url.strip(),
-            max_price=max_price,
-            name=search_name or "Поиск",
-            is_active=True,
+    return True, None, parsed
+
+
+def _search_url_fields(parsed: SearchUrl) -> dict:
+    """Search columns filled from the parsed link."""
+    return {
+        "search_url": parsed.url,
+        "canonical_url": parsed.canonical,
+        "max_price": parsed.max_price,
+        "min_price": parsed.min_price,
+        "filters": parsed.filters or None,
+        "region": parsed.region,
+        "category": parsed.category,
+    }
+
+
+def _reserve_user_slot_stmt(user_id: int):
+    """Take one of the user's search slots; no row comes back when the quota is used up."""
+    from config import settings
+    stmt = update(User).where(User.id == user_id).values(search_count=User.search_count + 1)
+    if settings.max_searches_per_user:
+        stmt = stmt.where(User.search_count < settings.max_searches_per_user)
+    return stmt.returning(User.search_count).execution_options(synchronize_session=False)
+
+
+def _reserve_global_slot_stmt():
+    """Count the search on the server; no row comes back at MAX_SEARCHES (or before the counter exists)."""
+    from config import settings
+    stmt = update(QuotaCounter).where(QuotaCounter.name == SEARCH_COUNTER).values(value=QuotaCounter.value + 1)
+    if settings.max_searches:
+        stmt = stmt.where(QuotaCounter.value < settings.max_searches)
+    return stmt.returning(QuotaCounter.value).execution_options(synchronize_session=False)
+
+
+def _init_global_counter_stmt():
+    """Create the search counter from count(*) once (a DB made by init_db has none)."""
+    return (
+        _insert_for_dialect()(QuotaCounter)
+        .values(name=SEARCH_COUNTER, value=select(func.count(Search.id)).scalar_subquery())
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+
+
+def _release_slot_stmts(user_id: int, user_slot: bool = True, global_slot: bool = True) -> list:
+    stmts = []
+    if user_slot:
+        stmts.append(update(User).where(User.id == user_id).values(search_count=User.search_count - 1))
+    if global_slot:
+        stmts.append(
+            update(QuotaCounter).where(QuotaCounter.name == SEARCH_COUNTER).values(value=QuotaCounter.value - 1)
         )
-        db.add(search)
-        db.flush()
-        search_id = search.id
-    return True, f"Поиск «{search_name or 'Поиск'}» добавлен. Ожидайте уведомления о новых объявлениях.", search_id
+    return [stmt.execution_options(synchronize_session=False) for stmt in stmts]
 
 
-def get_active_searches(limit: int = 20) -> list[dict]:
-    """Return list of active, non-blocked searches. Closes DB session before returning."""
+def _quota_message(per_user: bool) -> str:
     from config import settings
-    from datetime import datetime as dt
-    now = dt.utcnow()
-    with get_db() as db:
-        rows = (
-            db.query(Search.id, User.telegram_id, Search.search_url, Search.name, Search.last_check_at)
-            .join(User, Search.user_id == User.id)
-            .filter(Search.is_active == True)
-            .filter((Search.blocked_until == None) | (Search.blocked_until <= now))
-            .limit(limit)
-            .all()
+    if per_user:
+        return (
+            f"У вас уже {settings.max_searches_per_user} поисков — это максимум. "
+            "Удалите ненужный: /my_searches"
         )
-        return [
-            {
-                "search_id": r.id,
-                "telegram_id": r.telegram_id,
-                "search_url": r.search_url,
-                "search_name": r.name,
-                "last_check_at": r.last_check_at,
-            }
-            for r in rows
-        ]
-
-
-def list_user_searches(telegram_id: int) -> list[dict]:
-    """Список поисков пользователя: [{"id": 1, "name": "...", "url": "..."}, ...]."""
-    with get_db() as db:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            return []
-        rows = db.query(Search.id, Search.name, Search.search_url).filter(
-            Search.user_id == user.id
-        ).order_by(Search.id).all()
-        return [
-            {"id": r.id, "name": r.name, "url": (r.search_url[:60] + "…") if len(r.search_url) > 60 else r.search_url}
-            for r in rows
-        ]
-
-
-def delete_search(telegram_id: int, search_id: int) -> tuple[bool, str]:
-    """Удалить поиск. Возвращает (успех, сообщение). Удалять можно только свой поиск."""
-    with get_db() as db:
-        user = db.query(User).filter(User.telegram_id == telegram_id).first()
-        if not user:
-            return False, "Пользователь не найден."
-        search = db.query(Search).filter(Search.id == search_id, Search.user_id == user.id).first()
-        if not search:
-            return False, "Поиск не найден или это не ваш поиск."
-        db.delete(search)
-    return True, "Поиск удалён. Можете добавить другую ссылку через /add_search"
-
-
-def get_seen_ad_ids(search_id: int) -> set[str]:
-    with get_db() as db:
-        rows = db.query(SeenAd.avito_ad_id).filter(SeenAd.search_id == search_id).all()
-        return {r[0] for r in rows}
-
-
-def mark_ad_seen(search_id: int, avito_ad_id: str) -> None:
-    with get_db() as db:
-        existing = db.query(SeenAd).filter(
-            SeenAd.search_id == search_id,
-            SeenAd.avito_ad_id == avito_ad_id,
-        ).first()
-        if not existing:
-            db.add(SeenAd(search_id=search_id, avito_ad_id=avito_ad_id))
-
-
-def update_last_check(search_id: int) -> None:
-    with get_db() as db:
-        s = db.query(Search).filter(Search.id == search_id).first()
-        if s:
-            s.last_check_at = datetime.utcnow()
-
-
-def set_search_blocked(search_id: int, blocked_until: datetime) -> None:
-    with get_db() as db:
-        s = db.query(Search).filter(Search.id == search_id).first()
-        if s:
-            s.blocked_until = blocked_until
+    return f"Достигнут лимит поисков на сервере ({settings.max_searches}). Попробуйте позже."
+
+
+def _search_columns_stmt():
+    """Columns of a search as the monitor sees it (see _active_search_dict)."""
+    return select(
+        Search.id, User.telegram_id, Search.search_url, Search.canonical_url, Search.name,
+        Search.min_price, Search.max_price, Search.last_check_at, Search.check_interval,
+    ).join(User, Search.user_id == User.id)
+
+
+def _active_searches_stmt(limit: int | None = None):
+    now = datetime.utcnow()
+    stmt = (
+        _search_columns_stmt()
+        .where(Search.is_active == True)
+        .where((Search.blocked_until == None) | (Search.blocked_until <= now))
+        .order_by(Search.last_check_at.asc().nulls_first(), Search.id)
+    )
+    return stmt.limit(limit) if limit is not None else stmt
+
+
+def _active_search_dict(r) -> dict:
+    return {
+        "search_id": r.id,
+        "telegram_id": r.telegram_id,
+        "search_url": r.search_url,
+        # Stored when the search was added; older rows without it are canonicalized on use
+        "canonical_url": r.canonical_url or canonical_search_url(r.search_url),
+        "search_name": r.name,
+        "min_price": float(r.min_price) if r.min_price is not None else None,
+        "max_price": float(r.max_price) if r.max_price is not None else None,
+        "last_check_at": r.last_check_at,
+        "check_interval": r.check_interval,
+    }
+
+
+def _user_search_dict(r) -> dict:
+    return {"id": r.id, "name": r.name, "url": (r.search_url[:60] + "…") if len(r.search_url) > 60 else r.search_url}
+
+
+def _insert_for_dialect():
+    return pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+
+
+def _seen_insert_stmt(chunk: list[tuple[int, str]], now: datetime):
+    return (
+        _insert_for_dialect()(SeenAd)
+        .values([
+            {"search_id": sid, "avito_ad_id": ad_id, "first_seen_at": now, "last_seen_at": now}
+            for sid, ad_id in chunk
+        ])
+        .on_conflict_do_nothing(index_elements=["search_id", "avito_ad_id"])
+        .returning(SeenAd.search_id, SeenAd.avito_ad_id)
+    )
+
+
+def _seen_refresh_stmt(chunk: list[tuple[int, str]], now: datetime):
+    """Touch last_seen_at of already seen ads, skipping rows refreshed recently (so it rarely writes)."""
+    from config import settings
+
+    refresh = min(SEEN_REFRESH_SECONDS, settings.seen_retention_days * 86400 // 4)
+    return (
+        update(SeenAd)
+        .where(tuple_(SeenAd.search_id, SeenAd.avito_ad_id).in_(chunk))
+        .where(or_(SeenAd.last_seen_at == None, SeenAd.last_seen_at < now - timedelta(seconds=refresh)))
+        .values(last_seen_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _retention_cutoff(now: datetime) -> datetime:
+    from config import settings
+
+    return now - timedelta(days=settings.seen_retention_days)
+
+
+def _compact_candidates_stmt(cutoff: datetime):
+    """Searches that have at least one row past the retention window."""
+    return select(SeenAd.search_id).where(SeenAd.last_seen_at < cutoff).distinct()
+
+
+def _keep_threshold_stmt(search_id: int, keep: int):
+    """(last_seen_at, id) of the keep-th newest row of a search (no row when it has fewer)."""
+    return (
+        select(SeenAd.last_seen_at, SeenAd.id)
+        .where(SeenAd.search_id == search_id)
+        .order_by(SeenAd.last_seen_at.desc(), SeenAd.id.desc())
+        .offset(keep - 1)
+        .limit(1)
+    )
+
+
+def _compact_batch_stmt(search_id: int, cutoff: datetime, threshold, batch: int):
+    """Delete up to `batch` rows past the window that are older than the keep threshold."""
+    seen_at, row_id = threshold
+    ids = (
+        select(SeenAd.id)
+        .where(SeenAd.search_id == search_id, SeenAd.last_seen_at < cutoff)
+        .where(or_(SeenAd.last_seen_at < seen_at, (SeenAd.last_seen_at == seen_at) & (SeenAd.id < row_id)))
+        .limit(batch)
+    )
+    return delete(SeenAd).where(SeenAd.id.in_(ids.scalar_subquery())).execution_options(synchronize_session=False)
+
+
+def _host_limit_dict(r: HostLimit) -> dict:
+    return {
+        "host": r.host,
+        "rate": r.rate,
+        "failures": r.failures,
+        "error_rate": r.error_rate,
+        "open_until": r.open_until,
+    }
+
+
+def _host_limits_upsert_stmt(rows: list[dict]):
+    now = datetime.utcnow()
+    stmt = _insert_for_dialect()(HostLimit).values([{**r, "updated_at": now} for r in rows])
+    return stmt.on_conflict_do_update(
+        index_elements=["host"],
+        set_={
+            "rate": stmt.excluded.rate,
+            "failures": stmt.excluded.failures,
+            "error_rate": stmt.excluded.error_rate,
+            "open_until": stmt.excluded.open_until,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
@@ -0,0 +1,371 @@
+"""Search, user and seen-ad DB operations (async; statements are built in app.services.search)."""
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from sqlalchemy import delete, or_, select, update
+
+from config import settings
+from app.database import get_async_db
+from app.metrics import db_timed
+from app.models import HostLimit, User, Search, SeenAd
+from app.search_url import SearchUrl
+from app.services.outbox import add_outbox_rows
+from app.services.user_cache import user_ids, user_searches
+from app.services.search import (
+    SEEN_INSERT_CHUNK,
+    _active_search_dict,
+    _active_searches_stmt,
+    _compact_batch_stmt,
+    _compact_candidates_stmt,
+    _keep_threshold_stmt,
+    _retention_cutoff,
+    _search_columns_stmt,
+    _host_limit_dict,
+    _host_limits_upsert_stmt,
+    _init_global_counter_stmt,
+    _quota_message,
+    _release_slot_stmts,
+    _reserve_global_slot_stmt,
+    _reserve_user_slot_stmt,
+    _seen_insert_stmt,
+    _seen_refresh_stmt,
+    _user_search_dict,
+    _search_url_fields,
+    _validate_search_url,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def _get_or_create_user(db, telegram_id: int) -> User:
+    """
+    Within the caller's transaction; the caller caches the id only after the commit, so an insert
+    that is rolled back never leaves its id in user_ids.
+    """
+    user = (await db.execute(select(User).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+    if not user:
+        user = User(telegram_id=telegram_id)
+        db.add(user)
+        await db.flush()
+    return user
+
+
+async def _user_id(db, telegram_id: int) -> int:
+    """User id from the cache, else get or create the user (not cached yet, see _get_or_create_user)."""
+    user_id = user_ids.get(telegram_id)
+    return user_id if user_id is not None else (await _get_or_create_user(db, telegram_id)).id
+
+
+@db_timed
+async def ensure_user_async(telegram_id: int) -> User:
+    """Get or create user by telegram_id."""
+    async with get_async_db() as db:
+        user = await _get_or_create_user(db, telegram_id)
+    user_ids.set(telegram_id, user.id)
+    return user
+
+
+async def ensure_user_id_async(telegram_id: int) -> int:
+    """Id of the user (created if needed); no DB round-trip once cached."""
+    user_id = user_ids.get(telegram_id)
+    if user_id is not None:
+        return user_id
+    return (await ensure_user_async(telegram_id)).id
+
+
+@db_timed
+async def add_search_async(telegram_id: int, search_url: str, search_name: str) -> tuple[bool, str, int | None]:
+    """
+    Validate URL, check limits, add search. Returns (success, message, search_id or None).
+    The quotas are taken by conditional UPDATEs in the insert's transaction, so concurrent adds cannot overshoot.
+    """
+    ok, err, parsed = _validate_search_url(search_url)
+    if not ok:
+        return False, err or "Ошибка валидации.", None
+
+    async with get_async_db() as db:
+        user_id = await _user_id(db, telegram_id)
+        search_id, quota_error = await _insert_search(db, user_id, parsed, search_name)
+    user_ids.set(telegram_id, user_id)
+    if quota_error:
+        return False, quota_error, None
+    user_searches.pop(telegram_id)
+    return True, f"Поиск «{search_name or 'Поиск'}» добавлен. Ожидайте уведомления о новых объявлениях.", search_id
+
+
+async def _insert_search(db, user_id: int, parsed: SearchUrl, search_name: str) -> tuple[int | None, str | None]:
+    """Take the user's and the global quota slot and insert the search: (search id, None) or (None, quota message)."""
+    if (await db.execute(_reserve_user_slot_stmt(user_id))).first() is None:
+        return None, _quota_message(per_user=True)
+    if (await db.execute(_reserve_global_slot_stmt())).first() is None:
+        await db.execute(_init_global_counter_stmt())
+        if (await db.execute(_reserve_global_slot_stmt())).first() is None:
+            for stmt in _release_slot_stmts(user_id, global_slot=False):
+                await db.execute(stmt)
+            return None, _quota_message(per_user=False)
+    search = Search(
+        user_id=user_id,
+        name=search_name or "Поиск",
+        is_active=True,
+        **_search_url_fields(parsed),
+    )
+    db.add(search)
+    await db.flush()
+    return search.id, None
+
+
+@db_timed
+async def get_active_searches_async(limit: int | None = None) -> list[dict]:
+    """Return active, non-blocked searches, least recently checked first."""
+    async with get_async_db() as db:
+        return [_active_search_dict(r) for r in await db.execute(_active_searches_stmt(limit))]
+
+
+@db_timed
+async def _load_user_searches(telegram_id: int) -> list[dict]:
+    async with get_async_db() as db:
+        rows = await db.execute(
+            select(Search.id, Search.name, Search.search_url)
+            .join(User, Search.user_id == User.id)
+            .where(User.telegram_id == telegram_id)
+            .order_by(Search.id)
+        )
+        return [_user_search_dict(r) for r in rows]
+
+
+async def list_user_searches_async(telegram_id: int) -> list[dict]:
+    """Список поисков пользователя: [{"id": 1, "name": "...", "url": "..."}, ...] (из кэша, если есть)."""
+    searches = user_searches.get(telegram_id)
+    if searches is None:
+        searches = await _load_user_searches(telegram_id)
+        user_searches.set(telegram_id, searches)
+    return searches
+
+
+@db_timed
+async def delete_search_async(telegram_id: int, search_id: int) -> tuple[bool, str]:
+    """Удалить поиск. Возвращает (успех, сообщение). Удалять можно только свой поиск."""
+    async with get_async_db() as db:
+        user_id = user_ids.get(telegram_id)
+        if user_id is None:
+            user_id = (await db.execute(select(User.id).where(User.telegram_id == telegram_id))).scalar_one_or_none()
+            if user_id is None:
+                return False, "Пользователь не найден."
+            user_ids.set(telegram_id, user_id)
+        # The owner check is part of both deletes; seen_ads first (see app.models)
+        owned = select(Search.id).where(Search.id == search_id, Search.user_id == user_id)
+        await db.execute(delete(SeenAd).where(SeenAd.search_id.in_(owned.scalar_subquery())))
+        result = await db.execute(delete(Search).where(Search.id == search_id, Search.user_id == user_id))
+        if not result.rowcount:
+            return False, "Поиск не найден или это не ваш поиск."
+        for stmt in _release_slot_stmts(user_id):
+            await db.execute(stmt)
+    user_searches.pop(telegram_id)
+    return True, "Поиск удалён. Можете добавить другую ссылку через /add_search"
+
+
+async def delete_search_by_number_async(telegram_id: int, number: int) -> tuple[bool, str]:
+    """Удалить поиск по номеру в списке /my_searches (список из кэша или одним запросом)."""
+    searches = await list_user_searches_async(telegram_id)
+    if number < 1 or number > len(searches):
+        if not searches:
+            return False, "У вас пока нет сохранённых поисков. Добавьте: /add_search"
+        return False, f"Нет поиска с номером {number}. Ваши номера: 1–{len(searches)}. Список: /my_searches"
+    return await delete_search_async(telegram_id, searches[number - 1]["id"])
+
+
+@db_timed
+async def load_seen_ads_async(search_ids: list[int]) -> dict[int, list[str]]:
+    """All seen ad ids of these searches, by search (cache warm-up)."""
+    out: dict[int, list[str]] = {search_id: [] for search_id in search_ids}
+    if not search_ids:
+        return out
+    async with get_async_db() as db:
+        rows = await db.execute(
+            select(SeenAd.search_id, SeenAd.avito_ad_id).where(SeenAd.search_id.in_(search_ids))
+        )
+        for search_id, ad_id in rows:
+            out[search_id].append(ad_id)
+    return out
+
+
+@db_timed
+async def get_searches_by_seen_ads_async(avito_ids: list[str]) -> dict[str, list[dict]]:
+    """
+    Active searches that have seen each of these ads, by avito id (dicts as get_active_searches_async);
+    price drops go to all of them, not only to the searches whose page was just fetched.
+    """
+    out: dict[str, list[dict]] = {}
+    if not avito_ids:
+        return out
+    async with get_async_db() as db:
+        rows = await db.execute(
+            _active_searches_stmt()
+            .add_columns(SeenAd.avito_ad_id)
+            .join(SeenAd, SeenAd.search_id == Search.id)
+            .where(SeenAd.avito_ad_id.in_(avito_ids))
+        )
+        for r in rows:
+            out.setdefault(r.avito_ad_id, []).append(_active_search_dict(r))
+    return out
+
+
+@db_timed
+async def filter_unseen_ads_async(
+    pairs: Iterable[tuple[int, str]],
+    outbox: Callable[[set[tuple[int, str]]], list[dict]] | None = None,
+) -> set[tuple[int, str]]:
+    """
+    Bulk dedup for a whole check cycle: mark every (search_id, avito_ad_id) as seen and return
+    only the pairs that were not seen before. One INSERT ... ON CONFLICT DO NOTHING ... RETURNING
+    per chunk (PostgreSQL and SQLite >= 3.35 share this path). `outbox` maps the new pairs to
+    notification outbox rows, inserted in the same transaction: an ad is marked seen only together
+    with its pending notification.
+    """
+    unique = list(dict.fromkeys(pairs))
+    if not unique and outbox is None:
+        return set()
+    now = datetime.utcnow()
+    new: set[tuple[int, str]] = set()
+    async with get_async_db() as db:
+        for i in range(0, len(unique), SEEN_INSERT_CHUNK):
+            chunk = unique[i:i + SEEN_INSERT_CHUNK]
+            new.update((r[0], r[1]) for r in await db.execute(_seen_insert_stmt(chunk, now)))
+            old = [p for p in chunk if p not in new]
+            if old:
+                await db.execute(_seen_refresh_stmt(old, now))
+        if outbox is not None:
+            await add_outbox_rows(db, outbox(new))
+    return new
+
+
+@db_timed
+async def compact_seen_ads_async() -> int:
+    """
+    Retention for seen_ads: delete rows not seen for SEEN_RETENTION_DAYS unless they are among the
+    SEEN_KEEP_PER_SEARCH newest of their search (ads still on an unchanged page must stay known).
+    Deletes at most SEEN_COMPACT_BATCH rows per transaction. Returns the number of rows deleted.
+    """
+    cutoff = _retention_cutoff(datetime.utcnow())
+    keep, batch = settings.seen_keep_per_search, settings.seen_compact_batch
+    async with get_async_db() as db:
+        search_ids = [r[0] for r in await db.execute(_compact_candidates_stmt(cutoff))]
+    deleted = 0
+    for search_id in search_ids:
+        async with get_async_db() as db:
+            threshold = (await db.execute(_keep_threshold_stmt(search_id, keep))).first()
+        if threshold is None:
+            continue
+        while True:
+            async with get_async_db() as db:
+                count = (await db.execute(_compact_batch_stmt(search_id, cutoff, tuple(threshold), batch))).rowcount
+            deleted += count
+            if count < batch:
+                break
+    return deleted
+
+
+@db_timed
+async def update_last_check_many_async(search_ids: list[int]) -> None:
+    """Stamp last_check_at for all searches checked in a cycle with one UPDATE."""
+    if not search_ids:
+        return
+    async with get_async_db() as db:
+        await db.execute(update(Search).where(Search.id.in_(search_ids)).values(last_check_at=datetime.utcnow()))
+
+
+@db_timed
+async def load_host_limits_async() -> list[dict]:
+    """Saved limiter state for all hosts (HostLimiter.restore format)."""
+    async with get_async_db() as db:
+        return [_host_limit_dict(r) for r in (await db.execute(select(HostLimit))).scalars()]
+
+
+@db_timed
+async def save_host_limits_async(rows: list[dict]) -> None:
+    """Upsert limiter state (HostLimiter.snapshot format) in one statement."""
+    if not rows:
+        return
+    async with get_async_db() as db:
+        await db.execute(_host_limits_upsert_stmt(rows))
+
+
+@db_timed
+async def claim_due_searches_async(worker_id: str, limit: int, lease_seconds: int) -> list[dict]:
+    """
+    Lease due pages to this worker (same dicts as get_active_searches_async): the `limit` most
+    overdue searches pick the pages (canonical URLs), and every free active search of those pages
+    is leased with them, so each page is fetched once for all its subscribers. Rows locked by
+    another worker's claim are skipped (FOR UPDATE SKIP LOCKED on PostgreSQL; SQLite serializes
+    writers, so the plain UPDATE is already exclusive).
+    """
+    now = datetime.utcnow()
+    free = (
+        (Search.is_active == True)
+        & ((Search.blocked_until == None) | (Search.blocked_until <= now))
+        & ((Search.lease_until == None) | (Search.lease_until < now))
+    )
+    due = (
+        select(Search.id, Search.canonical_url)
+        .where(free)
+        .where((Search.next_check_at == None) | (Search.next_check_at <= now))
+        .order_by(Search.next_check_at.asc().nulls_first(), Search.id)
+        .limit(limit)
+    )
+    async with get_async_db() as db:
+        rows = (await db.execute(due)).all()
+        if not rows:
+            return []
+        urls = {r.canonical_url for r in rows if r.canonical_url}
+        # Rows from before canonical_url was stored are leased on their own
+        loose = [r.id for r in rows if not r.canonical_url]
+        pages = (
+            select(Search.id)
+            .where(free)
+            .where(or_(Search.canonical_url.in_(urls), Search.id.in_(loose)))
+            .order_by(Search.id)
+            .with_for_update(skip_locked=True)
+        )
+        result = await db.execute(
+            update(Search)
+            .where(Search.id.in_(pages.scalar_subquery()))
+            .values(lease_owner=worker_id, lease_until=now + timedelta(seconds=lease_seconds))
+            .returning(Search.id)
+            .execution_options(synchronize_session=False)
+        )
+        ids = [r[0] for r in result]
+        if not ids:
+            return []
+        rows = await db.execute(_search_columns_stmt().where(Search.id.in_(ids)).order_by(Search.id))
+        return [_active_search_dict(r) for r in rows]
+
+
+@db_timed
+async def extend_leases_async(worker_id: str, search_ids: list[int], lease_seconds: int) -> None:
+    """Heartbeat: push lease_until forward for searches this worker still holds."""
+    if not search_ids:
+        return
+    async with get_async_db() as db:
+        await db.execute(
+            update(Search)
+            .where(Search.id.in_(search_ids), Search.lease_owner == worker_id)
+            .values(lease_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+
+
+@db_timed
+async def release_searches_async(worker_id: str, next_checks: dict[int, datetime]) -> None:
+    """Drop this worker's leases and set next_check_at; one UPDATE per distinct next_check_at."""
+    by_time: dict[datetime, list[int]] = {}
+    for search_id, next_check_at in next_checks.items():
+        by_time.setdefault(next_check_at, []).append(search_id)
+    async with get_async_db() as db:
+        for next_check_at, ids in by_time.items():
+            await db.execute(
+                update(Search)
+                .where(Search.id.in_(ids), Search.lease_owner == worker_id)
+                .values(lease_owner=None, lease_until=None, next_check_at=next_check_at)
+                .execution_options(synchronize_session=False)
+            )
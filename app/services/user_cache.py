@@ -0,0 +1,58 @@
+"""
+Read-through caches for the bot handlers: telegram_id -> user id and telegram_id -> search list.
+Only the bot process changes users and searches, so its own writes invalidate the entries; the TTL
+bounds staleness across processes (several API workers in webhook mode).
+"""
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+from config import settings
+from app.metrics import USER_CACHE_LOOKUPS
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """LRU of at most `maxsize` entries, each valid for `ttl` seconds after it was stored."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[0] <= time.monotonic():
+            if entry is not _MISSING:
+                del self._entries[key]
+            USER_CACHE_LOOKUPS.labels(cache=self.name, result="miss").inc()
+            return default
+        self._entries.move_to_end(key)
+        USER_CACHE_LOOKUPS.labels(cache=self.name, result="hit").inc()
+        return entry[1]
+
+    def set(self, key: K, value: V) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+user_ids: TTLCache[int, int] = TTLCache("user_id", settings.user_cache_size, settings.user_cache_ttl_seconds)
+user_searches: TTLCache[int, list[dict]] = TTLCache(
+    "user_searches", settings.user_cache_size, settings.user_cache_ttl_seconds
+)
@@ -0,0 +1 @@
+# Offline benchmarks for the parse and check pipeline
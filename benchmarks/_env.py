@@ -0,0 +1,21 @@
+"""Settings for benchmark runs; imported before anything from app/config reads the environment."""
+import os
+import tempfile
+
+BENCH_DIR = tempfile.mkdtemp(prefix="avito-bench-")
+BENCH_DB = os.path.join(BENCH_DIR, "bench.sqlite")
+
+os.environ.update(
+    {
+        "BOT_TOKEN": "123456:bench",
+        "DATABASE_URL": f"sqlite:///{BENCH_DB}",
+        # The stub host must not be what limits throughput
+        "HOST_RATE_INITIAL": "100000",
+        "HOST_RATE_MAX": "100000",
+        "FETCH_CONCURRENCY": os.environ.get("FETCH_CONCURRENCY", "64"),
+        "FETCH_PER_HOST_CONCURRENCY": os.environ.get("FETCH_PER_HOST_CONCURRENCY", "64"),
+        "NOTIFY_GLOBAL_RATE": "100000",
+        "NOTIFY_PER_CHAT_INTERVAL": "0",
+        "NOTIFY_WORKERS": "16",
+    }
+)
@@ -0,0 +1,158 @@
+"""
+Full check-cycle benchmark: thousands of searches against a local stub Avito server, a stub
+Telegram Bot API and SQLite. Every cycle each page gains `new_per_cycle` ads at the top.
+"""
+import asyncio
+import resource
+import time
+
+from aiohttp import web
+
+from benchmarks import _env
+from benchmarks.fixtures import ITEMS_PER_PAGE, make_items, page_json_script
+from app.database import get_db, init_db
+from app.models import Search, User
+
+
+class StubAvito:
+    """Serves /search/<n>; the items of page n at cycle c start at id n·10⁶ + c·new_per_cycle (newest first)."""
+
+    def __init__(self, new_per_cycle: int, blocks: int) -> None:
+        self.new_per_cycle = new_per_cycle
+        self.blocks = blocks
+        self.cycle = 0
+        self.requests = 0
+        self._cache: dict[tuple[int, int], str] = {}
+
+    def page(self, n: int) -> str:
+        key = (n, self.cycle)
+        html = self._cache.get(key)
+        if html is None:
+            top = n * 1_000_000 + self.cycle * self.new_per_cycle
+            items = list(reversed(make_items(top - ITEMS_PER_PAGE + 1, seed=n)))
+            html = self._cache[key] = page_json_script(items, blocks=self.blocks)
+            self._cache.pop((n, self.cycle - 1), None)
+        return html
+
+    def prepare(self, pages: int) -> None:
+        """Render the current cycle's pages up front so rendering is not timed as part of the check."""
+        for n in range(pages):
+            self.page(n)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        return web.Response(text=self.page(int(request.match_info["n"])), content_type="text/html")
+
+
+class StubTelegram:
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = await request.post() if request.content_type != "application/json" else await request.json()
+        self.sent += 1
+        chat_id = int(data.get("chat_id", 0))
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": self.sent,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "ok",
+                },
+            }
+        )
+
+
+async def _serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def _seed(base_url: str, searches: int, urls: int) -> None:
+    init_db()
+    with get_db() as db:
+        users = [User(telegram_id=1_000_000 + i) for i in range(searches)]
+        db.add_all(users)
+        db.flush()
+        db.add_all(
+            Search(
+                user_id=u.id,
+                search_url=f"{base_url}/search/{i % urls}",
+                max_price=10_000_000,
+                name=f"Поиск {i}",
+                is_active=True,
+            )
+            for i, u in enumerate(users)
+        )
+
+
+async def bench_cycle(searches: int = 2000, urls: int = 500, cycles: int = 3, new_per_cycle: int = 2, blocks: int = 500) -> dict:
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from app.catalog import make_ad_catalog
+    from app.monitor import PageChecker, make_fetcher, make_parse_executor, run_check_async
+    from app.notifier import make_dispatcher
+    from app.seen_cache import make_seen_cache
+
+    avito, telegram = StubAvito(new_per_cycle, blocks), StubTelegram()
+    avito_app, tg_app = web.Application(), web.Application()
+    avito_app.router.add_get("/search/{n}", avito.handle)
+    tg_app.router.add_post("/bot{token}/{method}", telegram.handle)
+    avito_runner, avito_url = await _serve(avito_app)
+    tg_runner, tg_url = await _serve(tg_app)
+    _seed(avito_url, searches, urls)
+
+    bot = Bot(token="123456:bench", session=AiohttpSession(api=TelegramAPIServer.from_base(tg_url)))
+    fetcher = await make_fetcher()
+    parser = make_parse_executor()
+    notifier = make_dispatcher(bot)
+    notifier.start()
+    seen = make_seen_cache()
+    checker = PageChecker(fetcher, parser, notifier, seen, make_ad_catalog())
+    results = []
+    try:
+        for cycle in range(cycles):
+            avito.cycle = cycle
+            avito.prepare(urls)
+            fetched, sent = avito.requests, telegram.sent
+            start = time.perf_counter()
+            await run_check_async(checker)
+            checked = time.perf_counter() - start
+            await notifier.join()
+            total = time.perf_counter() - start
+            results.append(
+                {
+                    "cycle": cycle,
+                    "check_s": round(checked, 3),
+                    "with_notifications_s": round(total, 3),
+                    "pages_fetched": avito.requests - fetched,
+                    "messages_sent": telegram.sent - sent,
+                    "searches_per_sec": round(searches / checked, 1),
+                }
+            )
+    finally:
+        await notifier.stop(drain_timeout=1)
+        await fetcher.close()
+        parser.shutdown()
+        await bot.session.close()
+        await avito_runner.cleanup()
+        await tg_runner.cleanup()
+    return {
+        "searches": searches,
+        "distinct_urls": urls,
+        "new_per_cycle": new_per_cycle,
+        "db": _env.BENCH_DB,
+        "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "cycles": results,
+    }
+
+
+def run(**kwargs) -> dict:
+    return asyncio.run(bench_cycle(**kwargs))
@@ -0,0 +1,51 @@
+"""Parse benchmark: time, memory peak and ads/s of parse_search_page per fixture."""
+import statistics
+import time
+import tracemalloc
+
+from benchmarks import _env  # noqa: F401  (must precede app imports)
+from app.parser import avito
+
+
+def _timed(fn, html: str, repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _peak_kib(fn, html: str) -> float:
+    tracemalloc.start()
+    try:
+        fn(html)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_fixture(name: str, html: str, repeat: int = 20, legacy_repeat: int = 3) -> dict:
+    avito._known_items_path.clear()
+    start = time.perf_counter()
+    ads = avito.parse_search_page(html)
+    cold = time.perf_counter() - start
+    warm = _timed(avito.parse_search_page, html, repeat)
+    legacy = _timed(avito._extract_json_from_script, html, legacy_repeat)
+    median = statistics.median(warm)
+    return {
+        "fixture": name,
+        "bytes": len(html.encode("utf-8")),
+        "ads": len(ads),
+        "cold_ms": round(cold * 1000, 3),
+        "parse_ms_median": round(median * 1000, 3),
+        "parse_ms_max": round(max(warm) * 1000, 3),
+        "legacy_ms_median": round(statistics.median(legacy) * 1000, 3),
+        "speedup_vs_legacy": round(statistics.median(legacy) / median, 1) if median else None,
+        "peak_kib": round(_peak_kib(avito.parse_search_page, html), 1),
+        "ads_per_sec": round(len(ads) / median, 1) if median else None,
+    }
+
+
+def run(fixtures: dict[str, str], repeat: int = 20) -> list[dict]:
+    return [bench_fixture(name, html, repeat) for name, html in fixtures.items()]
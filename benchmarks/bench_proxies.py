@@ -0,0 +1,115 @@
+"""
+Proxy pool throughput: a stub origin that allows `budget` requests/s per client egress (429 above
+it, like Avito per IP) behind N local stand-in forward proxies. Sustained 200s/s should grow
+roughly linearly with N.
+"""
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks import _env  # noqa: F401
+from benchmarks.fixtures import ITEMS_PER_PAGE, make_items, page_json_script
+
+EGRESS_HEADER = "X-Bench-Egress"
+
+
+class StubOrigin:
+    """Token bucket of `budget` req/s per egress (the header set by the stand-in proxy)."""
+
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.page = page_json_script(make_items(1, ITEMS_PER_PAGE), blocks=50)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self.ok = self.blocked = 0
+
+    async def handle(self, request: web.BaseRequest) -> web.Response:
+        egress = request.headers.get(EGRESS_HEADER, "direct")
+        now = time.monotonic()
+        tokens, at = self._buckets.get(egress, (self.budget, now))
+        tokens = min(self.budget, tokens + (now - at) * self.budget)
+        if tokens < 1:
+            self._buckets[egress] = (tokens, now)
+            self.blocked += 1
+            return web.Response(status=429)
+        self._buckets[egress] = (tokens - 1, now)
+        self.ok += 1
+        return web.Response(text=self.page, content_type="text/html")
+
+
+class StandInProxy:
+    """Minimal forward proxy for plain-HTTP targets (absolute-form request line)."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._session: aiohttp.ClientSession | None = None
+
+    async def handle(self, request: web.BaseRequest) -> web.Response:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in ("host", "proxy-connection")}
+        headers[EGRESS_HEADER] = self.name
+        async with self._session.get(str(request.url), headers=headers) as r:
+            return web.Response(status=r.status, body=await r.read(), content_type=r.content_type)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+async def _serve(handler) -> tuple[web.ServerRunner, str]:
+    runner = web.ServerRunner(web.Server(handler), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def _measure(origin_url: str, proxy_urls: list[str], budget: float, seconds: float) -> dict:
+    from app.parser.fetcher import AsyncFetcher
+    from app.parser.proxies import ProxyPool
+    from app.parser.ratelimit import HostLimiter
+
+    # Paced slightly under the origin's budget, as the AIMD limiter settles in production
+    limiter = HostLimiter(initial_rate=budget * 0.9, max_rate=budget * 0.9, backoff_base=1.0, backoff_max=2.0)
+    pool = ProxyPool(proxy_urls, include_direct=False, per_egress=8)
+    fetcher = AsyncFetcher(concurrency=8 * len(proxy_urls), per_host=8, limiter=limiter, proxies=pool)
+    ok = blocked = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() < deadline:
+            results = await fetcher.fetch_many([f"{origin_url}/search?p={i}" for i in range(8 * len(proxy_urls))])
+            ok += sum(1 for status, _, _ in results if status == 200)
+            blocked += sum(1 for status, _, _ in results if status in (403, 429))
+    finally:
+        elapsed = time.perf_counter() - start
+        await fetcher.close()
+    return {
+        "proxies": len(proxy_urls),
+        "ok_per_sec": round(ok / elapsed, 1),
+        "blocked": blocked,
+        "egresses": pool.stats(),
+    }
+
+
+async def bench_proxies(counts: tuple[int, ...] = (1, 2, 4), budget: float = 20.0, seconds: float = 3.0) -> dict:
+    origin = StubOrigin(budget)
+    origin_runner, origin_url = await _serve(origin.handle)
+    proxies = [StandInProxy(f"p{i}") for i in range(max(counts))]
+    served = [await _serve(p.handle) for p in proxies]
+    results = []
+    try:
+        for n in counts:
+            results.append(await _measure(origin_url, [url for _, url in served[:n]], budget, seconds))
+    finally:
+        for proxy, (runner, _) in zip(proxies, served):
+            await proxy.close()
+            await runner.cleanup()
+        await origin_runner.cleanup()
+    return {"budget_per_egress": budget, "seconds": seconds, "runs": results}
+
+
+def run(**kwargs) -> dict:
+    return asyncio.run(bench_proxies(**kwargs))
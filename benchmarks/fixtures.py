@@ -0,0 +1,110 @@
+"""
+Search-page fixtures: one page per extraction path of app.parser.avito.
+
+Generated pages mimic the layout of real Avito search results (large markup, embedded state,
+50 items). Real recorded pages dropped into benchmarks/fixtures/*.html are loaded as well,
+so the same harness can be run against live captures.
+"""
+import json
+import random
+from pathlib import Path
+from urllib.parse import quote
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+ITEMS_PER_PAGE = 50
+
+
+def make_items(first_id: int, count: int = ITEMS_PER_PAGE, seed: int = 0) -> list[dict]:
+    rnd = random.Random(seed)
+    items = []
+    for i in range(count):
+        ad_id = first_id + i
+        # Stable per ad, so consecutive cycles do not look like price changes
+        price = random.Random(ad_id).randrange(1_000, 500_000, 500)
+        items.append(
+            {
+                "id": ad_id,
+                "categoryId": 24,
+                "title": f"Объявление {ad_id}, {rnd.choice(['б/у', 'новый', 'отличное состояние'])}",
+                "price": {"value": price, "string": f"{price:,} ₽".replace(",", " ")},
+                "priceDetailed": {"value": price, "string": f"{price:,} ₽".replace(",", " "), "postfix": ""},
+                "url": f"/moskva/tovary/obyavlenie_{ad_id}",
+                "location": {"id": 637640, "name": "Москва"},
+                "geo": {"formattedAddress": "Москва, ул. Тверская", "geoReferences": [{"content": "Тверская"}]},
+                "sortTimeStamp": 1_760_000_000_000 - i * 60_000,
+                "images": [{"208x156": f"https://00.img.avito.st/image/1/{ad_id}{k}", "236x177": f"https://00.img.avito.st/image/2/{ad_id}{k}"} for k in range(5)],
+                "description": "Описание объявления. " * rnd.randint(3, 12),
+                "iva": {"DateInfoStep": [{"payload": {"absolute": "2 часа назад"}}]},
+            }
+        )
+    return items
+
+
+def _state(items: list[dict]) -> dict:
+    return {
+        "meta": {"requestId": "bench", "timestamp": 1_760_000_000},
+        "catalog": {
+            "filters": [{"key": f"f{k}", "label": f"Фильтр {k}", "values": list(range(30))} for k in range(40)],
+            "items": items,
+            "pager": {"page": 1, "pages": 100},
+        },
+        "banners": [{"code": f"b{k}", "payload": "x" * 200} for k in range(200)],
+    }
+
+
+def _markup(items: list[dict], blocks: int) -> str:
+    cards = "".join(
+        f'<div class="iva-item-root" data-marker="item" data-item-id="{it["id"]}">'
+        f'<a href="/moskva/tovary/obyavlenie_{it["id"]}" itemprop="url"><h3>{it["title"]}</h3></a>'
+        f'<span data-marker="item-price">{it["price"]["string"]}</span></div>'
+        for it in items
+    )
+    filler = "".join(
+        f'<div class="styles-module-root-{k}"><span class="text-{k % 7}">Категория {k}</span>'
+        f'<ul>{"".join(f"<li><a href=/moskva/cat{j}>Раздел {j}</a></li>" for j in range(5))}</ul></div>'
+        for k in range(blocks)
+    )
+    return f'<div class="items-items">{cards}</div>{filler}'
+
+
+def page_json_script(items: list[dict], blocks: int = 4000) -> str:
+    """State in <script type="application/json"> (first extraction path)."""
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Avito</title>"
+        "<script>window.dataLayer=[];</script></head><body>"
+        f"{_markup(items, blocks)}"
+        f'<script type="application/json" data-mfe-state="true">{json.dumps(_state(items), ensure_ascii=False)}</script>'
+        "</body></html>"
+    )
+
+
+def page_initial_data(items: list[dict], blocks: int = 4000, encoded: bool = False) -> str:
+    """State assigned to window.__initialData__ (plain object or URI-encoded string)."""
+    state = json.dumps(_state(items), ensure_ascii=False)
+    value = json.dumps(quote(state)) if encoded else state
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Avito</title></head><body>"
+        f"{_markup(items, blocks)}"
+        f"<script>window.__initialData__ = {value};</script>"
+        "</body></html>"
+    )
+
+
+def page_item_links(items: list[dict], blocks: int = 4000) -> str:
+    """No embedded state at all: only https://www.avito.ru/item/<id> links (last-resort path)."""
+    links = "".join(f'<a href="https://www.avito.ru/item/{it["id"]}">{it["title"]}</a>' for it in items)
+    return f"<!DOCTYPE html><html><body>{_markup([], blocks)}{links}</body></html>"
+
+
+def load_fixtures() -> dict[str, str]:
+    """name -> html: the generated pages plus any recorded pages in FIXTURES_DIR."""
+    items = make_items(4_000_000_000)
+    pages = {
+        "generated_json_script": page_json_script(items),
+        "generated_initial_data": page_initial_data(items),
+        "generated_initial_data_encoded": page_initial_data(items, encoded=True),
+        "generated_item_links": page_item_links(items),
+    }
+    for path in sorted(FIXTURES_DIR.glob("*.html")):
+        pages[path.stem] = path.read_text(encoding="utf-8", errors="replace")
+    return pages
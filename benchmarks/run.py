@@ -0,0 +1,66 @@
+"""
+Run the offline benchmarks and write the results as JSON.
+
+    python -m benchmarks.run --searches 2000 --urls 500 --cycles 3 --output bench_results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmarks import _env  # noqa: F401  (must precede app imports)
+from benchmarks import bench_cycle, bench_parse, bench_proxies
+from benchmarks.fixtures import load_fixtures
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--output", default="bench_results.json")
+    ap.add_argument("--repeat", type=int, default=20, help="parse runs per fixture")
+    ap.add_argument("--searches", type=int, default=2000)
+    ap.add_argument("--urls", type=int, default=500, help="distinct search URLs among the searches")
+    ap.add_argument("--cycles", type=int, default=3)
+    ap.add_argument("--new-per-cycle", type=int, default=2, help="new ads per page per cycle")
+    ap.add_argument("--skip-parse", action="store_true")
+    ap.add_argument("--skip-cycle", action="store_true")
+    ap.add_argument("--skip-proxies", action="store_true")
+    args = ap.parse_args()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        }
+    }
+    if not args.skip_parse:
+        results["parse"] = bench_parse.run(load_fixtures(), repeat=args.repeat)
+        for r in results["parse"]:
+            print(f"parse {r['fixture']}: {r['parse_ms_median']} ms, {r['ads']} ads, x{r['speedup_vs_legacy']} vs legacy")
+    if not args.skip_cycle:
+        results["cycle"] = bench_cycle.run(
+            searches=args.searches, urls=args.urls, cycles=args.cycles, new_per_cycle=args.new_per_cycle
+        )
+        for c in results["cycle"]["cycles"]:
+            print(f"cycle {c['cycle']}: {c['check_s']} s, {c['pages_fetched']} pages, {c['messages_sent']} messages")
+    if not args.skip_proxies:
+        results["proxies"] = bench_proxies.run()
+        for r in results["proxies"]["runs"]:
+            print(f"proxies {r['proxies']}: {r['ok_per_sec']} pages/s, {r['blocked']} blocked")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,4 +19,5 @@ $DCO up -d
 echo "=== Containers ==="
 $DCO ps
 echo "=== Logs (Ctrl+C to exit) ==="
-$DCO logs -f app
+$DCO logs init
+$DCO logs -f app worker
@@ -0,0 +1,32 @@
+"""Settings for the test run; set before anything from app/config reads the environment."""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix="avito-tests-")
+
+os.environ.update(
+    {
+        "BOT_TOKEN": "123456:test",
+        "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.sqlite')}",
+    }
+)
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+
+@pytest.fixture
+def db():
+    """Empty tables for one test."""
+    from app.database import async_engine, engine, init_db
+    from app.models import Base
+    from app.services.user_cache import user_searches, user_ids
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    user_ids.clear()
+    user_searches.clear()
+    yield
+    # Pooled aiosqlite connections belong to the event loop of the test that opened them
+    asyncio.run(async_engine.dispose())
@@ -0,0 +1,96 @@
+import asyncio
+from unittest import mock
+
+from sqlalchemy import select
+
+from app import catalog as catalog_module
+from app.catalog import AdCatalog
+from app.database import get_db
+from app.models import Ad, AdPrice
+from app.parser.avito import ParsedAd
+
+
+def _ad(ad_id: str, price: int | None) -> ParsedAd:
+    return ParsedAd(ad_id, f"Ad {ad_id}", price, f"https://www.avito.ru/{ad_id}")
+
+
+def _catalog() -> AdCatalog:
+    return AdCatalog(max_entries=100, refresh_seconds=3600)
+
+
+def _history() -> dict[str, list[int | None]]:
+    with get_db() as db:
+        rows = db.execute(select(AdPrice.avito_id, AdPrice.price).order_by(AdPrice.id)).all()
+    out: dict[str, list[int | None]] = {}
+    for avito_id, price in rows:
+        out.setdefault(avito_id, []).append(price)
+    return out
+
+
+async def _cycle(catalog: AdCatalog, ads: list[ParsedAd]):
+    changes = await catalog.compare(ads)
+    await catalog.save(changes)
+    return changes
+
+
+def test_new_ads_are_written_with_their_first_price(db):
+    async def run():
+        changes = await _cycle(_catalog(), [_ad("1", 1000), _ad("2", None)])
+        assert {ad.id for ad in changes.write} == changes.changed == {"1", "2"}
+        assert changes.drops == {}
+
+    asyncio.run(run())
+    assert _history() == {"1": [1000], "2": [None]}
+    with get_db() as db:
+        assert db.get(Ad, "1").title == "Ad 1"
+
+
+def test_unchanged_ads_are_answered_from_memory(db):
+    async def run():
+        catalog = _catalog()
+        await _cycle(catalog, [_ad("1", 1000)])
+        with mock.patch.object(catalog_module, "load_ad_prices_async") as load:
+            changes = await catalog.compare([_ad("1", 1000)])
+        load.assert_not_called()
+        assert (changes.write, changes.changed, changes.drops) == ([], set(), {})
+
+    asyncio.run(run())
+
+
+def test_price_drop_and_rise(db):
+    async def run():
+        catalog = _catalog()
+        await _cycle(catalog, [_ad("1", 1000), _ad("2", 1000), _ad("3", 1000)])
+        changes = await _cycle(catalog, [_ad("1", 800), _ad("2", 1200), _ad("3", None)])
+        # Only a lower price is a drop; an ad that lost its price is not
+        assert changes.drops == {"1": 1000}
+        assert changes.changed == {"1", "2", "3"}
+        assert (await catalog.compare([_ad("1", 800)])).drops == {}
+
+    asyncio.run(run())
+    assert _history() == {"1": [1000, 800], "2": [1000, 1200], "3": [1000, None]}
+
+
+def test_unsaved_drop_is_found_again(db):
+    """The caller saves only once the drop is in the outbox: a failed cycle must not lose it."""
+    async def run():
+        catalog = _catalog()
+        await _cycle(catalog, [_ad("1", 1000)])
+        assert (await catalog.compare([_ad("1", 900)])).drops == {"1": 1000}
+        assert (await catalog.compare([_ad("1", 900)])).drops == {"1": 1000}
+
+    asyncio.run(run())
+    assert _history() == {"1": [1000]}
+
+
+def test_drop_seen_by_another_worker_is_not_repeated(db):
+    async def run():
+        first, second = _catalog(), _catalog()
+        await _cycle(first, [_ad("1", 1000)])
+        await _cycle(second, [_ad("1", 1000)])
+        assert (await _cycle(first, [_ad("1", 900)])).drops == {"1": 1000}
+        # second still remembers 1000 but the DB already has 900
+        changes = await second.compare([_ad("1", 900)])
+        assert (changes.drops, changes.changed) == ({}, set())
+
+    asyncio.run(run())
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+from app.matching import PAGE_SIZE, AdMatcher
+from app.monitor import _within_price
+from app.parser.avito import ParsedAd
+
+BASE = "https://www.avito.ru/moskva/telefony?q=iphone&s=104"
+LAST_CHECK = datetime(2026, 1, 1)
+FETCHED = LAST_CHECK + timedelta(minutes=1)
+
+
+def _search(search_id: int, url: str, max_price: float, min_price: float | None = None) -> dict:
+    return {
+        "search_id": search_id,
+        "search_url": url,
+        "canonical_url": None,
+        "min_price": min_price,
+        "max_price": max_price,
+        "last_check_at": LAST_CHECK,
+    }
+
+
+def _ad(ad_id: str, title: str, price: int | None, published_at: datetime | None = None) -> ParsedAd:
+    return ParsedAd(ad_id, title, price, f"https://www.avito.ru/{ad_id}", published_at=published_at)
+
+
+WIDE = _search(1, BASE + "&maxPrice=100000", 100000.0)
+NARROW = _search(2, BASE + "&maxPrice=50000", 50000.0)
+PRICED_FROM = _search(3, BASE + "&minPrice=20000&maxPrice=50000", 50000.0, 20000.0)
+OTHER_QUERY = _search(4, "https://www.avito.ru/moskva/telefony?q=samsung&s=104&maxPrice=100000", 100000.0)
+OTHER_FAMILY = _search(5, "https://www.avito.ru/moskva/noutbuki?q=iphone&s=104&maxPrice=100000", 100000.0)
+ADS = [
+    _ad("1", "Смартфон", None),
+    _ad("2", "Apple phone", 30000),
+    _ad("3", "iPhone 13", 90000),
+    _ad("4", "Samsung Galaxy", 10000),
+]
+
+
+def _matcher(*searches: dict) -> AdMatcher:
+    matcher = AdMatcher(refresh_seconds=60)
+    matcher.load(list(searches))
+    return matcher
+
+
+def _matched(matcher: AdMatcher, pages) -> dict[int, list[str]]:
+    results, _ = matcher.match(pages, _within_price)
+    return {search["search_id"]: sorted(ad.id for ad in ads) for search, ads in results}
+
+
+def test_same_query_member_is_filtered_by_price_only():
+    matcher = _matcher(WIDE, NARROW, PRICED_FROM)
+    matched = _matched(matcher, [("p", [WIDE], ADS, FETCHED)])
+    # Ads without a price, or whose title lacks the query words, are kept as the search's own fetch would
+    assert matched == {1: ["1", "2", "3", "4"], 2: ["1", "2", "4"], 3: ["1", "2"]}
+
+
+def test_other_query_member_needs_the_words_in_the_title():
+    matcher = _matcher(WIDE, OTHER_QUERY)
+    assert _matched(matcher, [("p", [WIDE], ADS, FETCHED)]) == {1: ["1", "2", "3", "4"], 4: ["4"]}
+
+
+def test_index_maps_ads_to_searches():
+    matcher = _matcher(WIDE, NARROW, OTHER_FAMILY)
+    _, index = matcher.match([("p", [WIDE], ADS, FETCHED)], _within_price)
+    assert index["2"] == {1, 2}
+    assert index["3"] == {1}
+
+
+def test_narrower_search_is_covered_by_recorded_page():
+    matcher = _matcher(WIDE, NARROW, PRICED_FROM)
+    pages = [("p", [WIDE], ADS, FETCHED)]
+    matcher.match(pages, _within_price)
+    matcher.recorded(pages)
+    assert matcher.covered(NARROW)
+    assert matcher.covered(PRICED_FROM)
+    # Up to date with that page now: the same cover does not count twice
+    assert not matcher.covered(NARROW)
+
+
+def test_not_covered_by_other_query_wider_range_or_other_family():
+    matcher = _matcher(NARROW, WIDE, OTHER_QUERY, OTHER_FAMILY)
+    pages = [("p", [NARROW], ADS, FETCHED)]
+    matcher.recorded(pages)
+    assert not matcher.covered(WIDE)
+    assert not matcher.covered(OTHER_QUERY)
+    assert not matcher.covered(OTHER_FAMILY)
+
+
+def test_full_page_covers_only_back_to_its_oldest_ad():
+    def full_page(oldest: datetime):
+        ads = [_ad(str(i), "iPhone", 1000, oldest + timedelta(seconds=i)) for i in range(PAGE_SIZE)]
+        return [("p", [WIDE], ads, FETCHED)]
+
+    matcher = _matcher(WIDE, NARROW)
+    matcher.recorded(full_page(LAST_CHECK + timedelta(seconds=1)))
+    # Ads published between the last check and the oldest one on the page may be missing
+    assert not matcher.covered(NARROW)
+    matcher.recorded(full_page(LAST_CHECK - timedelta(seconds=1)))
+    assert matcher.covered(NARROW)
+
+
+def test_empty_page_covers_nothing():
+    matcher = _matcher(WIDE, NARROW)
+    matcher.recorded([("p", [WIDE], [], FETCHED)])
+    assert not matcher.covered(NARROW)
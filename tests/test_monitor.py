@@ -0,0 +1,96 @@
+"""PageChecker against a local stub Avito page that answers conditional requests."""
+import asyncio
+
+from aiohttp import web
+from sqlalchemy import func, select
+
+from app.database import get_async_db
+from app.models import OutboxMessage
+from app.monitor import PageChecker
+from app.parser.executor import ParseExecutor
+from app.parser.fetcher import AsyncFetcher
+from app.services import filter_unseen_ads_async
+from benchmarks.fixtures import make_items, page_json_script
+
+
+
+class StubPage:
+    """One search page with `ads` ads and an ETag per version; a request sending it back gets a 304."""
+
+    def __init__(self) -> None:
+        self.statuses: list[int] = []
+        self.publish(5)
+
+    def publish(self, ads: int) -> None:
+        self.html = page_json_script(make_items(1, ads), blocks=10)
+        self.etag = f'"v{ads}"'
+
+    async def handle(self, request: web.BaseRequest) -> web.Response:
+        if request.headers.get("If-None-Match") == self.etag:
+            self.statuses.append(304)
+            return web.Response(status=304)
+        self.statuses.append(200)
+        return web.Response(text=self.html, content_type="text/html", headers={"ETag": self.etag})
+
+
+class FlakySeen:
+    """filter_unseen() that fails `failures` times (e.g. the DB is down), then dedups for real."""
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+
+    async def filter_unseen(self, pairs, outbox=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        return await filter_unseen_ads_async(pairs, outbox)
+
+
+class Notifier:
+    def wake(self) -> None:
+        pass
+
+
+async def _outbox_count() -> int:
+    async with get_async_db() as db:
+        return await db.scalar(select(func.count()).select_from(OutboxMessage))
+
+
+def test_failed_record_does_not_trust_the_new_validators(db):
+    async def run():
+        page = StubPage()
+        runner = web.ServerRunner(web.Server(page.handle), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/search"
+        search = {
+            "search_id": 1, "telegram_id": 1, "search_url": url, "canonical_url": url,
+            "search_name": "test", "min_price": None, "max_price": 10**9, "last_check_at": None,
+        }
+        fetcher = AsyncFetcher()
+        seen = FlakySeen(failures=0)
+        checker = PageChecker(fetcher, ParseExecutor(), Notifier(), seen)
+        try:
+            await checker.check([search])
+            assert await _outbox_count() == 5
+            page.publish(8)
+            seen.failures = 1
+            try:
+                await checker.check([search])
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("the cycle should have failed")
+            assert await _outbox_count() == 5
+            # The page is fetched and parsed again, not answered with a 304 to the failed cycle's ETag
+            await checker.check([search])
+            assert page.statuses == [200, 200, 200]
+            assert await _outbox_count() == 8
+            await checker.check([search])
+            assert page.statuses == [200, 200, 200, 304]
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from app.database import get_async_db
+from app.models import OutboxMessage
+from app.notifier import KIND_NEW, KIND_PRICE_DROP
+from app.parser.avito import ParsedAd
+from app.services import (
+    add_outbox_async,
+    add_search_async,
+    claim_outbox_async,
+    filter_unseen_ads_async,
+    get_active_searches_async,
+    mark_outbox_sent_async,
+    outbox_row,
+)
+
+SEARCH_URL = "https://www.avito.ru/moskva/telefony?q=iphone&maxPrice=50000"
+
+
+async def _search() -> dict:
+    ok, message, _ = await add_search_async(1, SEARCH_URL, "iphone")
+    assert ok, message
+    (search,) = await get_active_searches_async()
+    return search
+
+
+async def _keys() -> list[str]:
+    async with get_async_db() as db:
+        return list((await db.execute(select(OutboxMessage.key).order_by(OutboxMessage.key))).scalars())
+
+
+def _ad(ad_id: str, price: int | None = 1000) -> ParsedAd:
+    return ParsedAd(ad_id, f"iPhone {ad_id}", price, f"https://www.avito.ru/{ad_id}")
+
+
+def test_same_notification_is_enqueued_once(db):
+    async def run():
+        search = await _search()
+        now = datetime.utcnow()
+        rows = [outbox_row(KIND_NEW, search, _ad("1"), None, now), outbox_row(KIND_NEW, search, _ad("2"), None, now)]
+        await add_outbox_async(rows)
+        await add_outbox_async(rows)
+        await add_outbox_async(rows[:1])
+        assert await _keys() == [f"new:{search['search_id']}:1", f"new:{search['search_id']}:2"]
+
+    asyncio.run(run())
+
+
+def test_price_drop_is_keyed_by_price(db):
+    async def run():
+        search = await _search()
+        now = datetime.utcnow()
+        await add_outbox_async([outbox_row(KIND_PRICE_DROP, search, _ad("1", 900), 1000, now)])
+        await add_outbox_async([outbox_row(KIND_PRICE_DROP, search, _ad("1", 900), 1000, now)])
+        await add_outbox_async([outbox_row(KIND_PRICE_DROP, search, _ad("1", 800), 900, now)])
+        assert len(await _keys()) == 2
+
+    asyncio.run(run())
+
+
+def test_sent_notification_is_not_enqueued_again(db):
+    async def run():
+        search = await _search()
+        row = outbox_row(KIND_NEW, search, _ad("1"), None, datetime.utcnow())
+        await add_outbox_async([row])
+        claimed = await claim_outbox_async("test", 10, 60)
+        assert [m.avito_id for m in claimed] == ["1"]
+        await mark_outbox_sent_async([m.id for m in claimed])
+        await add_outbox_async([row])
+        assert await claim_outbox_async("test", 10, 60) == []
+
+    asyncio.run(run())
+
+
+def test_dedup_writes_outbox_rows_for_new_pairs_only(db):
+    async def run():
+        search = await _search()
+        ads = {ad.id: ad for ad in (_ad("1"), _ad("2"))}
+
+        def outbox(new_pairs):
+            now = datetime.utcnow()
+            return [outbox_row(KIND_NEW, search, ads[ad_id], None, now) for _, ad_id in sorted(new_pairs)]
+
+        pairs = [(search["search_id"], ad_id) for ad_id in ads]
+        assert await filter_unseen_ads_async(pairs, outbox) == set(pairs)
+        # A retried cycle (or a second worker) with the same ads
+        assert await filter_unseen_ads_async(pairs, outbox) == set()
+        async with get_async_db() as db:
+            assert await db.scalar(select(func.count()).select_from(OutboxMessage)) == 2
+
+    asyncio.run(run())
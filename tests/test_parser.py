@@ -0,0 +1,52 @@
+from app.parser import avito
+from app.parser.avito import fingerprint_and_parse, parse_search_page
+from benchmarks.fixtures import make_items, page_initial_data, page_item_links, page_json_script
+
+# Markup around the state is irrelevant to the extractors; keep the pages small
+BLOCKS = 20
+
+
+def _items() -> list[dict]:
+    not_ad, relative, no_price = make_items(76, 3)
+    # Not an Avito id: dropped
+    not_ad["id"] = "abc"
+    # itemId wins over id; blank title; relative link without a slash
+    relative.update(itemId=77, id="card-77", title="  ", url="moskva/tovary/obyavlenie_77")
+    no_price["price"] = no_price["priceDetailed"] = {"string": "Цена не указана"}
+    return make_items(1, 20) + [not_ad, relative, no_price]
+
+
+def test_fast_extractor_matches_legacy_parser():
+    html = page_json_script(_items(), blocks=BLOCKS)
+    fast = avito._normalize_items(avito._extract_items_fast(html))
+    legacy = avito._normalize_items(avito._extract_json_from_script(html))
+    assert fast == legacy
+    assert [ad.id for ad in fast] == [str(i) for i in range(1, 21)] + ["77", "78"]
+    by_id = {ad.id: ad for ad in fast}
+    assert by_id["77"].title == "Без названия"
+    assert by_id["77"].url == "https://www.avito.ru/moskva/tovary/obyavlenie_77"
+    assert by_id["78"].price is None
+    assert isinstance(by_id["1"].price, int)
+    assert by_id["1"].published_at is not None
+
+
+def test_initial_data_pages_give_the_same_ads():
+    """__initialData__ (plain or URI-encoded) is only understood by the fast extractor."""
+    expected = parse_search_page(page_json_script(_items(), blocks=BLOCKS))
+    assert parse_search_page(page_initial_data(_items(), blocks=BLOCKS)) == expected
+    assert parse_search_page(page_initial_data(_items(), blocks=BLOCKS, encoded=True)) == expected
+
+
+def test_pages_without_state_fall_back_to_the_legacy_parser():
+    items = make_items(1, 5)
+    html = page_item_links(items, blocks=BLOCKS)
+    assert avito._extract_items_fast(html) == []
+    assert [ad.id for ad in parse_search_page(html)] == [str(it["id"]) for it in items]
+    # Nothing to fingerprint: the page is always parsed in full
+    fingerprint, ads = fingerprint_and_parse(html, known_fingerprint=None)
+    assert fingerprint is None
+    assert len(ads) == 5
+
+
+def test_page_without_ads():
+    assert parse_search_page("<html><body>Ничего не найдено</body></html>") == []
@@ -0,0 +1,84 @@
+import asyncio
+
+from sqlalchemy import select
+
+from config import settings
+from app.database import get_db
+from app.models import QuotaCounter, Search, User
+from app.services import add_search_async, delete_search_async
+from app.services.search import SEARCH_COUNTER
+
+URL = "https://www.avito.ru/moskva/telefony?q=iphone&maxPrice=50000"
+
+
+def _counts() -> tuple[dict[int, int], int | None]:
+    """search_count per telegram id and the server's search counter."""
+    with get_db() as db:
+        users = dict(db.execute(select(User.telegram_id, User.search_count)).all())
+        counter = db.execute(select(QuotaCounter.value).where(QuotaCounter.name == SEARCH_COUNTER)).scalar()
+    return users, counter
+
+
+async def _add(telegram_id: int) -> tuple[bool, str, int | None]:
+    return await add_search_async(telegram_id, URL, "iphone")
+
+
+def test_per_user_quota(db, monkeypatch):
+    monkeypatch.setattr(settings, "max_searches_per_user", 2)
+    monkeypatch.setattr(settings, "max_searches", 0)
+
+    async def run():
+        first, second = await _add(1), await _add(1)
+        assert first[0] and second[0]
+        ok, message, search_id = await _add(1)
+        assert (ok, search_id) == (False, None)
+        assert "максимум" in message
+        assert _counts() == ({1: 2}, 2)
+        # Another user has a quota of their own
+        assert (await _add(2))[0]
+        assert (await delete_search_async(1, first[2]))[0]
+        assert _counts() == ({1: 1, 2: 1}, 2)
+        assert (await _add(1))[0]
+
+    asyncio.run(run())
+
+
+def test_global_quota_releases_the_user_slot(db, monkeypatch):
+    monkeypatch.setattr(settings, "max_searches_per_user", 10)
+    monkeypatch.setattr(settings, "max_searches", 3)
+
+    async def run():
+        added = [await _add(telegram_id) for telegram_id in (1, 1, 2)]
+        assert all(ok for ok, _, _ in added)
+        ok, message, _ = await _add(2)
+        assert not ok
+        assert "на сервере" in message
+        # The user's slot taken before the global quota refused is given back
+        assert _counts() == ({1: 2, 2: 1}, 3)
+        with get_db() as db_session:
+            assert db_session.query(Search).count() == 3
+        # A deleted search frees its server slot
+        assert (await delete_search_async(1, added[0][2]))[0]
+        assert (await _add(2))[0]
+        assert _counts() == ({1: 1, 2: 2}, 3)
+
+    asyncio.run(run())
+
+
+def test_global_counter_starts_from_existing_searches(db, monkeypatch):
+    """A database made by init_db has searches but no counter row yet."""
+    monkeypatch.setattr(settings, "max_searches", 3)
+    with get_db() as db_session:
+        user = User(telegram_id=1, search_count=2)
+        db_session.add(user)
+        db_session.flush()
+        db_session.add_all(
+            [Search(user_id=user.id, search_url=URL, max_price=50000, name="old", is_active=True) for _ in range(2)]
+        )
+
+    async def run():
+        assert (await _add(2))[0]
+        assert _counts() == ({1: 2, 2: 1}, 3)
+        assert not (await _add(2))[0]
+
+    asyncio.run(run())
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+from app.parser.ratelimit import OUTCOME_BLOCKED, OUTCOME_OK, OUTCOME_TIMEOUT, TIMEOUTS_TO_OPEN, HostLimiter
+
+HOST = "www.avito.ru"
+
+
+def _limiter(**kwargs) -> HostLimiter:
+    options = {"initial_rate": 1000.0, "max_rate": 1000.0, "backoff_base": 0.05, "backoff_max": 1.0}
+    return HostLimiter(**{**options, **kwargs})
+
+
+def _backoff(limiter: HostLimiter) -> float:
+    return limiter._hosts[HOST].open_until - time.time()
+
+
+async def _expire(limiter: HostLimiter) -> None:
+    await asyncio.sleep(max(0.0, _backoff(limiter)) + 0.01)
+
+
+def test_block_opens_breaker_and_halves_rate():
+    async def run():
+        limiter = _limiter(initial_rate=10.0, max_rate=10.0)
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        assert limiter._hosts[HOST].rate == 5.0
+        assert not await limiter.acquire(HOST)
+        assert limiter.wait_time(HOST) == float("inf")
+
+    asyncio.run(run())
+
+
+def test_backoff_doubles_per_failed_probe():
+    async def run():
+        limiter = _limiter()
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        for failures in (1, 2, 3):
+            # Jittered within [base·2^(n-1) / 2, base·2^(n-1)]
+            assert 0.05 * 2 ** (failures - 1) / 2 - 0.01 <= _backoff(limiter) <= 0.05 * 2 ** (failures - 1)
+            await _expire(limiter)
+            assert await limiter.acquire(HOST)
+            limiter.record(HOST, OUTCOME_BLOCKED)
+        assert limiter._hosts[HOST].failures == 4
+
+    asyncio.run(run())
+
+
+def test_backoff_is_capped():
+    async def run():
+        limiter = _limiter(backoff_base=10.0, backoff_max=0.1)
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        assert _backoff(limiter) <= 0.1
+
+    asyncio.run(run())
+
+
+def test_half_open_lets_one_probe_through():
+    async def run():
+        limiter = _limiter()
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        await _expire(limiter)
+        assert await limiter.acquire(HOST)
+        # The probe is in flight: nothing else goes out
+        assert not await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_OK)
+        assert limiter._hosts[HOST].open_until == 0.0
+        assert limiter._hosts[HOST].failures == 0
+        assert await limiter.acquire(HOST)
+
+    asyncio.run(run())
+
+
+def test_abandoned_probe_can_be_retried():
+    async def run():
+        limiter = _limiter()
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        await _expire(limiter)
+        assert await limiter.acquire(HOST)
+        limiter.abandon(HOST)
+        assert await limiter.acquire(HOST)
+
+    asyncio.run(run())
+
+
+def test_in_flight_outcomes_do_not_escalate_backoff():
+    async def run():
+        limiter = _limiter()
+        for _ in range(3):
+            assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        open_until = limiter._hosts[HOST].open_until
+        # The two other requests were sent before the breaker opened
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        limiter.record(HOST, OUTCOME_OK)
+        state = limiter._hosts[HOST]
+        assert (state.failures, state.open_until) == (1, open_until)
+
+    asyncio.run(run())
+
+
+def test_timeouts_open_breaker_after_several_in_a_row():
+    async def run():
+        limiter = _limiter()
+        for _ in range(TIMEOUTS_TO_OPEN - 1):
+            assert await limiter.acquire(HOST)
+            limiter.record(HOST, OUTCOME_TIMEOUT)
+        assert limiter._hosts[HOST].open_until == 0.0
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_TIMEOUT)
+        assert not await limiter.acquire(HOST)
+
+    asyncio.run(run())
+
+
+def test_hosts_are_independent():
+    async def run():
+        limiter = _limiter()
+        assert await limiter.acquire(HOST)
+        limiter.record(HOST, OUTCOME_BLOCKED)
+        assert await limiter.acquire(f"{HOST}@proxy:3128")
+
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from config import settings
+from app.database import get_db
+from app.models import SeenAd
+from app.services import compact_seen_ads_async
+
+NOW = datetime.utcnow()
+OLD = NOW - timedelta(days=40)
+
+
+def _seen(search_id: int, ad_id: str, last_seen_at: datetime) -> SeenAd:
+    return SeenAd(search_id=search_id, avito_ad_id=ad_id, first_seen_at=last_seen_at, last_seen_at=last_seen_at)
+
+
+def _remaining() -> dict[int, set[str]]:
+    with get_db() as db:
+        rows = db.execute(select(SeenAd.search_id, SeenAd.avito_ad_id)).all()
+    out: dict[int, set[str]] = {}
+    for search_id, ad_id in rows:
+        out.setdefault(search_id, set()).add(ad_id)
+    return out
+
+
+def test_compaction_keeps_recent_rows_and_newest_per_search(db, monkeypatch):
+    monkeypatch.setattr(settings, "seen_retention_days", 30)
+    monkeypatch.setattr(settings, "seen_keep_per_search", 5)
+    # Smaller than what is deleted per search: several batches
+    monkeypatch.setattr(settings, "seen_compact_batch", 2)
+    with get_db() as db_session:
+        db_session.add_all(
+            # Search 1: ten rows past the window (old-9 the newest of them) and three recent ones
+            [_seen(1, f"old-{i}", OLD + timedelta(hours=i)) for i in range(10)]
+            + [_seen(1, f"new-{i}", NOW - timedelta(days=i)) for i in range(3)]
+            # Search 2: fewer rows than it keeps, all past the window
+            + [_seen(2, f"old-{i}", OLD) for i in range(3)]
+            # Search 3: equal times; the rows inserted last count as newest
+            + [_seen(3, f"old-{i}", OLD) for i in range(7)]
+        )
+
+    assert asyncio.run(compact_seen_ads_async()) == 8 + 2
+
+    remaining = _remaining()
+    assert remaining[1] == {"new-0", "new-1", "new-2", "old-8", "old-9"}
+    assert remaining[2] == {"old-0", "old-1", "old-2"}
+    assert remaining[3] == {f"old-{i}" for i in range(2, 7)}
+
+
+def test_compaction_without_old_rows_deletes_nothing(db):
+    with get_db() as db_session:
+        db_session.add_all([_seen(1, str(i), NOW) for i in range(3)])
+    assert asyncio.run(compact_seen_ads_async()) == 0
+    assert _remaining() == {1: {"0", "1", "2"}}
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app.database import get_db
+from app.models import Search
+from app.scheduling import CATCH_UP_FACTOR, DueQueue, LeaseQueue
+from app.services import add_search_async
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def _search(search_id: int, page: int, last_check_at: datetime | None = None, interval: int | None = None) -> dict:
+    return {
+        "search_id": search_id,
+        "canonical_url": f"https://www.avito.ru/moskva?p={page}",
+        "last_check_at": last_check_at,
+        "check_interval": interval,
+    }
+
+
+def _pages(batch: list[dict]) -> set[str]:
+    return {s["canonical_url"] for s in batch}
+
+
+def test_budget_spreads_pages_over_the_interval():
+    queue = DueQueue(tick_seconds=5, default_interval=60)
+    # 120 pages every 60 s, ticks of 5 s: 10 pages a tick
+    queue.load([_search(i, i, NOW - timedelta(seconds=60)) for i in range(120)], NOW)
+    assert queue.budget(NOW) == 10
+    assert len(queue.pop_due(NOW)) == 10
+    # Fewer pages than ticks still get one page a tick
+    queue.load([_search(1, 1)], NOW)
+    assert queue.budget(NOW) == 1
+
+
+def test_budget_grows_while_lagging():
+    queue = DueQueue(tick_seconds=5, default_interval=60)
+    queue.load([_search(i, i, NOW - timedelta(seconds=200)) for i in range(120)], NOW)
+    assert queue.lag(NOW) == 140
+    assert queue.budget(NOW) == 10 * CATCH_UP_FACTOR
+
+
+def test_page_is_handed_out_once_with_all_subscribers():
+    queue = DueQueue(tick_seconds=5, default_interval=60)
+    # Page 1 is due (search 1 was checked long ago), search 2 on the same page is not yet
+    queue.load(
+        [_search(1, 1, NOW - timedelta(seconds=90)), _search(2, 1, NOW - timedelta(seconds=10), interval=30),
+         _search(3, 2, NOW - timedelta(seconds=10))],
+        NOW,
+    )
+    assert {s["search_id"] for s in queue.pop_due(NOW)} == {1, 2}
+    # Rescheduled by the page's shortest interval; page 2 is due 50 s from now
+    assert queue.pop_due(NOW + timedelta(seconds=29)) == []
+    assert {s["search_id"] for s in queue.pop_due(NOW + timedelta(seconds=30))} == {1, 2}
+    assert _pages(queue.pop_due(NOW + timedelta(seconds=50))) == {"https://www.avito.ru/moskva?p=2"}
+
+
+def test_most_overdue_page_first():
+    queue = DueQueue(tick_seconds=5, default_interval=60)
+    queue.load([_search(i, i, NOW - timedelta(seconds=60 + i)) for i in range(12)], NOW)
+    assert queue.budget(NOW) == 1
+    assert [s["search_id"] for s in queue.pop_due(NOW)] == [11]
+    assert [s["search_id"] for s in queue.pop_due(NOW)] == [10]
+
+
+def test_reload_keeps_in_memory_schedule_unless_a_subscriber_is_new():
+    queue = DueQueue(tick_seconds=5, default_interval=60)
+    searches = [_search(1, 1, NOW - timedelta(seconds=60))]
+    queue.load(searches, NOW)
+    assert queue.pop_due(NOW)
+    # The DB has not caught up with the check yet: the page stays scheduled for NOW + 60
+    queue.load(searches, NOW + timedelta(seconds=1))
+    assert queue.pop_due(NOW + timedelta(seconds=1)) == []
+    # A new search on the page gets it right away
+    queue.load(searches + [_search(2, 1)], NOW + timedelta(seconds=2))
+    assert {s["search_id"] for s in queue.pop_due(NOW + timedelta(seconds=2))} == {1, 2}
+
+
+def test_next_batch_reloads_from_the_db(db):
+    async def run():
+        queue = DueQueue(tick_seconds=5, default_interval=60, refresh_seconds=30)
+        now = datetime.utcnow()
+        assert await queue.next_batch(now) == []
+        ok, _, search_id = await add_search_async(1, "https://www.avito.ru/moskva?q=iphone&maxPrice=100", "iphone")
+        assert ok
+        # Not reloaded before refresh_seconds
+        assert await queue.next_batch(now + timedelta(seconds=29)) == []
+        assert [s["search_id"] for s in await queue.next_batch(now + timedelta(seconds=30))] == [search_id]
+
+    asyncio.run(run())
+
+
+async def _add_pages(*subscribers: int) -> list[list[int]]:
+    """Search ids of pages with these numbers of subscribers, added in page order."""
+    pages = []
+    for page, count in enumerate(subscribers, start=1):
+        url = f"https://www.avito.ru/moskva?q=iphone&maxPrice={page * 1000}"
+        pages.append([(await add_search_async(telegram_id, url, "iphone"))[2] for telegram_id in range(count)])
+    return pages
+
+
+def _ids(batch: list[dict]) -> set[int]:
+    return {s["search_id"] for s in batch}
+
+
+def _lease(worker_id: str, batch_size: int = 10) -> LeaseQueue:
+    return LeaseQueue(worker_id, batch_size=batch_size, lease_seconds=60, default_interval=60)
+
+
+def test_workers_lease_whole_pages_without_overlap(db):
+    async def run():
+        first, second, third = await _add_pages(3, 1, 2)
+        a, b = _lease("a", batch_size=1), _lease("b", batch_size=2)
+        try:
+            # One search picks the page; all of its subscribers come along
+            assert _ids(await a.next_batch()) == set(first)
+            assert _ids(await b.next_batch()) == set(second) | set(third)
+            assert await a.next_batch() == []
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(run())
+
+
+def test_completed_searches_wait_for_their_interval(db):
+    async def run():
+        (page,) = await _add_pages(2)
+        a, b = _lease("a"), _lease("b")
+        try:
+            batch = await a.next_batch()
+            await a.complete(batch)
+            assert await b.next_batch() == []
+            with get_db() as db_session:
+                db_session.execute(update(Search).values(next_check_at=datetime.utcnow()))
+            assert _ids(await b.next_batch()) == set(page)
+        finally:
+            await a.close()
+            await b.close()
+
+    asyncio.run(run())
+
+
+def test_lease_cap_and_release_on_close(db):
+    async def run():
+        first, second = await _add_pages(2, 1)
+        a, b = _lease("a", batch_size=2), _lease("b")
+        try:
+            assert _ids(await a.next_batch()) == set(first)
+            # Full: the other page stays with the other workers
+            assert await a.next_batch() == []
+            assert _ids(await b.next_batch()) == set(second)
+            await a.close()
+            # Handed back due now
+            assert _ids(await b.next_batch()) == set(first)
+        finally:
+            await b.close()
+
+    asyncio.run(run())
+
+
+def test_expired_lease_is_taken_over(db):
+    async def run():
+        (page,) = await _add_pages(2)
+        a, b = _lease("a"), _lease("b")
+        try:
+            assert _ids(await a.next_batch()) == set(page)
+            assert await b.next_batch() == []
+            # Worker a died: its leases run out
+            with get_db() as db_session:
+                db_session.execute(update(Search).values(lease_until=datetime.utcnow() - timedelta(seconds=1)))
+            assert _ids(await b.next_batch()) == set(page)
+            # a's late completion does not touch b's leases
+            await a.complete([{"search_id": i} for i in page])
+            with get_db() as db_session:
+                assert {row.lease_owner for row in db_session.query(Search)} == {"b"}
+        finally:
+            await b.close()
+
+    asyncio.run(run())
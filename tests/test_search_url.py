@@ -0,0 +1,92 @@
+import base64
+import importlib.util
+import json
+
+from app.database import ROOT
+from app.search_url import decode_f_param, parse_search_url
+
+
+def _f(opaque: str, **fields) -> str:
+    """An Avito `f` parameter: opaque part, then the filter JSON in unpadded URL-safe base64."""
+    return f"{opaque}~" + base64.urlsafe_b64encode(json.dumps(fields).encode()).decode().rstrip("=")
+
+
+LINKS = [
+    "https://www.avito.ru/moskva/telefony?q=iphone&maxPrice=50000",
+    "http://avito.ru/moskva/telefony/?maxPrice=50000&q=iphone&utm_source=tg#top",
+    "https://m.avito.ru/rossiya?q=велосипед&minPrice=1 000&maxPrice=20 000,50",
+    f"https://www.avito.ru/sankt-peterburg/avtomobili/bmw?f={_f('ASgBAgICAUSGFMjmAQ', **{'from': 300000, 'to': 900000})}",
+    "https://www.avito.ru/moskva?q=iphone&s=104&max_price=100&min_price=abc",
+    "http://127.0.0.1:8080/search/3?maxPrice=10",
+]
+
+
+def test_canonical_link():
+    first, second = parse_search_url(LINKS[0]), parse_search_url(LINKS[1])
+    # Scheme, host, trailing slash, fragment, utm_* and parameter order do not matter
+    assert first.canonical == second.canonical == "https://www.avito.ru/moskva/telefony?maxPrice=50000&q=iphone"
+    # Other hosts keep scheme and port (a local stub)
+    assert parse_search_url(LINKS[5]).canonical == "http://127.0.0.1:8080/search/3?maxPrice=10"
+
+
+def test_prices_region_category_and_query():
+    link = parse_search_url(LINKS[2])
+    assert (link.min_price, link.max_price) == (1000.0, 20000.5)
+    assert (link.region, link.category) == ("rossiya", None)
+    assert link.words == ("велосипед",)
+    assert link.is_avito
+    link = parse_search_url(LINKS[4])
+    assert (link.min_price, link.max_price) == (None, 100.0)
+    assert link.sorted_by_date
+    link = parse_search_url(LINKS[5])
+    assert not link.is_avito
+    assert link.region is None
+
+
+def test_prices_from_filter_blob():
+    link = parse_search_url(LINKS[3])
+    assert link.filters == {"from": 300000, "to": 900000}
+    assert (link.min_price, link.max_price) == (300000.0, 900000.0)
+    assert (link.region, link.category) == ("sankt-peterburg", "avtomobili/bmw")
+    # Explicit parameters win over the blob
+    assert parse_search_url(LINKS[3] + "&maxPrice=500000").max_price == 500000.0
+
+
+def test_decode_f_param_ignores_garbage():
+    assert decode_f_param("") == {}
+    assert decode_f_param("ASgBAgICAUSGFMjmAQ") == {}
+    assert decode_f_param("x~eyJub3QganNvbg") == {}
+
+
+def test_family_ignores_price_text_and_sort():
+    base = "https://www.avito.ru/moskva/telefony?"
+    family = parse_search_url(base + "q=iphone&maxPrice=50000").family
+    assert parse_search_url(base + "q=samsung&s=104&minPrice=10&maxPrice=90000&p=2").family == family
+    assert parse_search_url(base + "maxPrice=50000&user=1").family != family
+    assert parse_search_url("https://www.avito.ru/moskva/noutbuki?maxPrice=50000").family != family
+    # The price JSON of `f` is ignored, its opaque part is not
+    cheap = parse_search_url(base + "f=" + _f("AAA", to=1000)).family
+    assert parse_search_url(base + "f=" + _f("AAA", to=9000)).family == cheap
+    assert parse_search_url(base + "f=" + _f("BBB", to=1000)).family != cheap
+
+
+def test_parse_is_cached():
+    assert parse_search_url(LINKS[0]) is parse_search_url(LINKS[0])
+
+
+def test_migration_009_parses_like_the_app():
+    """The backfill's frozen copy stores what parse_search_url stored when the revision was written."""
+    spec = importlib.util.spec_from_file_location(
+        "migration_009", ROOT / "alembic" / "versions" / "009_search_url_fields.py"
+    )
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    for url in LINKS:
+        link = parse_search_url(url)
+        assert migration._parse(url) == {
+            "canonical_url": link.canonical,
+            "min_price": link.min_price,
+            "filters": link.filters or None,
+            "region": link.region,
+            "category": link.category,
+        }
@@ -0,0 +1,68 @@
+import asyncio
+import random
+
+from app.seen_cache import BloomFilter, SeenCache
+from app.services import add_search_async, delete_search_async, filter_unseen_ads_async
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=100)
+    keys = [(random.randrange(1000), random.randrange(10**12)) for _ in range(1000)]
+    for key in keys:
+        bloom.add(*key)
+    assert all(key in bloom for key in keys)
+
+
+def test_seen_cache_reports_each_new_pair_once(db):
+    """
+    A saturated bloom filter and a memory cap that evicts almost everything force every path
+    (bloom miss, known, complete entry, cold load); the result must match a plain set.
+    """
+    async def run():
+        cache = SeenCache(max_bytes=600, bloom_capacity=16, refresh_seconds=0)
+        rng = random.Random(1)
+        seen: set[tuple[int, str]] = set()
+        for _ in range(40):
+            pairs = [(rng.randrange(1, 6), str(rng.randrange(1, 200))) for _ in range(30)]
+            if rng.random() < 0.1:
+                pairs.append((1, "not-numeric"))
+            expected = set(pairs) - seen
+            assert await cache.filter_unseen(pairs) == expected
+            seen.update(pairs)
+
+    asyncio.run(run())
+
+
+def test_seen_cache_defers_to_db(db):
+    """Ads another worker marked seen are not new, even where the cache still says so."""
+    async def run():
+        cache = SeenCache(max_bytes=2**20, bloom_capacity=1000)
+        assert await cache.filter_unseen([(1, "100"), (1, "101")]) == {(1, "100"), (1, "101")}
+        assert await filter_unseen_ads_async([(1, "102"), (2, "200")]) == {(1, "102"), (2, "200")}
+        assert await cache.filter_unseen([(1, "101"), (1, "102"), (1, "103"), (2, "200")]) == {(1, "103")}
+
+    asyncio.run(run())
+
+
+def test_seen_cache_reloads_evicted_searches(db):
+    async def run():
+        cache = SeenCache(max_bytes=1, bloom_capacity=1000)
+        assert await cache.filter_unseen([(1, "100")]) == {(1, "100")}
+        assert await cache.filter_unseen([(2, "200")]) == {(2, "200")}
+        assert 1 not in cache._searches
+        assert await cache.filter_unseen([(1, "100"), (1, "101")]) == {(1, "101")}
+
+    asyncio.run(run())
+
+
+def test_deleted_search_id_is_not_reused(db):
+    """Cache entries of a deleted search are never dropped; they must not apply to the next search."""
+    async def run():
+        url = "https://www.avito.ru/moskva/telefony?q=iphone&maxPrice=50000"
+        _, _, first = await add_search_async(1, url, "first")
+        _, _, second = await add_search_async(1, url, "second")
+        assert (await delete_search_async(1, second))[0]
+        _, _, third = await add_search_async(1, url, "third")
+        assert third not in (first, second)
+
+    asyncio.run(run())